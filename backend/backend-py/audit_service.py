@@ -13,11 +13,16 @@ Key Features:
 """
 
 import os
-import json
+import sys
 import time
+import atexit
+import socket
+import struct
 import hashlib
+import threading
+import orjson
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from enum import Enum
 
 
@@ -90,6 +95,247 @@ class AuditSeverity(Enum):
     CRITICAL = "CRITICAL"
 
 
+class StdoutAuditSink:
+    """Writes audit records to stdout as "[TAG] {json}" lines for CloudWatch Logs."""
+    
+    def _stream(self):
+        # Looked up per call so a redirected sys.stdout is honoured
+        return sys.stdout
+    
+    def emit(self, records: List[Tuple[str, bytes]]) -> None:
+        stream = self._stream()
+        stream.write("".join(f"[{tag}] {record.decode()}\n" for tag, record in records))
+        stream.flush()
+
+
+class StderrAuditSink(StdoutAuditSink):
+    """Same line format on stderr; last resort when the configured sink fails."""
+    
+    def _stream(self):
+        return sys.stderr
+
+
+class UnixSocketAuditSink:
+    """
+    Writes audit records to a Unix domain socket as length-prefixed frames
+    (4-byte big-endian length followed by the JSON record), for a sidecar
+    forwarder to ship on. Falls back to stdout if the socket is unavailable
+    (reported on stderr once per outage); errors from the fallback propagate
+    to the writer rather than being dropped.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._sock: Optional[socket.socket] = None
+        self._fallback = StdoutAuditSink()
+        self._degraded = False
+    
+    def emit(self, records: List[Tuple[str, bytes]]) -> None:
+        frames = b"".join(struct.pack(">I", len(record)) + record for _, record in records)
+        # One reconnect attempt covers a forwarder restart between batches
+        for _ in range(2):
+            try:
+                if self._sock is None:
+                    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    self._sock.connect(self.path)
+                self._sock.sendall(frames)
+                if self._degraded:
+                    self._degraded = False
+                    print(f"[AUDIT_SINK] Audit socket {self.path} reachable again", file=sys.stderr)
+                return
+            except OSError as e:
+                error = e
+                if self._sock is not None:
+                    self._sock.close()
+                self._sock = None
+        if not self._degraded:
+            # Reported once per outage rather than per batch
+            self._degraded = True
+            print(f"[AUDIT_SINK_ERROR] Audit socket {self.path} unavailable ({error}); "
+                  f"writing audit records to stdout", file=sys.stderr)
+        # Errors from the fallback propagate so the writer can handle them
+        self._fallback.emit(records)
+
+
+def _sink_from_env():
+    """
+    Select the audit sink from AUDIT_SINK ("stdout", the default, or
+    "binary" for framed records on the AUDIT_SINK_SOCKET Unix socket).
+    """
+    if os.environ.get("AUDIT_SINK", "stdout").lower() == "binary":
+        return UnixSocketAuditSink(os.environ.get("AUDIT_SINK_SOCKET", "/tmp/medusa-audit.sock"))
+    return StdoutAuditSink()
+
+
+class AuditLogWriter:
+    """
+    Buffered writer for audit log records.
+    
+    Records are collected in memory and handed to the sink in batches by a
+    background thread, so log_event does not pay for an I/O call per event.
+    The thread sleeps until a record arrives, then writes the batch
+    flush_interval seconds later, or sooner once batch_size records are
+    pending. flush() writes everything pending synchronously and
+    should be called before a Lambda invocation returns so no records are
+    left behind when the execution environment is frozen.
+    
+    Tamper evidence: every batch that contains audit events is followed by
+    an AUDIT_ROOT record whose root is BLAKE2b over the batch's event hashes,
+    keyed with the previous root. Individual events hash independently, so
+    log_event has no serial dependency between calls.
+    
+    If the sink raises, the batch is written to stderr instead; if that
+    fails too, the batch stays queued for the next flush. The root chain
+    only advances once a batch's root record has been written.
+    """
+    
+    def __init__(self, sink=None, batch_size: int = 64, flush_interval: float = 0.05):
+        self.sink = sink or StdoutAuditSink()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._records: List[Tuple[str, bytes]] = []
+        self._hashes: List[bytes] = []
+        self._last_root: Optional[str] = None
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+    
+    def write(self, tag: str, record: bytes, event_hash: Optional[str] = None) -> None:
+        """
+        Queue one record for output.
+        
+        Args:
+            tag: Record type, e.g. "AUDIT" (used as the stdout line prefix)
+            record: Serialized JSON record
+            event_hash: Hex event hash to commit in the next batch root
+        """
+        with self._cond:
+            self._records.append((tag, record))
+            if event_hash:
+                self._hashes.append(bytes.fromhex(event_hash))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="audit-log-writer", daemon=True
+                )
+                self._thread.start()
+            # Wake the thread to start a batch, or to write a full one early
+            if len(self._records) == 1 or len(self._records) >= self.batch_size:
+                self._cond.notify()
+    
+    def flush(self) -> None:
+        """Write all pending records now."""
+        with self._cond:
+            self._emit_pending()
+    
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                # Idle until there is work, so a quiet container takes no wakeups
+                while not self._records:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.flush_interval
+                while self._records and len(self._records) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(timeout=remaining)
+                self._emit_pending()
+                if self._records:
+                    # Both sinks failed; back off before retrying the batch
+                    self._cond.wait(timeout=self.flush_interval)
+    
+    def _emit_pending(self) -> None:
+        # Caller must hold self._cond; emitting under the lock keeps record order
+        if not self._records:
+            return
+        records, self._records = self._records, []
+        hashes, self._hashes = self._hashes, []
+        batch, root = records, None
+        if hashes:
+            root, root_record = self._batch_root(hashes)
+            batch = records + [("AUDIT_ROOT", root_record)]
+        try:
+            self.sink.emit(batch)
+        except Exception as e:
+            try:
+                print(f"[AUDIT_SINK_ERROR] {type(self.sink).__name__} failed ({e}); "
+                      f"writing {len(batch)} records to stderr", file=sys.stderr)
+                _STDERR_SINK.emit(batch)
+            except Exception:
+                # Nothing was written: keep the batch (and the root chain)
+                # for the next flush
+                self._records = records + self._records
+                self._hashes = hashes + self._hashes
+                return
+        # The chain only advances once its root has actually been written
+        if root is not None:
+            self._last_root = root
+    
+    def _batch_root(self, hashes: List[bytes]) -> Tuple[str, bytes]:
+        # Caller must hold self._cond
+        prev_root = self._last_root
+        root = hashlib.blake2b(
+            b"".join(hashes),
+            digest_size=16,
+            key=bytes.fromhex(prev_root) if prev_root else b""
+        ).hexdigest()
+        return root, orjson.dumps({
+            "log_type": "AUDIT_ROOT",
+            "root": root,
+            "prevRoot": prev_root,
+            "count": len(hashes),
+        })
+
+
+_STDERR_SINK = StderrAuditSink()
+
+
+# Unix epoch, used to build timestamps from time.time_ns() without float math
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Audit log retention before DynamoDB TTL cleanup (90 days)
+AUDIT_RETENTION_SECONDS = 90 * 24 * 3600
+
+# Enum member -> string value, resolved once instead of per log_event call
+_SEVERITY_VALUES: Dict[AuditSeverity, str] = {s: s.value for s in AuditSeverity}
+
+# Canonical instances of the short strings callers pass per event (outcome,
+# role, resource type). Values arriving from request data or JWT claims are
+# fresh objects; swapping them for the interned copy lets every retained
+# entry share one string and keeps dict/string comparisons on the identity
+# fast path.
+_SHARED_STRINGS: Dict[str, str] = {
+    v: v for v in map(sys.intern, (
+        "success", "failure", "denied",
+        "admin", "doctor", "patient",
+        "device", "session", "user", "firmware",
+    ))
+}
+
+
+# db.put_audit_log, imported on first use (db needs table configuration that
+# is not present everywhere audit_service is imported, e.g. unit tests)
+_put_audit_log = None
+_audit_store_resolved = False
+
+
+def _resolve_audit_store():
+    """
+    Resolve the audit log storage function once per process.
+    
+    A failed import is remembered too, so an unavailable db module costs one
+    import attempt rather than one per logged event.
+    """
+    global _put_audit_log, _audit_store_resolved
+    if not _audit_store_resolved:
+        _audit_store_resolved = True
+        try:
+            import db
+            _put_audit_log = db.put_audit_log
+        except Exception as e:
+            print(f"[AUDIT_STORE_ERROR] Audit log storage unavailable: {e}")
+    return _put_audit_log
+
+
 class AuditService:
     """
     Centralized audit logging service for MeDUSA platform.
@@ -98,7 +344,7 @@ class AuditService:
     - Consistent JSON format for CloudWatch Logs Insights
     - PII protection through data masking
     - Event correlation via request IDs
-    - Tamper-evident timestamps with hash chains
+    - Tamper-evident timestamps with per-batch hash roots
     """
     
     # Fields that should be masked for PII protection
@@ -114,6 +360,28 @@ class AuditService:
         'phone': (0, 4),  # Show last 4 digits
     }
     
+    # Every (lowercased) key that triggers full or partial masking
+    _ALL_MASK_KEYS = frozenset(SENSITIVE_FIELDS | PARTIAL_MASK_FIELDS.keys())
+    
+    # Non-default severities per event type (everything else is INFO)
+    _SEVERITY_MAP: Dict[AuditEventType, AuditSeverity] = {
+        # Critical severity events
+        AuditEventType.AUTHZ_ROLE_ESCALATION_ATTEMPT: AuditSeverity.CRITICAL,
+        AuditEventType.SECURITY_SUSPICIOUS_ACTIVITY: AuditSeverity.CRITICAL,
+        
+        # Error severity events
+        AuditEventType.AUTH_LOGIN_FAILURE: AuditSeverity.ERROR,
+        AuditEventType.AUTH_MFA_FAILURE: AuditSeverity.ERROR,
+        AuditEventType.AUTHZ_ACCESS_DENIED: AuditSeverity.ERROR,
+        AuditEventType.SECURITY_INVALID_TOKEN: AuditSeverity.ERROR,
+        AuditEventType.SYSTEM_ERROR: AuditSeverity.ERROR,
+        
+        # Warning severity events
+        AuditEventType.SECURITY_RATE_LIMIT_EXCEEDED: AuditSeverity.WARNING,
+        AuditEventType.DATA_DELETE: AuditSeverity.WARNING,
+        AuditEventType.DEVICE_UNBIND: AuditSeverity.WARNING,
+    }
+    
     def __init__(self, service_name: str = "medusa-api"):
         """
         Initialize the audit service.
@@ -123,61 +391,119 @@ class AuditService:
         """
         self.service_name = service_name
         self.environment = os.environ.get("ENVIRONMENT", "production")
-        self._last_hash = None
+        
+        # Per event type, the fields that are identical on every entry of that
+        # type from this service instance (severity is the automatic default)
+        self._event_templates: Dict[AuditEventType, Dict[str, str]] = {
+            event_type: {
+                "log_type": "AUDIT",
+                "service": self.service_name,
+                "environment": self.environment,
+                "eventType": event_type.value,
+                "severity": self._get_severity_for_event(event_type).value,
+            }
+            for event_type in AuditEventType
+        }
+    
+    def _needs_masking(self, data: Dict[str, Any]) -> bool:
+        """
+        Check whether data (including nested dictionaries) has any key
+        that would be masked.
+        
+        Args:
+            data: Dictionary to scan
+            
+        Returns:
+            True if at least one key needs masking
+        """
+        stack = [data]
+        while stack:
+            current = stack.pop()
+            for key, value in current.items():
+                if isinstance(key, str) and key.lower() in self._ALL_MASK_KEYS:
+                    return True
+                if isinstance(value, dict):
+                    stack.append(value)
+        return False
     
     def _mask_sensitive_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Mask sensitive data fields to protect PII.
         
+        Data without any sensitive keys is returned as-is (no copy).
+        Nested dictionaries are walked with an explicit stack.
+        
         Args:
             data: Dictionary containing potentially sensitive data
             
         Returns:
             Dictionary with sensitive fields masked
         """
-        if not data:
+        if not data or not self._needs_masking(data):
             return data
-            
-        masked = {}
-        for key, value in data.items():
-            key_lower = key.lower()
-            
-            # Full masking for highly sensitive fields
-            if key_lower in self.SENSITIVE_FIELDS:
-                masked[key] = "***REDACTED***"
-            # Partial masking for identifiable fields
-            elif key_lower in self.PARTIAL_MASK_FIELDS and isinstance(value, str):
-                start_show, end_show = self.PARTIAL_MASK_FIELDS[key_lower]
-                if len(value) > start_show + end_show:
-                    masked[key] = value[:start_show] + "***" + value[-end_show:]
-                else:
-                    masked[key] = "***"
-            # Recursive masking for nested dictionaries
-            elif isinstance(value, dict):
-                masked[key] = self._mask_sensitive_data(value)
-            else:
-                masked[key] = value
+        
+        masked: Dict[str, Any] = {}
+        stack = [(data, masked)]
+        while stack:
+            source, target = stack.pop()
+            for key, value in source.items():
+                key_lower = key.lower() if isinstance(key, str) else key
                 
+                # Full masking for highly sensitive fields
+                if key_lower in self.SENSITIVE_FIELDS:
+                    target[key] = "***REDACTED***"
+                # Partial masking for identifiable fields
+                elif key_lower in self.PARTIAL_MASK_FIELDS and isinstance(value, str):
+                    start_show, end_show = self.PARTIAL_MASK_FIELDS[key_lower]
+                    if len(value) > start_show + end_show:
+                        target[key] = value[:start_show] + "***" + value[-end_show:]
+                    else:
+                        target[key] = "***"
+                # Nested dictionaries are masked on a later iteration
+                elif isinstance(value, dict):
+                    nested: Dict[str, Any] = {}
+                    target[key] = nested
+                    stack.append((value, nested))
+                else:
+                    target[key] = value
+        
         return masked
     
-    def _generate_event_hash(self, event_data: Dict[str, Any]) -> str:
+    def _serialize_entry(self, entry: Dict[str, Any]) -> bytes:
         """
-        Generate a hash for event integrity verification.
-        Creates a chain with previous hash for tamper evidence.
+        Serialize an audit entry to JSON bytes.
+        
+        Keys are emitted in insertion order rather than sorted. log_event
+        always builds entries with the same field layout, so the output is
+        deterministic without paying for a key sort; anyone re-deriving the
+        hash must serialize the fields in that same order.
         
         Args:
-            event_data: The event data to hash
+            entry: The audit entry to serialize
             
         Returns:
-            SHA-256 hash string
+            UTF-8 encoded JSON bytes
+        """
+        return orjson.dumps(
+            entry,
+            # Non-str keys (e.g. ints in details) are stringified, as json did
+            option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS,
+            default=str
+        )
+    
+    def _generate_event_hash(self, payload: bytes) -> str:
         """
-        hash_input = json.dumps(event_data, sort_keys=True, default=str)
-        if self._last_hash:
-            hash_input = self._last_hash + hash_input
+        Generate a hash for event integrity verification.
+        The hash covers this event only; ordering and completeness are
+        committed by the batch roots emitted by AuditLogWriter.
         
-        event_hash = hashlib.sha256(hash_input.encode()).hexdigest()[:16]
-        self._last_hash = event_hash
-        return event_hash
+        Args:
+            payload: Serialized event data (see _serialize_entry)
+            
+        Returns:
+            BLAKE2b (64-bit digest) hex string
+        """
+        return hashlib.blake2b(payload, digest_size=8).hexdigest()
     
     def _get_severity_for_event(self, event_type: AuditEventType) -> AuditSeverity:
         """
@@ -189,36 +515,7 @@ class AuditService:
         Returns:
             Appropriate severity level
         """
-        # Critical severity events
-        critical_events = {
-            AuditEventType.AUTHZ_ROLE_ESCALATION_ATTEMPT,
-            AuditEventType.SECURITY_SUSPICIOUS_ACTIVITY,
-        }
-        
-        # Error severity events
-        error_events = {
-            AuditEventType.AUTH_LOGIN_FAILURE,
-            AuditEventType.AUTH_MFA_FAILURE,
-            AuditEventType.AUTHZ_ACCESS_DENIED,
-            AuditEventType.SECURITY_INVALID_TOKEN,
-            AuditEventType.SYSTEM_ERROR,
-        }
-        
-        # Warning severity events
-        warning_events = {
-            AuditEventType.SECURITY_RATE_LIMIT_EXCEEDED,
-            AuditEventType.DATA_DELETE,
-            AuditEventType.DEVICE_UNBIND,
-        }
-        
-        if event_type in critical_events:
-            return AuditSeverity.CRITICAL
-        elif event_type in error_events:
-            return AuditSeverity.ERROR
-        elif event_type in warning_events:
-            return AuditSeverity.WARNING
-        else:
-            return AuditSeverity.INFO
+        return self._SEVERITY_MAP.get(event_type, AuditSeverity.INFO)
     
     def log_event(
         self,
@@ -255,43 +552,34 @@ class AuditService:
         Returns:
             The complete audit log entry
         """
-        # Generate timestamp with microsecond precision
-        timestamp = datetime.now(timezone.utc)
-        
-        # Determine severity
-        if severity is None:
-            severity = self._get_severity_for_event(event_type)
+        # Generate timestamp with microsecond precision from a single clock read
+        now_ns = time.time_ns()
+        timestamp_iso = (_EPOCH + timedelta(microseconds=now_ns // 1000)).isoformat()
         
         # Generate unique log ID
-        log_id = f"LOG#{timestamp.isoformat()}#{hashlib.sha256(str(time.time_ns()).encode()).hexdigest()[:8]}"
+        log_id = f"LOG#{timestamp_iso}#{hashlib.sha256(str(now_ns).encode()).hexdigest()[:8]}"
         
         # Build the audit entry for DynamoDB storage
         audit_entry = {
             # DynamoDB keys
             "pk": "AUDIT#ALL",  # Partition key for global queries
-            "sk": timestamp.isoformat(),  # Sort key for time-based ordering
+            "sk": timestamp_iso,  # Sort key for time-based ordering
             "logId": log_id,
             
-            # Event identification
-            "log_type": "AUDIT",
-            "service": self.service_name,
-            "environment": self.environment,
-            "timestamp": timestamp.isoformat(),
-            "timestamp_unix": int(timestamp.timestamp() * 1000),  # Milliseconds
-            
-            # Event classification - flattened for GSI
-            "eventType": event_type.value,
-            "severity": severity.value,
-            "outcome": outcome,
+            # Event identification and classification (flattened for GSI)
+            **self._event_templates[event_type],
+            "timestamp": timestamp_iso,
+            "timestamp_unix": now_ns // 1_000_000,  # Milliseconds
+            "outcome": _SHARED_STRINGS.get(outcome, outcome),
             
             # Actor information - flattened for GSI
             "userId": user_id,
-            "userRole": user_role,
+            "userRole": _SHARED_STRINGS.get(user_role, user_role),
             "ipAddress": ip_address,
             "userAgent": user_agent,
             
             # Resource information
-            "resourceType": resource_type,
+            "resourceType": _SHARED_STRINGS.get(resource_type, resource_type),
             "resourceId": resource_id,
             
             # Action details
@@ -302,22 +590,30 @@ class AuditService:
             "requestId": request_id,
             
             # TTL for automatic cleanup (90 days retention)
-            "ttl": int((timestamp + timedelta(days=90)).timestamp())
+            "ttl": now_ns // 1_000_000_000 + AUDIT_RETENTION_SECONDS
         }
         
+        # Explicit severity overrides the event type's default
+        if severity is not None:
+            audit_entry["severity"] = _SEVERITY_VALUES[severity]
+        
         # Add event hash for integrity verification
-        audit_entry["event_hash"] = self._generate_event_hash(audit_entry)
+        payload = self._serialize_entry(audit_entry)
+        event_hash = self._generate_event_hash(payload)
+        audit_entry["event_hash"] = event_hash
         
         # Store in DynamoDB
-        try:
-            import db
-            db.put_audit_log(audit_entry)
-        except Exception as e:
-            print(f"[AUDIT_STORE_ERROR] Failed to store audit log: {e}")
+        put_audit_log = _resolve_audit_store()
+        if put_audit_log is not None:
+            try:
+                put_audit_log(audit_entry)
+            except Exception as e:
+                print(f"[AUDIT_STORE_ERROR] Failed to store audit log: {e}")
         
-        # Also output to CloudWatch for real-time monitoring
-        log_line = json.dumps(audit_entry, default=str)
-        print(f"[AUDIT] {log_line}")
+        # Also output to CloudWatch for real-time monitoring. Reuse the hashed
+        # payload and splice the hash in rather than serializing again.
+        record = payload[:-1] + b',"event_hash":"' + event_hash.encode() + b'"}'
+        audit_log_writer.write("AUDIT", record, event_hash)
         
         return audit_entry
     
@@ -475,6 +771,10 @@ class AuditService:
         )
 
 
+# Global audit log writer (flushed on interpreter exit and per Lambda invocation)
+audit_log_writer = AuditLogWriter(sink=_sink_from_env())
+atexit.register(audit_log_writer.flush)
+
 # Global audit service instance
 audit_service = AuditService()
 
@@ -1,9 +1,10 @@
-import os, time, jwt, pyotp
+import os, time, hmac, base64, hashlib, functools, threading, orjson, pyotp
+from collections import OrderedDict
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
-from fastapi import Request, HTTPException
+from fastapi import HTTPException
 from fastapi.responses import JSONResponse
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
 
 # Security: JWT_SECRET must be set in environment - no fallback for production safety
 JWT_SECRET = os.environ.get("JWT_SECRET")
@@ -12,6 +13,8 @@ if not JWT_SECRET:
 JWT_EXPIRE_SECONDS = int(os.environ.get("JWT_EXPIRE_SECONDS", "3600"))
 REFRESH_TTL_SECONDS = int(os.environ.get("REFRESH_TTL_SECONDS", str(7*24*3600)))
 MFA_TEMP_TOKEN_SECONDS = 300  # 5 minutes for MFA challenge
+JWT_CACHE_TTL_SECONDS = 60  # Max time a verified token is trusted without re-checking
+JWT_CACHE_MAX_ENTRIES = 10_000
 
 # Initialize Argon2id hasher
 ph = PasswordHasher()
@@ -25,22 +28,89 @@ def verify_pw(pw: str, hashed: str) -> bool:
     except (VerifyMismatchError, Exception):
         return False
 
+# ========== JWT (HS256) Encoding ==========
+
+class TokenError(Exception):
+    """Raised when a JWT is malformed or its signature does not verify."""
+
+class TokenExpiredError(TokenError):
+    """Raised when a JWT's exp claim has passed."""
+
+# Keyed HMAC-SHA256 context primed once; each signature works on a copy so the
+# key schedule is not recomputed per token
+_JWT_HMAC = hmac.new(JWT_SECRET.encode(), digestmod=hashlib.sha256)
+# base64url({"alg":"HS256","typ":"JWT"}) - the only header this service issues
+_JWT_HEADER_B64 = b"eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9"
+
+def _b64url_encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+def _b64url_decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+def _jwt_sign(signing_input: bytes) -> bytes:
+    mac = _JWT_HMAC.copy()
+    mac.update(signing_input)
+    return mac.digest()
+
+def _jwt_encode_json(payload_json: bytes) -> str:
+    """Sign already-serialized claims as a compact HS256 JWT."""
+    signing_input = _JWT_HEADER_B64 + b"." + _b64url_encode(payload_json)
+    return (signing_input + b"." + _b64url_encode(_jwt_sign(signing_input))).decode()
+
+def _jwt_encode_hs256(payload: Dict[str, Any]) -> str:
+    """Encode and sign claims as a compact HS256 JWT."""
+    return _jwt_encode_json(orjson.dumps(payload))
+
+def _jwt_decode_hs256(token: str) -> Dict[str, Any]:
+    """
+    Verify an HS256 JWT and return its claims.
+    Raises TokenExpiredError if exp has passed, TokenError for anything else invalid.
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.encode().split(b".")
+        header = orjson.loads(_b64url_decode(header_b64))
+        signature = _b64url_decode(signature_b64)
+    except Exception:
+        raise TokenError("malformed token")
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        raise TokenError("unsupported algorithm")
+    if not hmac.compare_digest(signature, _jwt_sign(header_b64 + b"." + payload_b64)):
+        raise TokenError("signature verification failed")
+    try:
+        claims = orjson.loads(_b64url_decode(payload_b64))
+    except Exception:
+        raise TokenError("malformed payload")
+    if not isinstance(claims, dict):
+        raise TokenError("malformed payload")
+    if "exp" in claims:
+        exp = claims["exp"]
+        if not isinstance(exp, int) or isinstance(exp, bool):
+            raise TokenError("exp must be an integer")
+        if exp <= int(time.time()):
+            raise TokenExpiredError("token expired")
+    return claims
+
 # ========== MFA (TOTP) Functions ==========
 
 def generate_mfa_secret() -> str:
     """Generate a new TOTP secret for MFA setup."""
     return pyotp.random_base32()
 
+@functools.lru_cache(maxsize=2048)
+def _totp_for(secret: str) -> pyotp.TOTP:
+    """Shared TOTP instance per secret (TOTP objects are stateless)."""
+    return pyotp.TOTP(secret)
+
 def verify_mfa_code(secret: str, code: str) -> bool:
     """Verify a TOTP code against the user's MFA secret."""
     if not secret or not code:
         return False
-    totp = pyotp.TOTP(secret)
-    return totp.verify(code, valid_window=1)  # Allow 1 period tolerance
+    return _totp_for(secret).verify(code, valid_window=1)  # Allow 1 period tolerance
 
 def get_mfa_provisioning_uri(email: str, secret: str) -> str:
     """Get the provisioning URI for QR code generation."""
-    return pyotp.TOTP(secret).provisioning_uri(name=email, issuer_name="MeDUSA")
+    return _totp_for(secret).provisioning_uri(name=email, issuer_name="MeDUSA")
 
 def issue_temp_token(sub: str, role: str) -> str:
     """
@@ -48,19 +118,18 @@ def issue_temp_token(sub: str, role: str) -> str:
     This token can only be used to complete MFA verification.
     """
     now = int(time.time())
-    return jwt.encode(
-        {"sub": sub, "role": role, "exp": now + MFA_TEMP_TOKEN_SECONDS, "scope": "mfa_pending"},
-        JWT_SECRET, algorithm="HS256"
+    return _jwt_encode_hs256(
+        {"sub": sub, "role": role, "exp": now + MFA_TEMP_TOKEN_SECONDS, "scope": "mfa_pending"}
     )
 
 def verify_temp_token(token: str) -> Dict[str, Any]:
     """Verify a temporary MFA token and check scope."""
     try:
-        claims = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        claims = _jwt_decode_hs256(token)
         if claims.get("scope") != "mfa_pending":
             raise HTTPException(status_code=401, detail={"code": "AUTH_INVALID", "message": "invalid token scope"})
         return claims
-    except jwt.ExpiredSignatureError:
+    except TokenExpiredError:
         raise HTTPException(status_code=401, detail={"code": "AUTH_EXPIRED", "message": "MFA token expired"})
     except Exception:
         raise HTTPException(status_code=401, detail={"code": "AUTH_INVALID", "message": "invalid MFA token"})
@@ -73,13 +142,12 @@ def issue_tokens(sub: str, role: str) -> Dict[str, Any]:
     Returns dict with camelCase keys to match API v3 Documentation
     """
     now = int(time.time())
-    access = jwt.encode(
-        {"sub": sub, "role": role, "exp": now + JWT_EXPIRE_SECONDS},
-        JWT_SECRET, algorithm="HS256"
-    )
-    refresh = jwt.encode(
-        {"sub": sub, "role": role, "exp": now + REFRESH_TTL_SECONDS, "typ": "refresh"},
-        JWT_SECRET, algorithm="HS256"
+    # Both tokens share sub/role: serialize them once and append the
+    # per-token integer/constant claims to the open JSON object
+    claims_prefix = orjson.dumps({"sub": sub, "role": role})[:-1]
+    access = _jwt_encode_json(claims_prefix + b',"exp":%d}' % (now + JWT_EXPIRE_SECONDS))
+    refresh = _jwt_encode_json(
+        claims_prefix + b',"exp":%d,"typ":"refresh"}' % (now + REFRESH_TTL_SECONDS)
     )
     # API v3 uses camelCase: accessJwt, refreshToken, expiresIn
     return {
@@ -88,10 +156,33 @@ def issue_tokens(sub: str, role: str) -> Dict[str, Any]:
         "expiresIn": JWT_EXPIRE_SECONDS
     }
 
+# Verified access token claims, keyed by a digest of the raw token, in LRU
+# order. Values are (claims, cached_until) where cached_until never exceeds the
+# token's exp. Only tokens that verified are stored, so junk tokens can't
+# displace them, and tokens in use stay ahead of ones that went quiet.
+_jwt_cache: "OrderedDict[bytes, Tuple[Dict[str, Any], int]]" = OrderedDict()
+_jwt_cache_lock = threading.Lock()
+
 def verify_jwt(token: str) -> Dict[str, Any]:
+    now = int(time.time())
+    cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(cache_key)
+        if cached is not None:
+            if now < cached[1]:
+                _jwt_cache.move_to_end(cache_key)
+                return dict(cached[0])
+            del _jwt_cache[cache_key]
     try:
-        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-    except jwt.ExpiredSignatureError:
+        claims = _jwt_decode_hs256(token)
+        entry = (claims, min(int(claims.get("exp", now)), now + JWT_CACHE_TTL_SECONDS))
+        with _jwt_cache_lock:
+            _jwt_cache[cache_key] = entry
+            if len(_jwt_cache) > JWT_CACHE_MAX_ENTRIES:
+                # Evict the least recently used entry
+                _jwt_cache.popitem(last=False)
+        return dict(claims)
+    except TokenExpiredError:
         raise HTTPException(status_code=401, detail={"code":"AUTH_EXPIRED","message":"token expired"})
     except Exception:
         raise HTTPException(status_code=401, detail={"code":"AUTH_INVALID","message":"invalid token"})
@@ -111,17 +202,48 @@ OPEN_PATH_SUFFIXES = [
     "/security/nonce"    # Nonce endpoint for replay protection
 ]
 
-async def auth_middleware(request: Request, call_next):
-    # Allow all OPTIONS requests for CORS preflight
-    if request.method == "OPTIONS":
-        return await call_next(request)
-    
-    path = request.url.path
-    if any(path.endswith(suf) for suf in OPEN_PATH_SUFFIXES):
-        return await call_next(request)
-    bearer = request.headers.get("Authorization", "")
-    if not bearer.startswith("Bearer "):
-        return JSONResponse(status_code=401, content={"code":"AUTH_REQUIRED","message":"missing bearer token"})
-    claims = verify_jwt(bearer.removeprefix("Bearer ").strip())
-    request.state.claims = claims
-    return await call_next(request)
+# Open suffixes grouped by their final path segment (e.g. "/login" ->
+# ("/auth/login", "/auth/mfa/login")), so a request only compares against the
+# few suffixes that share its last segment instead of the whole list
+_OPEN_PATHS_BY_SEGMENT: Dict[str, Tuple[str, ...]] = {}
+for _suffix in OPEN_PATH_SUFFIXES:
+    _segment = _suffix[_suffix.rfind("/"):]
+    _OPEN_PATHS_BY_SEGMENT[_segment] = _OPEN_PATHS_BY_SEGMENT.get(_segment, ()) + (_suffix,)
+del _suffix, _segment
+
+def _is_open_path(path: str) -> bool:
+    candidates = _OPEN_PATHS_BY_SEGMENT.get(path[path.rfind("/"):])
+    return candidates is not None and any(path.endswith(suf) for suf in candidates)
+
+class AuthMiddleware:
+    """
+    Bearer-token check as plain ASGI middleware. Unlike @app.middleware("http")
+    it builds no Request/Response wrappers and spawns no extra task per call;
+    verified claims land in scope["state"], which is what request.state reads.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Allow all OPTIONS requests for CORS preflight
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or _is_open_path(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        bearer = b""
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                bearer = value
+                break
+        if not bearer.startswith(b"Bearer "):
+            response = JSONResponse(status_code=401, content={"code":"AUTH_REQUIRED","message":"missing bearer token"})
+        else:
+            try:
+                claims = verify_jwt(bearer[len(b"Bearer "):].decode("latin-1").strip())
+            except HTTPException as e:
+                response = JSONResponse(status_code=e.status_code, content=e.detail)
+            else:
+                scope.setdefault("state", {})["claims"] = claims
+                await self.app(scope, receive, send)
+                return
+        await response(scope, receive, send)
@@ -1,10 +1,22 @@
 import os
 import time
+import json
+import base64
 import secrets
+import threading
+import copy
+import functools
+import bisect
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, deque, OrderedDict
 from typing import Optional, Dict, Any, List, Tuple
 from decimal import Decimal
 import boto3
+from botocore.config import Config
 from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.types import TypeDeserializer
 
 def _pose_pk(patient_id: str) -> str:
     return f"POSE#{patient_id}"
@@ -12,6 +24,172 @@ def _pose_pk(patient_id: str) -> str:
 def _pose_sk(pose_id: str) -> str:
     return f"POSE#{pose_id}"
 
+def _scan_segment(table, segment: int, total_segments: int) -> List[Dict[str,Any]]:
+    kw = {"Segment": segment, "TotalSegments": total_segments}
+    items: List[Dict[str,Any]] = []
+    while True:
+        resp = table.scan(**kw)
+        items.extend(resp.get("Items", []))
+        if "LastEvaluatedKey" not in resp:
+            return items
+        kw["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+# Key condition templates used by the hot query paths. Passing the expression
+# string directly skips boto3 building and compiling Key()/Attr() objects on
+# every call; only the attribute values change between requests.
+_KEY_CONDITIONS = {
+    (False, False): "#pk = :pk",
+    (True, False): "#pk = :pk AND #sk >= :lo",
+    (False, True): "#pk = :pk AND #sk <= :hi",
+    (True, True): "#pk = :pk AND #sk BETWEEN :lo AND :hi",
+}
+_KEY_PREFIX_CONDITION = "#pk = :pk AND begins_with(#sk, :prefix)"
+
+def _key_condition(pk_attr: str, pk: Any, sk_attr: Optional[str] = None,
+                   lo: Any = None, hi: Any = None) -> Dict[str, Any]:
+    """Query kwargs for pk = :pk with an optional inclusive sort key range"""
+    names = {"#pk": pk_attr}
+    values = {":pk": pk}
+    if lo is not None:
+        values[":lo"] = lo
+    if hi is not None:
+        values[":hi"] = hi
+    if len(values) > 1:
+        names["#sk"] = sk_attr
+    return {
+        "KeyConditionExpression": _KEY_CONDITIONS[(lo is not None, hi is not None)],
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
+    }
+
+def _count(operation, **kw) -> int:
+    """Sum Count over every page of a Select="COUNT" scan or query (each page stops at 1 MB)"""
+    kw["Select"] = "COUNT"
+    total = 0
+    while True:
+        resp = operation(**kw)
+        total += resp.get("Count", 0)
+        if "LastEvaluatedKey" not in resp:
+            return total
+        kw["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+def _parallel_scan(table, total_segments: int) -> List[Dict[str,Any]]:
+    """Full-table scan split into segments read concurrently"""
+    if total_segments <= 1:
+        return _scan_segment(table, 0, 1)
+    # Worker count stays well under the 50-connection pool on the resource
+    with ThreadPoolExecutor(max_workers=total_segments) as pool:
+        segments = pool.map(lambda i: _scan_segment(table, i, total_segments), range(total_segments))
+        return list(itertools.chain.from_iterable(segments))
+
+def _batch_get(table, keys: List[Dict[str,Any]], id_attr: str) -> Dict[str, Dict[str,Any]]:
+    """
+    Fetch items with BatchGetItem (100 keys per call), retrying
+    UnprocessedKeys with exponential backoff. Returns items keyed by id_attr.
+    """
+    found: Dict[str, Dict[str,Any]] = {}
+    for start in range(0, len(keys), 100):
+        request = {table.name: {"Keys": keys[start:start + 100]}}
+        delay = 0.05
+        while request:
+            resp = ddb.batch_get_item(RequestItems=request)
+            for item in resp.get("Responses", {}).get(table.name, []):
+                found[item[id_attr]] = item
+            request = resp.get("UnprocessedKeys")
+            if request:
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+    return found
+
+def _transact_write(table, actions: List[Dict[str,Any]]) -> None:
+    """
+    Run TransactWriteItems actions on table's client in chunks of 100 (the
+    per-transaction limit), each chunk all-or-nothing. A chunk cancelled by
+    a conflicting concurrent transaction is retried with exponential backoff.
+    """
+    client = table.meta.client
+    for start in range(0, len(actions), 100):
+        chunk = actions[start:start + 100]
+        delay = 0.05
+        for attempt in range(3):
+            try:
+                client.transact_write_items(TransactItems=chunk)
+                break
+            except client.exceptions.TransactionCanceledException as e:
+                reasons = e.response.get("CancellationReasons", [])
+                if attempt == 2 or not any(r.get("Code") == "TransactionConflict" for r in reasons):
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+class _TTLCache:
+    """
+    Size-bounded LRU of recently read items with a short TTL, kept in front
+    of the single-item getters on read-heavy paths. Writes through this
+    module pop the key once the write has completed; writes made by other
+    Lambda containers become visible once the entry expires.
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[Dict[str,Any], float]]" = OrderedDict()
+        # Handlers run on FastAPI's threadpool and share these caches
+        self._lock = threading.RLock()
+        # Bumped by every pop, so reads that overlap a write aren't cached
+        self._generation = 0
+    
+    def get(self, key: str) -> Optional[Dict[str,Any]]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+        # Callers may mutate what they get back, nested settings/lists
+        # included; keep the cached copy intact
+        return copy.deepcopy(entry[0])
+    
+    def generation(self) -> int:
+        """Token to take before a backing read and hand to put()"""
+        return self._generation
+    
+    def put(self, key: str, item: Dict[str,Any], generation: Optional[int] = None) -> None:
+        """
+        Cache item. With a generation from before the read, the item is
+        dropped if any key was invalidated meanwhile: the read may predate
+        that write, and caching it would serve the old item for a full TTL.
+        """
+        entry = (copy.deepcopy(item), time.monotonic() + self.ttl)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._items[key] = entry
+            self._items.move_to_end(key)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+    
+    def pop(self, key: str) -> None:
+        """Invalidate key; call after the backing write has completed"""
+        with self._lock:
+            self._items.pop(key, None)
+            self._generation += 1
+
+_user_cache = _TTLCache()
+_device_cache = _TTLCache()
+_profile_cache = _TTLCache()
+_session_cache = _TTLCache(maxsize=4096)
+_report_cache = _TTLCache(maxsize=4096)
+_setting_cache = _TTLCache(maxsize=4096)
+# Conversation participants never change after creation, so they can be kept
+# far longer than the item caches
+_participants_cache = _TTLCache(maxsize=4096, ttl=3600.0)
+
+# OS-backed CSPRNG bound once for verification codes
+_sysrand = secrets.SystemRandom()
+
 USE_MEMORY = os.environ.get("USE_MEMORY", "false").lower() == "true"
 VERIFICATION_CODE_TTL = 600  # 10 minutes
 
@@ -19,10 +197,61 @@ VERIFICATION_CODE_TTL = 600  # 10 minutes
 _verification_codes: Dict[str, Dict[str, Any]] = {}
 
 if not USE_MEMORY:
-    ddb = boto3.resource("dynamodb")
+    # Single module-level resource so warm invocations reuse pooled, kept-alive
+    # HTTPS connections instead of paying a TLS handshake per call
+    _DDB_CONFIG = Config(
+        max_pool_connections=50,
+        tcp_keepalive=True,
+        retries={"max_attempts": 3, "mode": "adaptive"},
+        connect_timeout=5,
+        read_timeout=10,
+    )
+    ddb = boto3.resource("dynamodb", config=_DDB_CONFIG)
+    # Low-level client for the hottest single-item calls: skips the resource
+    # layer's request/response transformation and deserializes only the
+    # returned attributes
+    ddb_client = boto3.client("dynamodb", config=_DDB_CONFIG)
+    _deserializer = TypeDeserializer()
+
+    def _get_item_raw(table, key: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        resp = ddb_client.get_item(
+            TableName=table.name,
+            Key={k: {"S": v} for k, v in key.items()}
+        )
+        item = resp.get("Item")
+        if item is None:
+            return None
+        return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+    # Key schemas of the tables defined in template.yaml, known at deploy time.
+    # Reading table.key_schema costs a DescribeTable round trip per table on
+    # cold start, so it is only done for tables not listed here (e.g. the
+    # externally managed tremor analysis table). DDB_SCHEMA_OVERRIDE replaces
+    # entries for dev tables with a different layout, e.g.
+    # "DDB_TABLE_USERS=pk:sk,DDB_TABLE_POSES=pk:sk".
+    _TABLE_SCHEMAS: Dict[str, Tuple[str, Optional[str]]] = {
+        "DDB_TABLE_USERS": ("id", None),
+        "DDB_TABLE_REFRESH": ("token", None),
+        "DDB_TABLE_POSES": ("patientId", "id"),
+        "DDB_TABLE_DEVICES": ("id", None),
+        "DDB_TABLE_PATIENT_PROFILES": ("userId", None),
+        "DDB_TABLE_SESSIONS": ("sessionId", None),
+        "DDB_TABLE_AUDIT_LOGS": ("pk", "sk"),
+        "DDB_TABLE_SYSTEM_SETTINGS": ("settingKey", None),
+        "DDB_TABLE_MESSAGES": ("conversationId", "messageId"),
+        "DDB_TABLE_SYMPTOMS": ("patientId", "recordId"),
+        "DDB_TABLE_REPORTS": ("reportId", None),
+    }
+    for _override in filter(None, os.environ.get("DDB_SCHEMA_OVERRIDE", "").split(",")):
+        _env_var, _, _attrs = _override.strip().partition("=")
+        _pk, _, _sk = _attrs.partition(":")
+        _TABLE_SCHEMAS[_env_var] = (_pk, _sk or None)
 
+    @functools.lru_cache(maxsize=None)
     def _table_with_schema(env_var: str):
         table = ddb.Table(os.environ[env_var])
+        if env_var in _TABLE_SCHEMAS:
+            return (table, *_TABLE_SCHEMAS[env_var])
         pk_attr = "id"
         sk_attr = None
         try:
@@ -52,6 +281,8 @@ if not USE_MEMORY:
     T_MESSAGES, MESSAGES_PK_ATTR, MESSAGES_SK_ATTR = _table_with_schema("DDB_TABLE_MESSAGES")
     T_SYMPTOMS, SYMPTOMS_PK_ATTR, SYMPTOMS_SK_ATTR = _table_with_schema("DDB_TABLE_SYMPTOMS")
     T_REPORTS, REPORTS_PK_ATTR, REPORTS_SK_ATTR = _table_with_schema("DDB_TABLE_REPORTS")
+    # Verification codes share the replay-protection nonces table (key: nonce)
+    T_NONCES = ddb.Table(os.environ.get("DDB_TABLE_NONCES", "medusa-nonces-prod"))
 
     USERS_SINGLE_TABLE = _is_pk_sk(USERS_PK_ATTR, USERS_SK_ATTR)
     REFRESH_SINGLE_TABLE = _is_pk_sk(REFRESH_PK_ATTR, REFRESH_SK_ATTR)
@@ -61,35 +292,86 @@ if not USE_MEMORY:
     SESSIONS_SINGLE_TABLE = _is_pk_sk(SESSIONS_PK_ATTR, SESSIONS_SK_ATTR)
     TREMOR_SINGLE_TABLE = _is_pk_sk(TREMOR_PK_ATTR, TREMOR_SK_ATTR)
 
-    def _user_key(user_id: str) -> Dict[str, str]:
-        if USERS_SINGLE_TABLE:
+    # Key and item builders are specialized to the table layout once here, so
+    # the per-call paths don't re-check the *_SINGLE_TABLE flags.
+    # _*_item never mutates the caller's dict: single-table layouts copy before
+    # adding pk/sk, flat layouts write the caller's dict as-is.
+    if USERS_SINGLE_TABLE:
+        def _user_key(user_id: str) -> Dict[str, str]:
             return {
                 USERS_PK_ATTR: f"USER#{user_id}",
                 USERS_SK_ATTR: "PROFILE",
             }
-        return {USERS_PK_ATTR: user_id}
 
-    def _refresh_key(token: str) -> Dict[str, str]:
-        if REFRESH_SINGLE_TABLE:
+        def _user_item(u: Dict[str, Any]) -> Dict[str, Any]:
+            return {**u, **_user_key(u["id"])}
+    else:
+        def _user_key(user_id: str) -> Dict[str, str]:
+            return {USERS_PK_ATTR: user_id}
+
+        def _user_item(u: Dict[str, Any]) -> Dict[str, Any]:
+            return u
+
+    if REFRESH_SINGLE_TABLE:
+        def _refresh_key(token: str) -> Dict[str, str]:
             key = {REFRESH_PK_ATTR: f"REFRESH#{token}"}
             if REFRESH_SK_ATTR:
                 key[REFRESH_SK_ATTR] = "SESSION"
             return key
-        return {REFRESH_PK_ATTR: token}
+
+        def _refresh_item(token: str, sess: Dict[str, Any]) -> Dict[str, Any]:
+            return {"token": token, **sess, **_refresh_key(token)}
+    else:
+        def _refresh_key(token: str) -> Dict[str, str]:
+            return {REFRESH_PK_ATTR: token}
+
+        def _refresh_item(token: str, sess: Dict[str, Any]) -> Dict[str, Any]:
+            return {"token": token, **sess}
+
+    if POSES_SINGLE_TABLE:
+        def _pose_item(p: Dict[str, Any]) -> Dict[str, Any]:
+            item = dict(p)
+            item[POSES_PK_ATTR] = _pose_pk(p["patientId"])
+            if POSES_SK_ATTR:
+                item[POSES_SK_ATTR] = _pose_sk(p["id"])
+            return item
+    else:
+        def _pose_item(p: Dict[str, Any]) -> Dict[str, Any]:
+            return p
 
 else:
     _users: Dict[str, Dict[str,Any]] = {}
+    # User ids in insertion order plus id -> position, so list_users can
+    # resume a page from next_token without re-walking _users
+    _users_keys: List[str] = []
+    _users_pos: Dict[str, int] = {}
     _refresh: Dict[str, Dict[str,Any]] = {}
-    _poses: List[Dict[str,Any]] = []
-    _devices: List[Dict[str,Any]] = []
+    # Tables are keyed the way they are looked up, with side indexes for the
+    # secondary access paths (the DynamoDB GSIs), so lookups are O(1)/O(k)
+    _poses_by_patient: Dict[str, List[Dict[str,Any]]] = {}
+    _devices: Dict[str, Dict[str,Any]] = {}
+    _devices_by_mac: Dict[str, str] = {}
+    _devices_by_patient: Dict[str, Dict[str, None]] = {}  # insertion-ordered id set
     _patient_profiles: Dict[str, Dict[str,Any]] = {}
     _sessions: Dict[str, Dict[str,Any]] = {}
-    _tremor_analysis: List[Dict[str,Any]] = []
-    _audit_logs: List[Dict[str,Any]] = []
+    # patient_id -> rows sorted by ascending timestamp, for bisect range queries
+    _tremor_analysis: Dict[str, List[Dict[str,Any]]] = {}
+    _audit_logs: deque = deque(maxlen=10000)  # newest first
+    # eventType / userId -> that key's entries in _audit_logs, newest first
+    _audit_by_event: Dict[str, deque] = {}
+    _audit_by_user: Dict[str, deque] = {}
     _system_settings: Dict[str, Dict[str,Any]] = {}
-    _messages: List[Dict[str,Any]] = []
-    _symptoms: List[Dict[str,Any]] = []
-    _reports: List[Dict[str,Any]] = []
+    # Caps on the growing in-memory collections; the oldest entries drop first
+    MEMORY_MESSAGES_PER_CONVERSATION = 1000
+    MEMORY_SYMPTOMS_PER_PATIENT = 1000
+    MEMORY_REPORTS = 10000
+    _conversations: Dict[str, Dict[str,Any]] = {}
+    _conversations_by_user: Dict[str, List[Dict[str,Any]]] = {}
+    _messages_by_conv: Dict[str, deque] = {}  # oldest first
+    _symptoms: Dict[str, Dict[str, Dict[str,Any]]] = {}  # patientId -> recordId -> record
+    _reports: Dict[str, Dict[str,Any]] = {}
+    _reports_by_patient: Dict[str, Dict[str, None]] = {}  # insertion-ordered id sets
+    _reports_by_author: Dict[str, Dict[str, None]] = {}
     USERS_SINGLE_TABLE = False
     REFRESH_SINGLE_TABLE = False
     POSES_SINGLE_TABLE = False
@@ -113,14 +395,82 @@ else:
     def _refresh_key(token: str) -> Dict[str,str]:
         return {"token": token}
 
+@functools.lru_cache(maxsize=512)
+def _build_update(keys: Tuple[str, ...], remove_mask: int) -> Tuple[str, Dict[str,str]]:
+    """
+    UpdateExpression and ExpressionAttributeNames for a tuple of attribute
+    names. Bit i of remove_mask REMOVEs keys[i] instead of SETting it; SET
+    values are bound to :val{i}. Update payloads come in a handful of shapes,
+    so the expression strings are built once per shape.
+    """
+    set_parts = []
+    remove_parts = []
+    expr_attr_names = {}
+    for i, key in enumerate(keys):
+        attr_name = f"#attr{i}"
+        expr_attr_names[attr_name] = key
+        if remove_mask >> i & 1:
+            remove_parts.append(attr_name)
+        else:
+            set_parts.append(f"{attr_name} = :val{i}")
+    clauses = []
+    if set_parts:
+        clauses.append("SET " + ", ".join(set_parts))
+    if remove_parts:
+        clauses.append("REMOVE " + ", ".join(remove_parts))
+    return " ".join(clauses), expr_attr_names
+
+def _update_args(updates: Dict[str,Any], remove_none: bool = False) -> Tuple[str, Dict[str,str], Dict[str,Any]]:
+    """
+    (UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+    for an update dict. With remove_none, None values REMOVE the attribute.
+    """
+    remove_mask = 0
+    expr_attr_values = {}
+    for i, value in enumerate(updates.values()):
+        if remove_none and value is None:
+            remove_mask |= 1 << i
+        else:
+            expr_attr_values[f":val{i}"] = value
+    update_expression, expr_attr_names = _build_update(tuple(updates), remove_mask)
+    # Callers own the returned names dict; don't hand out the cached one
+    return update_expression, dict(expr_attr_names), expr_attr_values
+
 def put_user(u: Dict[str,Any]):
     if USE_MEMORY:
+        if u["id"] not in _users_pos:
+            _users_pos[u["id"]] = len(_users_keys)
+            _users_keys.append(u["id"])
         _users[u["id"]] = u
         return
-    item = dict(u)
-    if USERS_SINGLE_TABLE:
-        item.update(_user_key(u["id"]))
+    item = _user_item(u)
     T_USERS.put_item(Item=item)
+    _user_cache.pop(u["id"])
+
+def create_user_if_absent(u: Dict[str,Any]) -> bool:
+    """
+    Create a user unless one with the same id already exists, in a single
+    conditional write. Returns False if the id is taken.
+    """
+    if USE_MEMORY:
+        if u["id"] in _users:
+            return False
+        put_user(u)
+        return True
+    item = _user_item(u)
+    try:
+        T_USERS.put_item(Item=item, ConditionExpression=Attr(USERS_PK_ATTR).not_exists())
+    except T_USERS.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    _user_cache.pop(u["id"])
+    increment_counter("users")
+    return True
+
+def get_users_bulk(user_ids: List[str]) -> Dict[str, Dict[str,Any]]:
+    """Get many users in BatchGetItem calls, keyed by user id (missing ids are absent)"""
+    if USE_MEMORY:
+        return {uid: _users[uid] for uid in user_ids if uid in _users}
+    return _batch_get(T_USERS, [_user_key(uid) for uid in dict.fromkeys(user_ids)], "id")
 
 def get_user_by_email(email: str) -> Optional[Dict[str,Any]]:
     if USE_MEMORY:
@@ -134,8 +484,14 @@ def get_user_by_email(email: str) -> Optional[Dict[str,Any]]:
 def get_user(user_id: str) -> Optional[Dict[str,Any]]:
     if USE_MEMORY:
         return _users.get(user_id)
-    resp = T_USERS.get_item(Key=_user_key(user_id))
-    return resp.get("Item")
+    item = _user_cache.get(user_id)
+    if item is not None:
+        return item
+    generation = _user_cache.generation()
+    item = _get_item_raw(T_USERS, _user_key(user_id))
+    if item is not None:
+        _user_cache.put(user_id, item, generation)
+    return item
 
 def list_users(role: Optional[str] = None, limit: int = 50, next_token: Optional[str] = None) -> Tuple[List[Dict[str,Any]], Optional[str]]:
     """
@@ -143,20 +499,15 @@ def list_users(role: Optional[str] = None, limit: int = 50, next_token: Optional
     Returns (users_list, next_token)
     """
     if USE_MEMORY:
-        users = list(_users.values())
+        # Resume right after next_token; fetch one extra to know if more remain
+        start_idx = _users_pos[next_token] + 1 if next_token in _users_pos else 0
+        users = (_users[_users_keys[i]] for i in range(start_idx, len(_users_keys)))
         if role:
-            users = [u for u in users if u.get("role") == role]
-        # Simple pagination for in-memory
-        start_idx = 0
-        if next_token:
-            for i, u in enumerate(users):
-                if u["id"] == next_token:
-                    start_idx = i + 1
-                    break
-        end_idx = start_idx + limit
-        result = users[start_idx:end_idx]
-        new_token = result[-1]["id"] if len(result) == limit and end_idx < len(users) else None
-        return result, new_token
+            users = (u for u in users if u.get("role") == role)
+        result = list(itertools.islice(users, limit + 1))
+        has_more = len(result) > limit
+        del result[limit:]
+        return result, result[-1]["id"] if has_more and result else None
     
     # DynamoDB scan with optional filter
     scan_kwargs = {"Limit": limit}
@@ -199,30 +550,7 @@ def update_user(user_id: str, updates: Dict[str,Any]) -> bool:
         return False
     
     # Build update expression for DynamoDB
-    update_parts = []
-    remove_parts = []
-    expr_attr_names = {}
-    expr_attr_values = {}
-    
-    for i, (key, value) in enumerate(updates.items()):
-        attr_name = f"#attr{i}"
-        expr_attr_names[attr_name] = key
-        
-        if value is None:
-            remove_parts.append(attr_name)
-        else:
-            attr_value = f":val{i}"
-            update_parts.append(f"{attr_name} = {attr_value}")
-            expr_attr_values[attr_value] = value
-    
-    update_expression = ""
-    if update_parts:
-        update_expression += "SET " + ", ".join(update_parts)
-    if remove_parts:
-        if update_expression:
-            update_expression += " "
-        update_expression += "REMOVE " + ", ".join(remove_parts)
-    
+    update_expression, expr_attr_names, expr_attr_values = _update_args(updates, remove_none=True)
     if not update_expression:
         return True
     
@@ -236,6 +564,7 @@ def update_user(user_id: str, updates: Dict[str,Any]) -> bool:
             update_kwargs["ExpressionAttributeValues"] = expr_attr_values
             
         T_USERS.update_item(**update_kwargs)
+        _user_cache.pop(user_id)
         return True
     except Exception as e:
         print(f"[db] Error updating user {user_id}: {e}")
@@ -245,10 +574,7 @@ def save_refresh(token: str, sess: Dict[str,Any]):
     if USE_MEMORY:
         _refresh[token] = sess
         return
-    item = {"token": token, **sess}
-    if REFRESH_SINGLE_TABLE:
-        item.update(_refresh_key(token))
-    T_REFRESH.put_item(Item=item)
+    T_REFRESH.put_item(Item=_refresh_item(token, sess))
 
 def take_refresh(token: str) -> Optional[Dict[str,Any]]:
     if USE_MEMORY:
@@ -261,31 +587,31 @@ def take_refresh(token: str) -> Optional[Dict[str,Any]]:
 
 def generate_verification_code() -> str:
     """Generate a 6-digit verification code"""
-    return ''.join([str(secrets.randbelow(10)) for _ in range(6)])
+    return f"{_sysrand.randrange(1_000_000):06d}"
 
 def save_verification_code(email: str, code: str, code_type: str = "registration") -> bool:
     """
     Save verification code with TTL.
     Uses the nonces table for storage with automatic expiration.
     """
+    now = int(time.time())
     if USE_MEMORY:
         _verification_codes[email] = {
             "code": code,
             "type": code_type,
-            "created_at": int(time.time()),
-            "expires_at": int(time.time()) + VERIFICATION_CODE_TTL
+            "created_at": now,
+            "expires_at": now + VERIFICATION_CODE_TTL
         }
         return True
     
     try:
-        nonces_table = ddb.Table(os.environ.get("DDB_TABLE_NONCES", "medusa-nonces-prod"))
-        nonces_table.put_item(Item={
+        T_NONCES.put_item(Item={
             "nonce": f"VERIFY#{email}#{code_type}",  # Unique key per email+type
             "code": code,
             "email": email,
             "type": code_type,
-            "created_at": int(time.time()),
-            "ttl": int(time.time()) + VERIFICATION_CODE_TTL  # Auto-delete after 10 min
+            "created_at": now,
+            "ttl": now + VERIFICATION_CODE_TTL  # Auto-delete after 10 min
         })
         return True
     except Exception as e:
@@ -297,13 +623,14 @@ def verify_and_consume_code(email: str, code: str, code_type: str = "registratio
     Verify a code and consume it (delete after verification).
     Returns True if code is valid and not expired.
     """
+    now = int(time.time())
     if USE_MEMORY:
         stored = _verification_codes.get(email)
         if not stored:
             return False
         if stored["type"] != code_type:
             return False
-        if stored["expires_at"] < int(time.time()):
+        if stored["expires_at"] < now:
             del _verification_codes[email]
             return False
         if stored["code"] != code:
@@ -313,30 +640,32 @@ def verify_and_consume_code(email: str, code: str, code_type: str = "registratio
         return True
     
     try:
-        nonces_table = ddb.Table(os.environ.get("DDB_TABLE_NONCES", "medusa-nonces-prod"))
         key = {"nonce": f"VERIFY#{email}#{code_type}"}
         
-        # Get the stored code
-        resp = nonces_table.get_item(Key=key)
-        item = resp.get("Item")
-        
-        if not item:
-            print(f"[db] No verification code found for {email}")
-            return False
-        
-        # Check if expired (extra safety, TTL should handle this)
-        if item.get("ttl", 0) < int(time.time()):
-            nonces_table.delete_item(Key=key)
-            print(f"[db] Verification code expired for {email}")
-            return False
-        
-        # Check code match
-        if item.get("code") != code:
-            print(f"[db] Verification code mismatch for {email}")
+        # Consume the code in one call: the delete only succeeds if the code
+        # matches and has not expired, so two concurrent requests cannot both
+        # pass the check
+        try:
+            ddb_client.delete_item(
+                TableName=T_NONCES.name,
+                Key={"nonce": {"S": key["nonce"]}},
+                ConditionExpression="#c = :code AND #t >= :now",
+                ExpressionAttributeNames={"#c": "code", "#t": "ttl"},
+                ExpressionAttributeValues={":code": {"S": code}, ":now": {"N": str(now)}},
+                ReturnValuesOnConditionCheckFailure="ALL_OLD"
+            )
+        except ddb_client.exceptions.ConditionalCheckFailedException as e:
+            item = e.response.get("Item")
+            if not item:
+                print(f"[db] No verification code found for {email}")
+            # Check if expired (extra safety, TTL should handle this)
+            elif int(item.get("ttl", {}).get("N", 0)) < now:
+                T_NONCES.delete_item(Key=key)
+                print(f"[db] Verification code expired for {email}")
+            else:
+                print(f"[db] Verification code mismatch for {email}")
             return False
         
-        # Code is valid - consume it (delete)
-        nonces_table.delete_item(Key=key)
         print(f"[db] Verification code consumed for {email}")
         return True
         
@@ -356,29 +685,33 @@ def has_pending_verification(email: str, code_type: str = "registration", min_ag
     Returns:
         True if there's a valid pending code that's less than min_age_seconds old
     """
+    now = int(time.time())
     if USE_MEMORY:
         stored = _verification_codes.get(email)
         if not stored or stored["type"] != code_type:
             return False
         # Check if code exists and is not expired
-        if stored["expires_at"] <= int(time.time()):
+        if stored["expires_at"] <= now:
             return False  # Expired, can request new one
         # Check rate limiting: only block if code is very recent (less than min_age_seconds old)
-        code_age = int(time.time()) - stored["created_at"]
+        code_age = now - stored["created_at"]
         return code_age < min_age_seconds
     
     try:
-        nonces_table = ddb.Table(os.environ.get("DDB_TABLE_NONCES", "medusa-nonces-prod"))
         key = {"nonce": f"VERIFY#{email}#{code_type}"}
-        resp = nonces_table.get_item(Key=key)
+        resp = T_NONCES.get_item(
+            Key=key,
+            ProjectionExpression="#t, #c",
+            ExpressionAttributeNames={"#t": "ttl", "#c": "created_at"}
+        )
         item = resp.get("Item")
         if not item:
             return False  # No code, can request
         # Check if expired
-        if item.get("ttl", 0) <= int(time.time()):
+        if item.get("ttl", 0) <= now:
             return False  # Expired, can request new one
         # Check rate limiting: only block if code is very recent
-        code_age = int(time.time()) - item.get("created_at", 0)
+        code_age = now - item.get("created_at", 0)
         return code_age < min_age_seconds
     except Exception:
         return False
@@ -387,8 +720,7 @@ def has_pending_verification(email: str, code_type: str = "registration", min_ag
 
 def list_poses_by_patient(pid: str, limit:int=50, next_token=None) -> Tuple[List[Dict[str,Any]], Any]:
     if USE_MEMORY:
-        items = [p for p in _poses if p["patientId"]==pid]
-        return items[:limit], None
+        return _poses_by_patient.get(pid, [])[:limit], None
     if POSES_SINGLE_TABLE:
         key_expr = Key(POSES_PK_ATTR).eq(_pose_pk(pid))
         kw = {
@@ -405,43 +737,113 @@ def list_poses_by_patient(pid: str, limit:int=50, next_token=None) -> Tuple[List
 
 def create_pose(p: Dict[str,Any]):
     if USE_MEMORY:
-        _poses.append(p)
+        _poses_by_patient.setdefault(p["patientId"], []).append(p)
         return
-    item = dict(p)
-    if POSES_SINGLE_TABLE:
-        item[POSES_PK_ATTR] = _pose_pk(p["patientId"])
-        if POSES_SK_ATTR:
-            item[POSES_SK_ATTR] = _pose_sk(p["id"])
-    T_POSES.put_item(Item=item)
+    T_POSES.put_item(Item=_pose_item(p))
+
+def create_poses_bulk(items: List[Dict[str,Any]]) -> None:
+    """Create many poses, packed into BatchWriteItem calls of up to 25 puts"""
+    if USE_MEMORY:
+        for p in items:
+            _poses_by_patient.setdefault(p["patientId"], []).append(p)
+        return
+    pkeys = [POSES_PK_ATTR] + ([POSES_SK_ATTR] if POSES_SK_ATTR else [])
+    # batch_writer chunks to 25 items and resubmits UnprocessedItems
+    with T_POSES.batch_writer(overwrite_by_pkeys=pkeys) as bw:
+        for p in items:
+            bw.put_item(Item=_pose_item(p))
 
 # ========================================
 # Device Operations
 # ========================================
 
+def _index_device(d: Dict[str, Any]) -> None:
+    if d.get("macAddress") is not None:
+        _devices_by_mac[d["macAddress"]] = d["id"]
+    if d.get("patientId") is not None:
+        _devices_by_patient.setdefault(d["patientId"], {})[d["id"]] = None
+
+def _unindex_device(d: Dict[str, Any]) -> None:
+    if _devices_by_mac.get(d.get("macAddress")) == d["id"]:
+        del _devices_by_mac[d["macAddress"]]
+    _devices_by_patient.get(d.get("patientId"), {}).pop(d["id"], None)
+
+def _store_device(device: Dict[str, Any]) -> None:
+    old = _devices.get(device["id"])
+    if old is not None:
+        _unindex_device(old)
+    _devices[device["id"]] = device
+    _index_device(device)
+
 def create_device(device: Dict[str, Any]) -> None:
     """Create a new device"""
     if USE_MEMORY:
-        _devices.append(device)
+        _store_device(device)
+        return
+    resp = T_DEVICES.put_item(Item=device, ReturnValues="ALL_OLD")
+    _device_cache.pop(device["id"])
+    if not resp.get("Attributes"):
+        increment_counter("devices")
+
+def create_device_if_absent(device: Dict[str, Any]) -> bool:
+    """Create a device unless its id is taken (single conditional write)"""
+    if USE_MEMORY:
+        if device["id"] in _devices:
+            return False
+        _store_device(device)
+        return True
+    try:
+        T_DEVICES.put_item(Item=device, ConditionExpression=Attr("id").not_exists())
+    except T_DEVICES.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    _device_cache.pop(device["id"])
+    increment_counter("devices")
+    return True
+
+def create_devices_bulk(devices: List[Dict[str, Any]]) -> None:
+    """
+    Create many new devices, packed into BatchWriteItem calls of up to 25 puts.
+    BatchWriteItem can't report overwrites, so ids must not exist yet; every
+    distinct id is added to the devices counter.
+    """
+    if USE_MEMORY:
+        for device in devices:
+            _store_device(device)
         return
-    T_DEVICES.put_item(Item=device)
+    with T_DEVICES.batch_writer(overwrite_by_pkeys=["id"]) as bw:
+        for device in devices:
+            bw.put_item(Item=device)
+    # Invalidate once the batch has flushed, so no read can re-cache old items
+    ids = {device["id"] for device in devices}
+    for device_id in ids:
+        _device_cache.pop(device_id)
+    if ids:
+        increment_counter("devices", len(ids))
 
 def get_device(device_id: str) -> Optional[Dict[str, Any]]:
     """Get device by ID"""
     if USE_MEMORY:
-        for d in _devices:
-            if d["id"] == device_id:
-                return d
-        return None
-    resp = T_DEVICES.get_item(Key={"id": device_id})
-    return resp.get("Item")
+        return _devices.get(device_id)
+    item = _device_cache.get(device_id)
+    if item is not None:
+        return item
+    generation = _device_cache.generation()
+    item = _get_item_raw(T_DEVICES, {"id": device_id})
+    if item is not None:
+        _device_cache.put(device_id, item, generation)
+    return item
+
+def get_devices_bulk(device_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Get many devices in BatchGetItem calls, keyed by device id"""
+    if USE_MEMORY:
+        return {did: _devices[did] for did in device_ids if did in _devices}
+    return _batch_get(T_DEVICES, [{"id": did} for did in dict.fromkeys(device_ids)], "id")
 
 def get_device_by_mac(mac_address: str) -> Optional[Dict[str, Any]]:
     """Get device by MAC address"""
     if USE_MEMORY:
-        for d in _devices:
-            if d["macAddress"] == mac_address:
-                return d
-        return None
+        device_id = _devices_by_mac.get(mac_address)
+        return _devices[device_id] if device_id is not None else None
     resp = T_DEVICES.query(
         IndexName="macAddress-index",
         KeyConditionExpression=Key("macAddress").eq(mac_address),
@@ -453,43 +855,41 @@ def get_device_by_mac(mac_address: str) -> Optional[Dict[str, Any]]:
 def get_devices_by_patient(patient_id: str) -> List[Dict[str, Any]]:
     """Get all devices for a patient (personal devices only)"""
     if USE_MEMORY:
-        return [d for d in _devices if d.get("patientId") == patient_id]
-    # No index for patientId anymore (devices are in shared pool)
-    # Use scan with filter for personal devices
-    resp = T_DEVICES.scan(
-        FilterExpression=Attr("patientId").eq(patient_id)
-    )
-    return resp.get("Items", [])
-
-def get_all_devices() -> List[Dict[str, Any]]:
+        return [_devices[did] for did in _devices_by_patient.get(patient_id, ())]
+    # patientId-index is sparse: shared-pool devices without a patientId
+    # are not in it, so the query only touches the patient's own devices
+    kw = {
+        "IndexName": "patientId-index",
+        "KeyConditionExpression": Key("patientId").eq(patient_id)
+    }
+    items: List[Dict[str, Any]] = []
+    while True:
+        resp = T_DEVICES.query(**kw)
+        items.extend(resp.get("Items", []))
+        if "LastEvaluatedKey" not in resp:
+            return items
+        kw["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+def get_all_devices(total_segments: int = 4) -> List[Dict[str, Any]]:
     """Get all devices (admin only)"""
     if USE_MEMORY:
-        return _devices
-    resp = T_DEVICES.scan()
-    return resp.get("Items", [])
+        return list(_devices.values())
+    return _parallel_scan(T_DEVICES, total_segments)
 
 def update_device(device_id: str, updates: Dict[str, Any]) -> None:
     """Update device fields"""
     if USE_MEMORY:
-        for d in _devices:
-            if d["id"] == device_id:
-                d.update(updates)
-                return
+        d = _devices.get(device_id)
+        if d is not None:
+            _unindex_device(d)
+            d.update(updates)
+            _index_device(d)
         return
     
     # Build update expression
-    update_expr = "SET "
-    expr_attr_values = {}
-    expr_attr_names = {}
-    
-    for i, (key, value) in enumerate(updates.items()):
-        if i > 0:
-            update_expr += ", "
-        attr_name = f"#attr{i}"
-        attr_value = f":val{i}"
-        update_expr += f"{attr_name} = {attr_value}"
-        expr_attr_names[attr_name] = key
-        expr_attr_values[attr_value] = value
+    update_expr, expr_attr_names, expr_attr_values = _update_args(updates)
+    if not update_expr:
+        return
     
     T_DEVICES.update_item(
         Key={"id": device_id},
@@ -497,14 +897,19 @@ def update_device(device_id: str, updates: Dict[str, Any]) -> None:
         ExpressionAttributeNames=expr_attr_names,
         ExpressionAttributeValues=expr_attr_values
     )
+    _device_cache.pop(device_id)
 
 def delete_device(device_id: str) -> None:
     """Delete a device"""
     if USE_MEMORY:
-        global _devices
-        _devices = [d for d in _devices if d["id"] != device_id]
+        d = _devices.pop(device_id, None)
+        if d is not None:
+            _unindex_device(d)
         return
-    T_DEVICES.delete_item(Key={"id": device_id})
+    resp = T_DEVICES.delete_item(Key={"id": device_id}, ReturnValues="ALL_OLD")
+    _device_cache.pop(device_id)
+    if resp.get("Attributes"):
+        increment_counter("devices", -1)
 
 # ========================================
 # Patient Profile Operations
@@ -516,13 +921,26 @@ def create_patient_profile(profile: Dict[str, Any]) -> None:
         _patient_profiles[profile["userId"]] = profile
         return
     T_PATIENT_PROFILES.put_item(Item=profile)
+    _profile_cache.pop(profile["userId"])
 
 def get_patient_profile(user_id: str) -> Optional[Dict[str, Any]]:
     """Get patient profile by user ID"""
     if USE_MEMORY:
         return _patient_profiles.get(user_id)
-    resp = T_PATIENT_PROFILES.get_item(Key={"userId": user_id})
-    return resp.get("Item")
+    item = _profile_cache.get(user_id)
+    if item is not None:
+        return item
+    generation = _profile_cache.generation()
+    item = T_PATIENT_PROFILES.get_item(Key={"userId": user_id}).get("Item")
+    if item is not None:
+        _profile_cache.put(user_id, item, generation)
+    return item
+
+def get_patient_profiles_bulk(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Get many patient profiles in BatchGetItem calls, keyed by user ID"""
+    if USE_MEMORY:
+        return {uid: _patient_profiles[uid] for uid in user_ids if uid in _patient_profiles}
+    return _batch_get(T_PATIENT_PROFILES, [{"userId": uid} for uid in dict.fromkeys(user_ids)], "userId")
 
 def get_patients_by_doctor(doctor_id: str) -> List[Dict[str, Any]]:
     """Get all patients assigned to a doctor"""
@@ -539,12 +957,11 @@ def get_patients_by_doctor(doctor_id: str) -> List[Dict[str, Any]]:
         print(f"Error querying patients by doctor: {e}")
         return []
 
-def get_all_patient_profiles() -> List[Dict[str, Any]]:
+def get_all_patient_profiles(total_segments: int = 4) -> List[Dict[str, Any]]:
     """Get all patient profiles (admin only)"""
     if USE_MEMORY:
         return list(_patient_profiles.values())
-    resp = T_PATIENT_PROFILES.scan()
-    return resp.get("Items", [])
+    return _parallel_scan(T_PATIENT_PROFILES, total_segments)
 
 def update_patient_profile(user_id: str, updates: Dict[str, Any]) -> None:
     """Update patient profile fields"""
@@ -554,18 +971,9 @@ def update_patient_profile(user_id: str, updates: Dict[str, Any]) -> None:
         return
     
     # Build update expression
-    update_expr = "SET "
-    expr_attr_values = {}
-    expr_attr_names = {}
-    
-    for i, (key, value) in enumerate(updates.items()):
-        if i > 0:
-            update_expr += ", "
-        attr_name = f"#attr{i}"
-        attr_value = f":val{i}"
-        update_expr += f"{attr_name} = {attr_value}"
-        expr_attr_names[attr_name] = key
-        expr_attr_values[attr_value] = value
+    update_expr, expr_attr_names, expr_attr_values = _update_args(updates)
+    if not update_expr:
+        return
     
     T_PATIENT_PROFILES.update_item(
         Key={"userId": user_id},
@@ -573,6 +981,7 @@ def update_patient_profile(user_id: str, updates: Dict[str, Any]) -> None:
         ExpressionAttributeNames=expr_attr_names,
         ExpressionAttributeValues=expr_attr_values
     )
+    _profile_cache.pop(user_id)
 
 def delete_patient_profile(user_id: str) -> None:
     """Delete a patient profile"""
@@ -581,6 +990,7 @@ def delete_patient_profile(user_id: str) -> None:
             del _patient_profiles[user_id]
         return
     T_PATIENT_PROFILES.delete_item(Key={"userId": user_id})
+    _profile_cache.pop(user_id)
 
 # ========================================
 # Session Operations (Device-Patient Dynamic Binding)
@@ -592,55 +1002,100 @@ def create_session(session: Dict[str, Any]) -> None:
         _sessions[session["sessionId"]] = session
         return
     T_SESSIONS.put_item(Item=session)
+    _session_cache.pop(session["sessionId"])
 
 def get_session(session_id: str) -> Optional[Dict[str, Any]]:
     """Get session by ID"""
     if USE_MEMORY:
         return _sessions.get(session_id)
-    resp = T_SESSIONS.get_item(Key={SESSIONS_PK_ATTR: session_id})
-    return resp.get("Item")
+    item = _session_cache.get(session_id)
+    if item is not None:
+        return item
+    generation = _session_cache.generation()
+    item = T_SESSIONS.get_item(Key={SESSIONS_PK_ATTR: session_id}).get("Item")
+    if item is not None:
+        _session_cache.put(session_id, item, generation)
+    return item
 
 def get_session_by_id(session_id: str) -> Optional[Dict[str,Any]]:
+    return get_session(session_id)
+
+def update_session(session_id: str, updates: Dict[str, Any]) -> None:
+    """Update session fields"""
     if USE_MEMORY:
-        return _sessions.get(session_id)
-    resp = T_SESSIONS.get_item(Key={SESSIONS_PK_ATTR: session_id})
-    return resp.get("Item")
+        if session_id in _sessions:
+            _sessions[session_id].update(updates)
+        return
+    
+    update_expr, expr_attr_names, expr_attr_values = _update_args(updates)
+    if not update_expr:
+        return
+    
+    T_SESSIONS.update_item(
+        Key={SESSIONS_PK_ATTR: session_id},
+        UpdateExpression=update_expr,
+        ExpressionAttributeNames=expr_attr_names,
+        ExpressionAttributeValues=expr_attr_values
+    )
+    _session_cache.pop(session_id)
 
 from datetime import datetime, timezone
 
+# Numeric attributes per table, so response post-processing converts only
+# these instead of type-probing every field of every row
+TREMOR_NUMERIC_FIELDS = (
+    "timestamp", "tremor_index", "dominant_frequency", "rms_value",
+    "signal_quality", "tremor_power", "total_power",
+)
+AUDIT_NUMERIC_FIELDS = ("timestamp_unix", "ttl")
+
+def _plain_numbers(item: Dict[str, Any], fields: Tuple[str, ...]) -> None:
+    """Replace DynamoDB Decimals in the given fields with int/float, in place"""
+    for f in fields:
+        v = item.get(f)
+        if isinstance(v, Decimal):
+            item[f] = int(v) if v == v.to_integral_value() else float(v)
+
+@functools.lru_cache(maxsize=4096)
+def _minute_epoch(minute: str) -> int:
+    return int(datetime.fromisoformat(minute).replace(tzinfo=timezone.utc).timestamp())
+
+def _iso_to_epoch(ts: str) -> int:
+    """
+    Epoch seconds for an ISO-8601 UTC timestamp. The tremor pipeline writes
+    "YYYY-MM-DDTHH:MM:SS[.ffffff]Z"; rows of one query share a few minute
+    prefixes, so those resolve from a cache plus the two seconds digits.
+    """
+    if ts.endswith("Z") and len(ts) >= 20 and ts[16] == ":" and ts[19] in ".Z":
+        return _minute_epoch(ts[:16]) + int(ts[17:19])
+    return int(datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp())
+
 def get_tremor_analysis(patient_id: str, start_time: Optional[int] = None, end_time: Optional[int] = None, limit: int = 100) -> Tuple[List[Dict[str,Any]], int]:
     """
     Query tremor analysis data for a patient.
     Returns (items, count)
     """
     if USE_MEMORY:
-        # Simple memory implementation
-        items = [t for t in _tremor_analysis if t.get("patient_id") == patient_id]
-        if start_time:
-            items = [t for t in items if t.get("timestamp", 0) >= start_time]
-        if end_time:
-            items = [t for t in items if t.get("timestamp", 0) <= end_time]
-        items.sort(key=lambda x: x.get("timestamp", 0), reverse=True)
-        return items[:limit], len(items)
+        rows = _tremor_analysis.get(patient_id, [])
+        ts = lambda t: t.get("timestamp", 0)
+        lo = bisect.bisect_left(rows, start_time, key=ts) if start_time else 0
+        hi = bisect.bisect_right(rows, end_time, key=ts) if end_time else len(rows)
+        # Newest first: walk the range backwards
+        items = rows[max(lo, hi - limit):hi][::-1]
+        return items, hi - lo
 
-    key_condition = Key(TREMOR_PK_ATTR).eq(patient_id)
-    
     # Convert int timestamps to ISO strings for DynamoDB query if needed
     # The DB stores timestamps as ISO strings (e.g. "2025-11-15T22:17:06.160809Z")
+    start_iso = end_iso = None
     if start_time:
         start_iso = datetime.fromtimestamp(start_time, timezone.utc).isoformat().replace("+00:00", "Z")
     if end_time:
         end_iso = datetime.fromtimestamp(end_time, timezone.utc).isoformat().replace("+00:00", "Z")
-
-    if start_time and end_time:
-        key_condition = key_condition & Key(TREMOR_SK_ATTR).between(start_iso, end_iso)
-    elif start_time:
-        key_condition = key_condition & Key(TREMOR_SK_ATTR).gte(start_iso)
     
     # We want latest first, so ScanIndexForward=False
     try:
         resp = T_TREMOR_ANALYSIS.query(
-            KeyConditionExpression=key_condition,
+            **_key_condition(TREMOR_PK_ATTR, patient_id, TREMOR_SK_ATTR, start_iso, end_iso),
             ScanIndexForward=False,
             Limit=limit
         )
@@ -650,19 +1105,13 @@ def get_tremor_analysis(patient_id: str, start_time: Optional[int] = None, end_t
         # Post-processing
         for item in items:
             # Convert Decimals to float/int
-            for k, v in item.items():
-                if isinstance(v, Decimal):
-                    if v % 1 == 0:
-                        item[k] = int(v)
-                    else:
-                        item[k] = float(v)
+            _plain_numbers(item, TREMOR_NUMERIC_FIELDS)
             
             # Convert timestamp string back to int for API response model
             if "timestamp" in item and isinstance(item["timestamp"], str):
                 try:
                     # Parse ISO string to timestamp
-                    dt = datetime.fromisoformat(item["timestamp"].replace("Z", "+00:00"))
-                    item["timestamp"] = int(dt.timestamp())
+                    item["timestamp"] = _iso_to_epoch(item["timestamp"])
                 except Exception:
                     pass # Keep as is if parsing fails
                         
@@ -674,17 +1123,34 @@ def get_tremor_analysis(patient_id: str, start_time: Optional[int] = None, end_t
 
 # ============== Audit Logs ==============
 
+# eventTypeSeverity-index is sparse: rows written before put_audit_log added
+# the composite attribute are missing from it. It is only queried once the
+# deploy marks it ready, after backfill_audit_event_type_severity has run.
+AUDIT_EVENT_SEVERITY_INDEX_READY = os.environ.get("AUDIT_EVENT_SEVERITY_INDEX_READY", "false").lower() == "true"
+
+def _event_type_severity(log: Dict[str, Any]) -> str:
+    return f"{log.get('eventType')}#{log.get('severity')}"
+
 def put_audit_log(log: Dict[str, Any]) -> bool:
     """Store an audit log entry"""
     if USE_MEMORY:
-        _audit_logs.insert(0, log)
-        # Keep only last 10000 logs in memory
-        if len(_audit_logs) > 10000:
-            _audit_logs.pop()
+        # Bounded deque keeps only the last 10000 logs in memory. The entry
+        # about to be evicted is the oldest of its event type and user too,
+        # so it drops off the right end of their index deques.
+        if len(_audit_logs) == _audit_logs.maxlen:
+            evicted = _audit_logs[-1]
+            _audit_by_event[evicted.get("eventType")].pop()
+            _audit_by_user[evicted.get("userId")].pop()
+        _audit_logs.appendleft(log)
+        _audit_by_event.setdefault(log.get("eventType"), deque()).appendleft(log)
+        _audit_by_user.setdefault(log.get("userId"), deque()).appendleft(log)
         return True
     
     try:
-        T_AUDIT_LOGS.put_item(Item=log)
+        # Composite key for eventTypeSeverity-index, so event type + severity
+        # queries match by key condition instead of a post-read filter
+        item = {**log, "eventTypeSeverity": _event_type_severity(log)}
+        T_AUDIT_LOGS.put_item(Item=item)
         return True
     except Exception as e:
         print(f"Error storing audit log: {e}")
@@ -702,85 +1168,69 @@ def get_audit_logs(
 ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
     """Query audit logs with optional filters"""
     if USE_MEMORY:
-        items = _audit_logs.copy()
+        # Start from the narrowest index, filter the rest lazily and stop
+        # once limit entries have matched
         if event_type:
-            items = [i for i in items if i.get("eventType") == event_type]
-        if user_id:
-            items = [i for i in items if i.get("userId") == user_id]
+            items = _audit_by_event.get(event_type, ())
+            if user_id:
+                items = (i for i in items if i.get("userId") == user_id)
+        elif user_id:
+            items = _audit_by_user.get(user_id, ())
+        else:
+            items = _audit_logs
         if severity:
-            items = [i for i in items if i.get("severity") == severity]
+            items = (i for i in items if i.get("severity") == severity)
         if start_time:
-            items = [i for i in items if i.get("sk", "") >= start_time]
+            items = (i for i in items if i.get("sk", "") >= start_time)
         if end_time:
-            items = [i for i in items if i.get("sk", "") <= end_time]
-        return items[:limit], None
+            items = (i for i in items if i.get("sk", "") <= end_time)
+        return list(itertools.islice(items, limit)), None
     
     try:
-        # Use GSI based on filter
-        if event_type:
-            key_condition = Key("eventType").eq(event_type)
-            if start_time and end_time:
-                key_condition = key_condition & Key("sk").between(start_time, end_time)
-            elif start_time:
-                key_condition = key_condition & Key("sk").gte(start_time)
-            
-            params = {
-                "IndexName": "eventType-index",
-                "KeyConditionExpression": key_condition,
-                "ScanIndexForward": False,
-                "Limit": limit
-            }
+        # Pick the index whose key covers the most filters; severity falls
+        # back to a FilterExpression when no index covers it
+        filter_severity = False
+        if event_type and severity and AUDIT_EVENT_SEVERITY_INDEX_READY:
+            index, pk_attr, pk = "eventTypeSeverity-index", "eventTypeSeverity", f"{event_type}#{severity}"
+        elif event_type:
+            index, pk_attr, pk = "eventType-index", "eventType", event_type
+            filter_severity = bool(severity)
         elif user_id:
-            key_condition = Key("userId").eq(user_id)
-            if start_time and end_time:
-                key_condition = key_condition & Key("sk").between(start_time, end_time)
-            elif start_time:
-                key_condition = key_condition & Key("sk").gte(start_time)
-            
-            params = {
-                "IndexName": "userId-index",
-                "KeyConditionExpression": key_condition,
-                "ScanIndexForward": False,
-                "Limit": limit
-            }
+            index, pk_attr, pk = "userId-index", "userId", user_id
+            filter_severity = bool(severity)
+        elif severity:
+            index, pk_attr, pk = "severity-index", "severity", severity
         else:
             # Scan all logs (use partition key ALL for all logs)
-            key_condition = Key("pk").eq("AUDIT#ALL")
-            if start_time and end_time:
-                key_condition = key_condition & Key("sk").between(start_time, end_time)
-            elif start_time:
-                key_condition = key_condition & Key("sk").gte(start_time)
-            
-            params = {
-                "KeyConditionExpression": key_condition,
-                "ScanIndexForward": False,
-                "Limit": limit
-            }
+            index, pk_attr, pk = None, "pk", "AUDIT#ALL"
+        
+        params = {
+            **_key_condition(pk_attr, pk, "sk", start_time or None, end_time or None),
+            "ScanIndexForward": False,
+            "Limit": limit
+        }
+        if index:
+            params["IndexName"] = index
         
         if next_token:
-            import json
-            import base64
             params["ExclusiveStartKey"] = json.loads(base64.b64decode(next_token).decode())
         
-        # Add severity filter if specified
-        if severity:
-            params["FilterExpression"] = Attr("severity").eq(severity)
+        if filter_severity:
+            params["FilterExpression"] = "#sev = :sev"
+            params["ExpressionAttributeNames"]["#sev"] = "severity"
+            params["ExpressionAttributeValues"][":sev"] = severity
         
         resp = T_AUDIT_LOGS.query(**params)
         items = resp.get("Items", [])
         
         # Convert Decimals
         for item in items:
-            for k, v in item.items():
-                if isinstance(v, Decimal):
-                    item[k] = int(v) if v % 1 == 0 else float(v)
+            _plain_numbers(item, AUDIT_NUMERIC_FIELDS)
         
         # Encode next token
         last_key = resp.get("LastEvaluatedKey")
         token = None
         if last_key:
-            import json
-            import base64
             token = base64.b64encode(json.dumps(last_key).encode()).decode()
         
         return items, token
@@ -789,6 +1239,37 @@ def get_audit_logs(
         return [], None
 
 
+def backfill_audit_event_type_severity() -> int:
+    """
+    One-off migration: add eventTypeSeverity to audit rows written before it
+    existed, so eventTypeSeverity-index covers the whole log. Safe to re-run;
+    returns the number of rows updated.
+    """
+    if USE_MEMORY:
+        return 0
+    kw = {
+        "FilterExpression": "attribute_exists(eventType) AND attribute_not_exists(eventTypeSeverity)",
+        "ProjectionExpression": "pk, sk, eventType, severity",
+    }
+    updated = 0
+    while True:
+        resp = T_AUDIT_LOGS.scan(**kw)
+        for item in resp.get("Items", []):
+            try:
+                T_AUDIT_LOGS.update_item(
+                    Key={"pk": item["pk"], "sk": item["sk"]},
+                    UpdateExpression="SET eventTypeSeverity = :v",
+                    ConditionExpression="attribute_exists(pk)",
+                    ExpressionAttributeValues={":v": _event_type_severity(item)}
+                )
+                updated += 1
+            except T_AUDIT_LOGS.meta.client.exceptions.ConditionalCheckFailedException:
+                pass  # Row removed (TTL) since the scan
+        if "LastEvaluatedKey" not in resp:
+            return updated
+        kw["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
 # ============== System Settings ==============
 
 def get_system_setting(key: str) -> Optional[Dict[str, Any]]:
@@ -796,46 +1277,129 @@ def get_system_setting(key: str) -> Optional[Dict[str, Any]]:
     if USE_MEMORY:
         return _system_settings.get(key)
     
+    item = _setting_cache.get(key)
+    if item is not None:
+        return item
+    generation = _setting_cache.generation()
     try:
-        resp = T_SYSTEM_SETTINGS.get_item(Key={"settingKey": key})
-        return resp.get("Item")
+        item = T_SYSTEM_SETTINGS.get_item(Key={"settingKey": key}).get("Item")
+        if item is not None:
+            _setting_cache.put(key, item, generation)
+        return item
     except Exception as e:
         print(f"Error getting system setting: {e}")
         return None
 
 
+# Settings change rarely; the full table is re-read at most every 60 s per
+# container, and put_system_setting drops the cached copy
+SETTINGS_CACHE_TTL_SECONDS = 60
+_settings_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+
+# Row in the system settings table holding the dashboard's running totals
+_COUNTERS_KEY = "__counters__"
+
 def get_all_system_settings() -> Dict[str, Any]:
     """Get all system settings"""
+    global _settings_cache
     if USE_MEMORY:
         return {k: v.get("value") for k, v in _system_settings.items()}
     
+    if _settings_cache is not None and _settings_cache[0] > time.monotonic():
+        return dict(_settings_cache[1])
+    generation = _setting_cache.generation()
     try:
-        resp = T_SYSTEM_SETTINGS.scan()
-        items = resp.get("Items", [])
-        return {item["settingKey"]: item.get("value") for item in items}
+        settings: Dict[str, Any] = {}
+        kw = {
+            "ProjectionExpression": "settingKey, #v",
+            "ExpressionAttributeNames": {"#v": "value"},
+        }
+        while True:
+            resp = T_SYSTEM_SETTINGS.scan(**kw)
+            for item in resp.get("Items", []):
+                if item["settingKey"] != _COUNTERS_KEY:
+                    settings[item["settingKey"]] = item.get("value")
+            if "LastEvaluatedKey" not in resp:
+                break
+            kw["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+        # put_system_setting pops _setting_cache; skip caching a scan that raced it
+        if generation == _setting_cache.generation():
+            _settings_cache = (time.monotonic() + SETTINGS_CACHE_TTL_SECONDS, settings)
+        return dict(settings)
     except Exception as e:
         print(f"Error getting all system settings: {e}")
         return {}
 
 
+def increment_counter(name: str, delta: int = 1) -> None:
+    """Atomically adjust a dashboard counter (no-op in memory mode, which counts directly)"""
+    if USE_MEMORY:
+        return
+    try:
+        T_SYSTEM_SETTINGS.update_item(
+            Key={"settingKey": _COUNTERS_KEY},
+            UpdateExpression="ADD #n :d",
+            ExpressionAttributeNames={"#n": name},
+            ExpressionAttributeValues={":d": delta}
+        )
+    except Exception as e:
+        print(f"Error updating counter {name}: {e}")
+
+
+def _counter_tables() -> Dict[str, Any]:
+    return {"users": T_USERS, "devices": T_DEVICES}
+
+
+def _get_counters() -> Dict[str, int]:
+    """
+    Read the dashboard counters row. Increments can land before any read, so
+    the row may exist with partial deltas; a counter counts as valid only once
+    its name is in the row's "seeded" set. Unseeded counters are corrected to
+    a consistent COUNT scan by ADDing the difference from the value read before
+    the scan, so increments landing while it runs are kept rather than
+    overwritten.
+    """
+    item = T_SYSTEM_SETTINGS.get_item(Key={"settingKey": _COUNTERS_KEY}).get("Item") or {}
+    seeded = item.get("seeded") or set()
+    counters = {name: int(item.get(name, 0)) for name in _counter_tables()}
+    unseeded = [name for name in counters if name not in seeded]
+    if unseeded:
+        with ThreadPoolExecutor(max_workers=len(unseeded)) as pool:
+            counts = dict(zip(unseeded, pool.map(
+                lambda name: _count(_counter_tables()[name].scan, ConsistentRead=True), unseeded)))
+        for name, count in counts.items():
+            try:
+                resp = T_SYSTEM_SETTINGS.update_item(
+                    Key={"settingKey": _COUNTERS_KEY},
+                    UpdateExpression="ADD #n :d, seeded :s",
+                    ConditionExpression="attribute_not_exists(seeded) OR NOT contains(seeded, :name)",
+                    ExpressionAttributeNames={"#n": name},
+                    ExpressionAttributeValues={":d": count - counters[name], ":s": {name}, ":name": name},
+                    ReturnValues="UPDATED_NEW"
+                )
+                counters[name] = int(resp["Attributes"][name])
+            except T_SYSTEM_SETTINGS.meta.client.exceptions.ConditionalCheckFailedException:
+                counters[name] = count  # Seeded concurrently
+    return counters
+
+
 def put_system_setting(key: str, value: Any, updated_by: str) -> bool:
     """Update a system setting"""
+    global _settings_cache
+    setting = {
+        "settingKey": key,
+        "value": value,
+        "updatedAt": datetime.now(timezone.utc).isoformat(),
+        "updatedBy": updated_by
+    }
     if USE_MEMORY:
-        _system_settings[key] = {
-            "settingKey": key,
-            "value": value,
-            "updatedAt": datetime.now(timezone.utc).isoformat(),
-            "updatedBy": updated_by
-        }
+        _system_settings[key] = setting
         return True
     
     try:
-        T_SYSTEM_SETTINGS.put_item(Item={
-            "settingKey": key,
-            "value": value,
-            "updatedAt": datetime.now(timezone.utc).isoformat(),
-            "updatedBy": updated_by
-        })
+        T_SYSTEM_SETTINGS.put_item(Item=setting)
+        _settings_cache = None
+        _setting_cache.pop(key)
         return True
     except Exception as e:
         print(f"Error updating system setting: {e}")
@@ -846,95 +1410,243 @@ def put_system_setting(key: str, value: Any, updated_by: str) -> bool:
 
 def create_conversation(conversation_id: str, participants: List[str], created_by: str) -> Dict[str, Any]:
     """Create a new conversation"""
+    now = datetime.now(timezone.utc).isoformat()
     conversation = {
         "conversationId": conversation_id,
         "participants": participants,
-        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "createdAt": now,
         "createdBy": created_by,
-        "lastMessageAt": datetime.now(timezone.utc).isoformat(),
+        "lastMessageAt": now,
         "lastMessagePreview": ""
     }
     
     if USE_MEMORY:
-        # Store in memory (simplified)
+        _conversations[conversation_id] = conversation
+        for pid in participants:
+            _conversations_by_user.setdefault(pid, []).append(conversation)
         return conversation
     
-    # For DynamoDB, we store conversation metadata with messageId = "METADATA"
+    # For DynamoDB, we store conversation metadata once with messageId =
+    # "METADATA" (indexed under the first participant), plus a thin
+    # "MEMBER#<id>" pointer row per other participant. Only these rows carry
+    # lastMessageAt, so participantRecent-index holds exactly one entry per
+    # (participant, conversation), ordered by latest activity.
     try:
-        T_MESSAGES.put_item(Item={
-            **conversation,
-            "messageId": "METADATA",
-            "participantId": participants[0]  # Primary participant for indexing
-        })
-        # Also create index entries for other participants
-        for pid in participants[1:]:
-            T_MESSAGES.put_item(Item={
+        with T_MESSAGES.batch_writer() as bw:
+            bw.put_item(Item={
                 **conversation,
                 "messageId": "METADATA",
-                "participantId": pid
+                "participantId": participants[0]  # Primary participant for indexing
             })
+            for pid in participants[1:]:
+                bw.put_item(Item={
+                    "conversationId": conversation_id,
+                    "messageId": f"MEMBER#{pid}",
+                    "participantId": pid,
+                    "lastMessageAt": now
+                })
+        _participants_cache.put(conversation_id, {"participants": participants})
         return conversation
     except Exception as e:
         print(f"Error creating conversation: {e}")
         return conversation
 
 
+# participantRecent-index is sparse: conversations whose pointer rows predate
+# lastMessageAt are missing from it. Listings use it once the deploy marks it
+# ready, after backfill_conversation_pointers has run.
+CONVERSATION_RECENT_INDEX_READY = os.environ.get("CONVERSATION_RECENT_INDEX_READY", "false").lower() == "true"
+
+def _get_conversations_by_participant(user_id: str, limit: int) -> List[Dict[str, Any]]:
+    """Listing through participantId-index, used until participantRecent-index is ready"""
+    try:
+        # "MEMBER#" < "METADATA" < "MSG#", so one sort key range finds both
+        # kinds of row and skips the user's messages
+        resp = T_MESSAGES.query(
+            IndexName="participantId-index",
+            **_key_condition("participantId", user_id, "messageId", "MEMBER#", "METADATA"),
+            Limit=limit
+        )
+        items = resp.get("Items", [])
+        # Resolve pointer rows to their conversation's METADATA row
+        pointed = _batch_get(
+            T_MESSAGES,
+            [{"conversationId": i["conversationId"], "messageId": "METADATA"}
+             for i in items if i["messageId"] != "METADATA"],
+            "conversationId"
+        )
+        conversations = []
+        for i in items:
+            if i["messageId"] == "METADATA":
+                conversations.append(i)
+            elif i["conversationId"] in pointed:
+                conversations.append(pointed[i["conversationId"]])
+        return conversations
+    except Exception as e:
+        print(f"Error getting conversations: {e}")
+        return []
+
 def get_conversations(user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
     """Get conversations for a user"""
     if USE_MEMORY:
-        return [m for m in _messages if user_id in m.get("participants", [])][:limit]
+        return heapq.nlargest(limit, _conversations_by_user.get(user_id, ()),
+                              key=lambda c: c.get("lastMessageAt", ""))
+    
+    if not CONVERSATION_RECENT_INDEX_READY:
+        return _get_conversations_by_participant(user_id, limit)
     
     try:
+        # Keys-only index rows come back most recently active first; fetch
+        # the METADATA rows for just that page
         resp = T_MESSAGES.query(
-            IndexName="participantId-index",
-            KeyConditionExpression=Key("participantId").eq(user_id) & Key("messageId").eq("METADATA"),
+            IndexName="participantRecent-index",
+            **_key_condition("participantId", user_id),
+            ScanIndexForward=False,
             Limit=limit
         )
-        return resp.get("Items", [])
+        conversation_ids = [i["conversationId"] for i in resp.get("Items", [])]
+        found = _batch_get(
+            T_MESSAGES,
+            [{"conversationId": cid, "messageId": "METADATA"} for cid in conversation_ids],
+            "conversationId"
+        )
+        return [found[cid] for cid in conversation_ids if cid in found]
     except Exception as e:
         print(f"Error getting conversations: {e}")
         return []
 
 
+# Characters of the latest message kept on the conversation for list views
+MESSAGE_PREVIEW_LENGTH = 100
+
 def send_message(conversation_id: str, sender_id: str, content: str, message_type: str = "text") -> Dict[str, Any]:
     """Send a message in a conversation"""
-    message_id = f"MSG#{datetime.now(timezone.utc).isoformat()}#{secrets.token_hex(4)}"
+    now = datetime.now(timezone.utc).isoformat()
+    message_id = f"MSG#{now}#{secrets.token_hex(4)}"
     message = {
         "conversationId": conversation_id,
         "messageId": message_id,
         "senderId": sender_id,
         "content": content,
         "messageType": message_type,
-        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "createdAt": now,
         "readBy": [sender_id]
     }
     
+    preview = content[:MESSAGE_PREVIEW_LENGTH]
+    
     if USE_MEMORY:
-        _messages.append(message)
+        msgs = _messages_by_conv.get(conversation_id)
+        if msgs is None:
+            msgs = _messages_by_conv[conversation_id] = deque(maxlen=MEMORY_MESSAGES_PER_CONVERSATION)
+        msgs.append(message)
+        conversation = _conversations.get(conversation_id)
+        if conversation is not None:
+            conversation["lastMessageAt"] = now
+            conversation["lastMessagePreview"] = preview
         return message
     
     try:
-        T_MESSAGES.put_item(Item={
-            **message,
-            "participantId": sender_id  # For indexing
-        })
+        item = {**message, "participantId": sender_id}  # For indexing
+        # The pointer row keys come from the participant list; it only needs
+        # reading once per container, after which a send is one transaction
+        metadata = _participants_cache.get(conversation_id)
+        if metadata is None:
+            metadata = T_MESSAGES.get_item(
+                Key={"conversationId": conversation_id, "messageId": "METADATA"},
+                ProjectionExpression="participants"
+            ).get("Item")
+            if metadata is None:
+                T_MESSAGES.put_item(Item=item)
+                return message  # No METADATA row to point at
+            _participants_cache.put(conversation_id, metadata)
+        # The message and the bumps of the conversation's participantRecent-index
+        # rows commit together, so no participant's listing runs ahead of or
+        # behind the stored messages. Missing pointer rows are recreated.
+        actions = [
+            {"Put": {"TableName": T_MESSAGES.name, "Item": item}},
+            {"Update": {
+                "TableName": T_MESSAGES.name,
+                "Key": {"conversationId": conversation_id, "messageId": "METADATA"},
+                "UpdateExpression": "SET lastMessageAt = :t, lastMessagePreview = :p",
+                "ConditionExpression": "attribute_exists(messageId)",
+                "ExpressionAttributeValues": {":t": now, ":p": preview}
+            }},
+        ]
+        for pid in metadata.get("participants", [])[1:]:
+            actions.append({"Update": {
+                "TableName": T_MESSAGES.name,
+                "Key": {"conversationId": conversation_id, "messageId": f"MEMBER#{pid}"},
+                "UpdateExpression": "SET participantId = :pid, lastMessageAt = :t",
+                "ExpressionAttributeValues": {":pid": pid, ":t": now}
+            }})
+        _transact_write(T_MESSAGES, actions)
         return message
     except Exception as e:
         print(f"Error sending message: {e}")
         return message
 
 
+def backfill_conversation_pointers() -> int:
+    """
+    One-off migration for conversations written before participantRecent-index:
+    older METADATA rows may be indexed under a later participant and lack
+    MEMBER# pointer rows, and older pointer rows lack lastMessageAt, so those
+    conversations are missing from get_conversations. Each conversation is
+    rewritten in one transaction; values already set by newer sends are kept.
+    Safe to re-run; returns the number of conversations updated.
+    """
+    if USE_MEMORY:
+        return 0
+    kw = {
+        "FilterExpression": "messageId = :m",
+        "ProjectionExpression": "conversationId, participants, lastMessageAt, createdAt",
+        "ExpressionAttributeValues": {":m": "METADATA"},
+    }
+    updated = 0
+    while True:
+        resp = T_MESSAGES.scan(**kw)
+        for item in resp.get("Items", []):
+            participants = item.get("participants") or []
+            if not participants:
+                continue
+            cid = item["conversationId"]
+            last = item.get("lastMessageAt") or item.get("createdAt") or ""
+            actions = [{"Update": {
+                "TableName": T_MESSAGES.name,
+                "Key": {"conversationId": cid, "messageId": "METADATA"},
+                "UpdateExpression": "SET participantId = :pid, lastMessageAt = if_not_exists(lastMessageAt, :t)",
+                "ConditionExpression": "attribute_exists(messageId)",
+                "ExpressionAttributeValues": {":pid": participants[0], ":t": last}
+            }}]
+            for pid in participants[1:]:
+                actions.append({"Update": {
+                    "TableName": T_MESSAGES.name,
+                    "Key": {"conversationId": cid, "messageId": f"MEMBER#{pid}"},
+                    "UpdateExpression": "SET participantId = :pid, lastMessageAt = if_not_exists(lastMessageAt, :t)",
+                    "ExpressionAttributeValues": {":pid": pid, ":t": last}
+                }})
+            try:
+                _transact_write(T_MESSAGES, actions)
+                updated += 1
+            except T_MESSAGES.meta.client.exceptions.TransactionCanceledException as e:
+                print(f"[db] Conversation {cid} not backfilled: {e}")
+        if "LastEvaluatedKey" not in resp:
+            return updated
+        kw["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
 def get_messages(conversation_id: str, limit: int = 50, before: Optional[str] = None) -> List[Dict[str, Any]]:
     """Get messages in a conversation"""
     if USE_MEMORY:
-        msgs = [m for m in _messages if m.get("conversationId") == conversation_id]
-        msgs.sort(key=lambda x: x.get("createdAt", ""), reverse=True)
-        return msgs[:limit]
+        # Appended in send order, so newest first is the reversed tail
+        return list(itertools.islice(reversed(_messages_by_conv.get(conversation_id, ())), limit))
     
     try:
-        key_condition = Key("conversationId").eq(conversation_id) & Key("messageId").begins_with("MSG#")
         params = {
-            "KeyConditionExpression": key_condition,
+            "KeyConditionExpression": _KEY_PREFIX_CONDITION,
+            "ExpressionAttributeNames": {"#pk": "conversationId", "#sk": "messageId"},
+            "ExpressionAttributeValues": {":pk": conversation_id, ":prefix": "MSG#"},
             "ScanIndexForward": False,
             "Limit": limit
         }
@@ -952,16 +1664,20 @@ def get_messages(conversation_id: str, limit: int = 50, before: Optional[str] =
 
 def create_symptom_record(patient_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
     """Create a new symptom record"""
-    record_id = f"SYM#{datetime.now(timezone.utc).isoformat()}#{secrets.token_hex(4)}"
+    now = datetime.now(timezone.utc).isoformat()
+    record_id = f"SYM#{now}#{secrets.token_hex(4)}"
     symptom = {
         "patientId": patient_id,
         "recordId": record_id,
-        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "createdAt": now,
         **record
     }
     
     if USE_MEMORY:
-        _symptoms.append(symptom)
+        records = _symptoms.setdefault(symptom["patientId"], {})
+        records[symptom["recordId"]] = symptom
+        if len(records) > MEMORY_SYMPTOMS_PER_PATIENT:
+            del records[next(iter(records))]
         return symptom
     
     try:
@@ -975,9 +1691,8 @@ def create_symptom_record(patient_id: str, record: Dict[str, Any]) -> Dict[str,
 def get_symptom_records(patient_id: str, limit: int = 50) -> List[Dict[str, Any]]:
     """Get symptom records for a patient"""
     if USE_MEMORY:
-        items = [s for s in _symptoms if s.get("patientId") == patient_id]
-        items.sort(key=lambda x: x.get("createdAt", ""), reverse=True)
-        return items[:limit]
+        return heapq.nlargest(limit, _symptoms.get(patient_id, {}).values(),
+                              key=lambda x: x.get("createdAt", ""))
     
     try:
         resp = T_SYMPTOMS.query(
@@ -994,8 +1709,7 @@ def get_symptom_records(patient_id: str, limit: int = 50) -> List[Dict[str, Any]
 def delete_symptom_record(patient_id: str, record_id: str) -> bool:
     """Delete a symptom record"""
     if USE_MEMORY:
-        global _symptoms
-        _symptoms = [s for s in _symptoms if not (s.get("patientId") == patient_id and s.get("recordId") == record_id)]
+        _symptoms.get(patient_id, {}).pop(record_id, None)
         return True
     
     try:
@@ -1008,6 +1722,16 @@ def delete_symptom_record(patient_id: str, record_id: str) -> bool:
 
 # ============== Reports ==============
 
+def _index_report(r: Dict[str, Any]) -> None:
+    if r.get("patientId") is not None:
+        _reports_by_patient.setdefault(r["patientId"], {})[r["reportId"]] = None
+    if r.get("authorId") is not None:
+        _reports_by_author.setdefault(r["authorId"], {})[r["reportId"]] = None
+
+def _unindex_report(r: Dict[str, Any]) -> None:
+    _reports_by_patient.get(r.get("patientId"), {}).pop(r["reportId"], None)
+    _reports_by_author.get(r.get("authorId"), {}).pop(r["reportId"], None)
+
 def create_report(report: Dict[str, Any]) -> Dict[str, Any]:
     """Create a new report"""
     report_id = f"RPT-{secrets.token_hex(6).upper()}"
@@ -1019,7 +1743,10 @@ def create_report(report: Dict[str, Any]) -> Dict[str, Any]:
     }
     
     if USE_MEMORY:
-        _reports.append(report_data)
+        _reports[report_data["reportId"]] = report_data
+        _index_report(report_data)
+        if len(_reports) > MEMORY_REPORTS:
+            _unindex_report(_reports.pop(next(iter(_reports))))
         return report_data
     
     try:
@@ -1037,26 +1764,29 @@ def get_reports(
 ) -> List[Dict[str, Any]]:
     """Get reports with optional filters"""
     if USE_MEMORY:
-        items = _reports.copy()
         if patient_id:
-            items = [r for r in items if r.get("patientId") == patient_id]
-        if author_id:
-            items = [r for r in items if r.get("authorId") == author_id]
-        items.sort(key=lambda x: x.get("createdAt", ""), reverse=True)
-        return items[:limit]
+            items = (_reports[rid] for rid in _reports_by_patient.get(patient_id, ()))
+            if author_id:
+                items = (r for r in items if r.get("authorId") == author_id)
+        elif author_id:
+            items = (_reports[rid] for rid in _reports_by_author.get(author_id, ()))
+        else:
+            items = _reports.values()
+        # createdAt can come from the request body, so order explicitly
+        return heapq.nlargest(limit, items, key=lambda x: x.get("createdAt", ""))
     
     try:
         if patient_id:
             resp = T_REPORTS.query(
                 IndexName="patientId-index",
-                KeyConditionExpression=Key("patientId").eq(patient_id),
+                **_key_condition("patientId", patient_id),
                 ScanIndexForward=False,
                 Limit=limit
             )
         elif author_id:
             resp = T_REPORTS.query(
                 IndexName="authorId-index",
-                KeyConditionExpression=Key("authorId").eq(author_id),
+                **_key_condition("authorId", author_id),
                 ScanIndexForward=False,
                 Limit=limit
             )
@@ -1072,14 +1802,17 @@ def get_reports(
 def get_report(report_id: str) -> Optional[Dict[str, Any]]:
     """Get a single report by ID"""
     if USE_MEMORY:
-        for r in _reports:
-            if r.get("reportId") == report_id:
-                return r
-        return None
+        return _reports.get(report_id)
     
+    item = _report_cache.get(report_id)
+    if item is not None:
+        return item
+    generation = _report_cache.generation()
     try:
-        resp = T_REPORTS.get_item(Key={"reportId": report_id})
-        return resp.get("Item")
+        item = T_REPORTS.get_item(Key={"reportId": report_id}).get("Item")
+        if item is not None:
+            _report_cache.put(report_id, item, generation)
+        return item
     except Exception as e:
         print(f"Error getting report: {e}")
         return None
@@ -1088,22 +1821,19 @@ def get_report(report_id: str) -> Optional[Dict[str, Any]]:
 def update_report(report_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """Update a report"""
     if USE_MEMORY:
-        for i, r in enumerate(_reports):
-            if r.get("reportId") == report_id:
-                _reports[i].update(updates)
-                _reports[i]["updatedAt"] = datetime.now(timezone.utc).isoformat()
-                return _reports[i]
-        return None
+        r = _reports.get(report_id)
+        if r is None:
+            return None
+        _unindex_report(r)
+        r.update(updates)
+        r["updatedAt"] = datetime.now(timezone.utc).isoformat()
+        _index_report(r)
+        return r
     
     try:
-        update_expr = "SET " + ", ".join(f"#{k} = :{k}" for k in updates.keys())
-        update_expr += ", #updatedAt = :updatedAt"
-        
-        expr_names = {f"#{k}": k for k in updates.keys()}
-        expr_names["#updatedAt"] = "updatedAt"
-        
-        expr_values = {f":{k}": v for k, v in updates.items()}
-        expr_values[":updatedAt"] = datetime.now(timezone.utc).isoformat()
+        update_expr, expr_names, expr_values = _update_args(
+            {**updates, "updatedAt": datetime.now(timezone.utc).isoformat()}
+        )
         
         resp = T_REPORTS.update_item(
             Key={"reportId": report_id},
@@ -1112,6 +1842,7 @@ def update_report(report_id: str, updates: Dict[str, Any]) -> Optional[Dict[str,
             ExpressionAttributeValues=expr_values,
             ReturnValues="ALL_NEW"
         )
+        _report_cache.pop(report_id)
         return resp.get("Attributes")
     except Exception as e:
         print(f"Error updating report: {e}")
@@ -1121,12 +1852,14 @@ def update_report(report_id: str, updates: Dict[str, Any]) -> Optional[Dict[str,
 def delete_report(report_id: str) -> bool:
     """Delete a report"""
     if USE_MEMORY:
-        global _reports
-        _reports = [r for r in _reports if r.get("reportId") != report_id]
+        r = _reports.pop(report_id, None)
+        if r is not None:
+            _unindex_report(r)
         return True
     
     try:
         T_REPORTS.delete_item(Key={"reportId": report_id})
+        _report_cache.pop(report_id)
         return True
     except Exception as e:
         print(f"Error deleting report: {e}")
@@ -1138,33 +1871,35 @@ def delete_report(report_id: str) -> bool:
 def get_dashboard_stats() -> Dict[str, Any]:
     """Get dashboard statistics for admin"""
     if USE_MEMORY:
+        # One pass per table, counting without building filtered lists
+        roles = Counter(u.get("role") for u in _users.values())
         return {
             "totalUsers": len(_users),
-            "totalDoctors": len([u for u in _users.values() if u.get("role") == "doctor"]),
-            "totalPatients": len([u for u in _users.values() if u.get("role") == "patient"]),
+            "totalDoctors": roles["doctor"],
+            "totalPatients": roles["patient"],
             "totalDevices": len(_devices),
-            "activeDevices": len([d for d in _devices if d.get("status") == "active"]),
-            "activeSessions": len([s for s in _sessions.values() if s.get("status") == "active"]),
+            "activeDevices": sum(d.get("status") == "active" for d in _devices.values()),
+            "activeSessions": sum(s.get("status") == "active" for s in _sessions.values()),
             "totalReports": len(_reports),
             "recentAuditLogs": len(_audit_logs)
         }
     
     try:
-        # Count users by role
-        users_resp = T_USERS.scan(Select="COUNT")
-        total_users = users_resp.get("Count", 0)
-        
-        # Count devices
-        devices_resp = T_DEVICES.scan(Select="COUNT")
-        total_devices = devices_resp.get("Count", 0)
-        
-        # Count active sessions
-        sessions_resp = T_SESSIONS.query(
-            IndexName="status-index",
-            KeyConditionExpression=Key("status").eq("active"),
-            Select="COUNT"
-        )
-        active_sessions = sessions_resp.get("Count", 0)
+        # The counters row read and the active session count are independent
+        # round-trips, so issue them concurrently
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            counters_future = pool.submit(_get_counters)
+            sessions_future = pool.submit(
+                _count,
+                T_SESSIONS.query,
+                IndexName="status-index",
+                KeyConditionExpression=Key("status").eq("active")
+            )
+            # User and device totals come from the counters row, not table scans
+            counters = counters_future.result()
+            active_sessions = sessions_future.result()
+        total_users = counters.get("users", 0)
+        total_devices = counters.get("devices", 0)
         
         return {
             "totalUsers": total_users,
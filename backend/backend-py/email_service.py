@@ -3,9 +3,132 @@ Email service for sending verification codes
 Supports multiple email providers (AWS SES, SendGrid, SMTP)
 """
 import os
+import re
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Tuple
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+# Diagnostics go through logging with deferred %-formatting, so DEBUG chatter
+# costs nothing unless enabled; sends and failures are logged at INFO/ERROR
+logger = logging.getLogger("medusa.email")
+
+# SES settings are fixed for the life of the process
+_USE_SES = os.environ.get("USE_SES", "false").lower() == "true"
+# Use SES_REGION if provided, otherwise use AWS_REGION (auto-provided by Lambda)
+_SES_REGION = os.environ.get("SES_REGION") or os.environ.get("AWS_REGION", "us-east-1")
+
+# Kept-alive pooled connections so warm Lambda containers reuse the TLS
+# session instead of handshaking per email
+_SES_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={"max_attempts": 3, "mode": "adaptive"},
+    connect_timeout=2,
+    read_timeout=5,
+)
+
+# Patterns for deriving the text/plain part from the HTML templates
+_STYLE_RE = re.compile(r'<style[^>]*>.*?</style>', re.DOTALL | re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+_WS_RE = re.compile(r'\s+')
+
+# Rules common to every email template, in the templates' str.format escaping
+_SHARED_CSS = """\
+                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+                .content {{ background: #f8f9fa; padding: 30px; border-radius: 5px; }}
+                .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 12px; }}
+"""
+
+# Client-side pacing to the account's SES send quota: re-read MaxSendRate
+# this often, halve the pace on throttling, regrow by this much per success
+SES_QUOTA_REFRESH_SECONDS = 300
+SES_RATE_INCREASE = 0.5
+
+
+def _html_to_text(html_body: str) -> str:
+    """Plain-text alternative of an HTML body for better deliverability"""
+    text_body = _STYLE_RE.sub('', html_body)  # Drop CSS, which is not text
+    text_body = _TAG_RE.sub('', text_body)  # Strip HTML tags
+    return _WS_RE.sub(' ', text_body).strip()  # Clean whitespace
+
+class _SendRateLimiter:
+    """
+    Token bucket paced at the account's SES MaxSendRate (emails per second),
+    re-read with GetSendQuota every SES_QUOTA_REFRESH_SECONDS. Throttling
+    halves the pace and successes regrow it additively (AIMD).
+    
+    The bucket is per process, so it only smooths bursts within one Lambda
+    container: concurrent containers can still exceed the account-wide quota
+    together, and SES throttling plus botocore's adaptive retries remain the
+    backstop for that. Waits sleep the calling request thread. Until the
+    quota has been read the limiter lets sends through unpaced.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.max_rate = None
+        self.rate = None
+        self._tokens = 0.0
+        self._stamp = time.monotonic()
+        self._quota_checked = float("-inf")
+    
+    def acquire(self, ses_client, count: int = 1) -> None:
+        """Reserve count sends, sleeping until the bucket covers them"""
+        with self._lock:
+            # Claim the refresh so one caller fetches while the rest keep
+            # sending at the current pace
+            now = time.monotonic()
+            refresh = now - self._quota_checked >= SES_QUOTA_REFRESH_SECONDS
+            if refresh:
+                self._quota_checked = now
+        if refresh:
+            self._refresh_quota(ses_client)
+        with self._lock:
+            if self.rate is None:
+                return
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            # Going negative reserves the tokens, so later callers queue behind
+            self._tokens -= count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+    
+    def _refresh_quota(self, ses_client) -> None:
+        """Read MaxSendRate without holding the lock, then swap it in"""
+        try:
+            max_rate = float(ses_client.get_send_quota()['MaxSendRate'])
+        except Exception as e:
+            logger.warning("Could not read SES send quota: %s", e)
+            return
+        if max_rate <= 0:
+            return
+        with self._lock:
+            if self.rate is None:
+                self._tokens = max_rate
+                self._stamp = time.monotonic()
+            self.max_rate = max_rate
+            self.rate = min(self.rate or max_rate, max_rate)
+    
+    def on_success(self) -> None:
+        with self._lock:
+            if self.rate is not None:
+                self.rate = min(self.max_rate, self.rate + SES_RATE_INCREASE)
+    
+    def on_throttle(self) -> None:
+        with self._lock:
+            if self.rate is not None:
+                self.rate = max(1.0, self.rate / 2)
+                logger.warning("SES throttled, pacing sends at %.1f/s", self.rate)
+
+
 class EmailService:
     """
     Email service for sending verification emails
@@ -15,21 +138,30 @@ class EmailService:
     SENDER_EMAIL = os.environ.get("SENDER_EMAIL", "noreply@medusa-health.com")
     SENDER_NAME = "MeDUSA Health System"
     
+    # One SES client per process, shared by every EmailService instance
+    _shared_ses_client = None
+    _rate_limiter = _SendRateLimiter()
+    
     def __init__(self):
         """Initialize email service with AWS SES"""
         self.ses_client = None
-        self.use_ses = os.environ.get("USE_SES", "false").lower() == "true"
+        self.use_ses = _USE_SES
         
         if self.use_ses:
             try:
-                # Use SES_REGION if provided, otherwise use AWS_REGION (auto-provided by Lambda)
-                region = os.environ.get("SES_REGION") or os.environ.get("AWS_REGION", "us-east-1")
-                self.ses_client = boto3.client('ses', region_name=region)
-                print(f"[EmailService] AWS SES initialized in region: {region}")
+                self.ses_client = self._get_ses_client(_SES_REGION)
+                logger.info("AWS SES initialized in region: %s", _SES_REGION)
             except Exception as e:
-                print(f"[EmailService] Failed to initialize AWS SES: {e}")
+                logger.error("Failed to initialize AWS SES: %s", e)
                 self.use_ses = False
     
+    @classmethod
+    def _get_ses_client(cls, region: str):
+        """Create the shared SES client on first use"""
+        if cls._shared_ses_client is None:
+            cls._shared_ses_client = boto3.client('ses', region_name=region, config=_SES_CONFIG)
+        return cls._shared_ses_client
+    
     def send_verification_code(self, email: str, code: str, code_type: str = "registration") -> bool:
         """
         Send verification code email
@@ -42,29 +174,112 @@ class EmailService:
         Returns:
             True if email sent successfully, False otherwise
         """
-        print(f"[EmailService] send_verification_code called: email={email}, code_type={code_type}")
-        print(f"[EmailService] use_ses={self.use_ses}, ses_client={self.ses_client is not None}")
+        logger.debug("send_verification_code called: email=%s, code_type=%s", email, code_type)
+        
+        if self.use_ses and self.ses_client:
+            return self._send_via_ses_template(email, code_type, {"code": code})
         
         if code_type == "password_reset":
             subject = "Password Reset Verification Code - MeDUSA"
-            message = self._generate_password_reset_email(code)
+            message, text = self._generate_password_reset_email(code)
         else:
             subject = "Email Verification Code - MeDUSA"
-            message = self._generate_verification_email(code)
-        
-        print(f"[EmailService] Generated email: subject={subject}, message_length={len(message)}")
+            message, text = self._generate_verification_email(code)
         
-        if self.use_ses and self.ses_client:
-            print(f"[EmailService] Attempting to send via SES...")
-            result = self._send_via_ses(email, subject, message)
-            print(f"[EmailService] SES send result: {result}")
-            return result
-        else:
-            print(f"[EmailService] Falling back to console logging (use_ses={self.use_ses}, ses_client={self.ses_client is not None})")
-            # Fallback to console logging for development
-            return self._log_email(email, subject, code)
+        logger.debug("Generated email: subject=%s, message_length=%d", subject, len(message))
+        logger.debug("Falling back to console logging (use_ses=%s, ses_client=%s)",
+                     self.use_ses, self.ses_client is not None)
+        # Fallback to console logging for development
+        return self._log_email(email, subject, code)
     
-    def _send_via_ses(self, recipient: str, subject: str, html_body: str) -> bool:
+    def _send_via_ses_template(self, email: str, kind: str, data: Dict[str, str]) -> bool:
+        """
+        Send one email with SendTemplatedEmail: the bodies live in the SES
+        template, so each request carries only the placeholder values. The
+        templates are published at deploy time by sync_ses_templates; if one
+        is missing the full body goes out with SendEmail instead.
+        """
+        template_name, _ = self._SES_TEMPLATES.get(kind, self._SES_TEMPLATES["registration"])
+        try:
+            response = self._ses_send(
+                "send_templated_email", 1,
+                Source=f"{self.SENDER_NAME} <{self.SENDER_EMAIL}>",
+                Destination={'ToAddresses': [email]},
+                Template=template_name,
+                TemplateData=json.dumps(data)
+            )
+            logger.info("Email sent, MessageId=%s", response['MessageId'])
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TemplateDoesNotExist':
+                logger.exception("Failed to send templated email to %s: %s", email, e)
+                return False
+        except Exception as e:
+            logger.exception("Failed to send templated email to %s: %s", email, e)
+            return False
+        logger.warning("SES template %s does not exist, sending full body", template_name)
+        subject, template, text_template = self._template_content(kind)
+        return self._send_via_ses(email, subject, template.format(**data), text_template.format(**data))
+    
+    # SES template name and placeholder fields per email kind; verification
+    # kinds are keyed by their code_type
+    _SES_TEMPLATES = {
+        "registration": ("medusa-registration-code", ("code",)),
+        "password_reset": ("medusa-password-reset-code", ("code",)),
+        "welcome_mfa": ("medusa-welcome-mfa", ("email", "mfa_secret", "role_upper")),
+    }
+    
+    def _template_content(self, kind: str) -> Tuple[str, str, str]:
+        """Subject and str.format HTML and text templates for an email kind"""
+        if kind == "welcome_mfa":
+            return ("Welcome to MeDUSA - Your MFA Setup Information",
+                    self._WELCOME_MFA_TEMPLATE, self._WELCOME_MFA_TEXT_TEMPLATE)
+        if kind == "password_reset":
+            return ("Password Reset Verification Code - MeDUSA",
+                    self._PASSWORD_RESET_TEMPLATE, self._PASSWORD_RESET_TEXT_TEMPLATE)
+        return ("Email Verification Code - MeDUSA",
+                self._VERIFICATION_TEMPLATE, self._VERIFICATION_TEXT_TEMPLATE)
+    
+    def sync_ses_templates(self) -> List[str]:
+        """
+        Create or update the SES template of every email kind from this
+        deployment's bodies. Run once per deploy (see deploy.ps1) rather than
+        on the request path; returns the template names
+        """
+        names = []
+        for kind, (template_name, fields) in self._SES_TEMPLATES.items():
+            subject, template, text_template = self._template_content(kind)
+            # Formatting with literal handlebars tags also collapses the doubled
+            # CSS braces back to single ones
+            tags = {field: "{{%s}}" % field for field in fields}
+            ses_template = {
+                'TemplateName': template_name,
+                'SubjectPart': subject,
+                'HtmlPart': template.format(**tags),
+                'TextPart': text_template.format(**tags)
+            }
+            try:
+                self.ses_client.create_template(Template=ses_template)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'AlreadyExists':
+                    raise
+                self.ses_client.update_template(Template=ses_template)
+            names.append(template_name)
+        return names
+    
+    def _ses_send(self, operation: str, recipients: int, **kwargs):
+        """Call an SES send operation paced by the shared rate limiter"""
+        self._rate_limiter.acquire(self.ses_client, recipients)
+        try:
+            response = getattr(self.ses_client, operation)(**kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('Throttling', 'ThrottlingException'):
+                self._rate_limiter.on_throttle()
+            raise
+        self._rate_limiter.on_success()
+        return response
+    
+    def _send_via_ses(self, recipient: str, subject: str, html_body: str, text_body: str) -> bool:
         """
         Send email via AWS SES
         
@@ -72,17 +287,14 @@ class EmailService:
             recipient: Recipient email address
             subject: Email subject
             html_body: HTML email body
+            text_body: Plain-text alternative of the body
             
         Returns:
             True if successful, False otherwise
         """
         try:
-            # Extract plain text from HTML for better deliverability
-            import re
-            text_body = re.sub(r'<[^>]+>', '', html_body)  # Strip HTML tags
-            text_body = re.sub(r'\s+', ' ', text_body).strip()  # Clean whitespace
-            
-            response = self.ses_client.send_email(
+            response = self._ses_send(
+                "send_email", 1,
                 Source=f"{self.SENDER_NAME} <{self.SENDER_EMAIL}>",
                 Destination={
                     'ToAddresses': [recipient]
@@ -106,26 +318,18 @@ class EmailService:
                 # Add configuration set for better tracking (optional)
                 # ConfigurationSetName='medusa-email-config'
             )
-            print(f"[EmailService] SUCCESS: Email sent successfully to {recipient}")
-            print(f"[EmailService] Message ID: {response['MessageId']}")
-            print(f"[EmailService] From: {self.SENDER_EMAIL}")
-            print(f"[EmailService] To: {recipient}")
-            print(f"[EmailService] Subject: {subject}")
+            logger.info("Email sent, MessageId=%s", response['MessageId'])
+            logger.debug("From: %s, To: %s, Subject: %s", self.SENDER_EMAIL, recipient, subject)
             return True
         except ClientError as e:
             error_code = e.response['Error']['Code']
             error_message = e.response['Error']['Message']
-            print(f"[EmailService] ERROR: Failed to send email: {error_code} - {error_message}")
-            print(f"[EmailService] Recipient: {recipient}")
-            print(f"[EmailService] Sender: {self.SENDER_EMAIL}")
             # Log full error for debugging
-            import traceback
-            print(f"[EmailService] Traceback: {traceback.format_exc()}")
+            logger.exception("Failed to send email: %s - %s (recipient=%s, sender=%s)",
+                             error_code, error_message, recipient, self.SENDER_EMAIL)
             return False
         except Exception as e:
-            print(f"[EmailService] ERROR: Unexpected error sending email: {str(e)}")
-            import traceback
-            print(f"[EmailService] Traceback: {traceback.format_exc()}")
+            logger.exception("Unexpected error sending email: %s", e)
             return False
     
     def _log_email(self, recipient: str, subject: str, code: str) -> bool:
@@ -140,31 +344,26 @@ class EmailService:
         Returns:
             Always True (for development)
         """
-        print("\n" + "="*60)
-        print("[EmailService] EMAIL (Development Mode - Not Actually Sent)")
-        print("="*60)
-        print(f"To: {recipient}")
-        print(f"Subject: {subject}")
-        print(f"Verification Code: {code}")
-        print("="*60 + "\n")
+        # Printed rather than logged: in development this is the delivery
+        # channel, and the code must show whatever the log level is
+        rule = "=" * 60
+        print(f"\n{rule}\n[EmailService] EMAIL (Development Mode - Not Actually Sent)\n{rule}\n"
+              f"To: {recipient}\nSubject: {subject}\nVerification Code: {code}\n{rule}\n")
         return True
     
-    def _generate_verification_email(self, code: str) -> str:
-        """Generate HTML email for email verification"""
-        return f"""
+    # Templates are str.format strings built once with the class; only the
+    # placeholders are filled per send. Verification codes get a short
+    # hand-written text part; the welcome text is derived from its HTML.
+    _VERIFICATION_TEMPLATE = """
         <!DOCTYPE html>
         <html>
         <head>
             <meta charset="UTF-8">
             <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: #1976D2; color: white; padding: 20px; text-align: center; }}
-                .content {{ background: #f8f9fa; padding: 30px; border-radius: 5px; }}
+""" + _SHARED_CSS + """                .header {{ background: #1976D2; color: white; padding: 20px; text-align: center; }}
                 .code {{ font-size: 32px; font-weight: bold; color: #1976D2; text-align: center; 
                          padding: 20px; background: white; border-radius: 5px; margin: 20px 0; 
                          letter-spacing: 5px; }}
-                .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 12px; }}
             </style>
         </head>
         <body>
@@ -189,25 +388,28 @@ class EmailService:
         </body>
         </html>
         """
-    
-    def _generate_password_reset_email(self, code: str) -> str:
-        """Generate HTML email for password reset"""
-        return f"""
+
+    _VERIFICATION_TEXT_TEMPLATE = (
+        "Your MeDUSA verification code is {code}. It expires in 10 minutes. "
+        "If you didn't request this code, please ignore this email."
+    )
+
+    def _generate_verification_email(self, code: str) -> Tuple[str, str]:
+        """Generate HTML and plain-text email for email verification"""
+        return self._VERIFICATION_TEMPLATE.format(code=code), self._VERIFICATION_TEXT_TEMPLATE.format(code=code)
+
+    _PASSWORD_RESET_TEMPLATE = """
         <!DOCTYPE html>
         <html>
         <head>
             <meta charset="UTF-8">
             <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: #D32F2F; color: white; padding: 20px; text-align: center; }}
-                .content {{ background: #f8f9fa; padding: 30px; border-radius: 5px; }}
+""" + _SHARED_CSS + """                .header {{ background: #D32F2F; color: white; padding: 20px; text-align: center; }}
                 .code {{ font-size: 32px; font-weight: bold; color: #D32F2F; text-align: center; 
                          padding: 20px; background: white; border-radius: 5px; margin: 20px 0; 
                          letter-spacing: 5px; }}
                 .warning {{ background: #fff3cd; border-left: 4px solid #ff9800; padding: 15px; 
                            margin: 20px 0; }}
-                .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 12px; }}
             </style>
         </head>
         <body>
@@ -236,6 +438,15 @@ class EmailService:
         </html>
         """
 
+    _PASSWORD_RESET_TEXT_TEMPLATE = (
+        "Your MeDUSA password reset code is {code}. It expires in 10 minutes. "
+        "If you didn't request a password reset, please ignore this email and ensure your account is secure."
+    )
+
+    def _generate_password_reset_email(self, code: str) -> Tuple[str, str]:
+        """Generate HTML and plain-text email for password reset"""
+        return self._PASSWORD_RESET_TEMPLATE.format(code=code), self._PASSWORD_RESET_TEXT_TEMPLATE.format(code=code)
+
     def send_welcome_with_mfa(self, email: str, mfa_secret: str, role: str = "patient") -> bool:
         """
         Send welcome email with MFA secret after successful registration.
@@ -248,32 +459,25 @@ class EmailService:
         Returns:
             True if email sent successfully, False otherwise
         """
-        print(f"[EmailService] send_welcome_with_mfa called: email={email}, role={role}")
+        logger.debug("send_welcome_with_mfa called: email=%s, role=%s", email, role)
         
         subject = "Welcome to MeDUSA - Your MFA Setup Information"
-        message = self._generate_welcome_mfa_email(email, mfa_secret, role)
         
         if self.use_ses and self.ses_client:
-            return self._send_via_ses(email, subject, message)
+            return self._send_via_ses_template(
+                email, "welcome_mfa", {"email": email, "mfa_secret": mfa_secret, "role_upper": role.upper()}
+            )
         else:
             # Note: In dev mode, MFA secret is logged to file only (not console) for debugging
             return self._log_email(email, subject, "[MFA_SECRET_REDACTED]")
     
-    def _generate_welcome_mfa_email(self, email: str, mfa_secret: str, role: str) -> str:
-        """Generate HTML email for welcome with MFA setup instructions"""
-        # Generate otpauth URI for QR code (compatible with Google Authenticator, etc.)
-        otpauth_uri = f"otpauth://totp/MeDUSA:{email}?secret={mfa_secret}&issuer=MeDUSA"
-        
-        return f"""
+    _WELCOME_MFA_TEMPLATE = """
         <!DOCTYPE html>
         <html>
         <head>
             <meta charset="UTF-8">
             <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: #4CAF50; color: white; padding: 20px; text-align: center; }}
-                .content {{ background: #f8f9fa; padding: 30px; border-radius: 5px; }}
+""" + _SHARED_CSS + """                .header {{ background: #4CAF50; color: white; padding: 20px; text-align: center; }}
                 .secret-box {{ font-size: 18px; font-weight: bold; color: #4CAF50; text-align: center; 
                              padding: 20px; background: white; border-radius: 5px; margin: 20px 0; 
                              letter-spacing: 3px; font-family: monospace; word-break: break-all; }}
@@ -284,7 +488,6 @@ class EmailService:
                            margin: 20px 0; }}
                 .security {{ background: #e8f5e9; border-left: 4px solid #4CAF50; padding: 15px; 
                            margin: 20px 0; }}
-                .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 12px; }}
                 .role-badge {{ display: inline-block; background: #1976D2; color: white; 
                               padding: 5px 15px; border-radius: 20px; font-size: 14px; }}
             </style>
@@ -297,7 +500,7 @@ class EmailService:
                 </div>
                 <div class="content">
                     <p>Hello! Your MeDUSA account has been created with the role: 
-                       <span class="role-badge">{role.upper()}</span></p>
+                       <span class="role-badge">{role_upper}</span></p>
                     
                     <h2>🔐 Two-Factor Authentication (MFA) Setup</h2>
                     <p>For your security, MFA is <strong>required</strong> for all MeDUSA accounts. 
@@ -352,3 +555,15 @@ class EmailService:
         </html>
         """
 
+    _WELCOME_MFA_TEXT_TEMPLATE = _html_to_text(_WELCOME_MFA_TEMPLATE)
+
+
+if __name__ == "__main__":
+    # Deploy step: python email_service.py sync-templates
+    import sys
+    if sys.argv[1:] != ["sync-templates"]:
+        sys.exit("usage: python email_service.py sync-templates")
+    service = EmailService()
+    service.ses_client = service._get_ses_client(_SES_REGION)
+    for name in service.sync_ses_templates():
+        print(f"SES template {name} is up to date")
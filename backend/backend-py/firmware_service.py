@@ -2,7 +2,7 @@
 MeDUSA Firmware Update Verification Service
 
 This module implements secure firmware update verification for medical devices:
-- Cryptographic signature verification (RSA-4096 or ECDSA-P384)
+- Cryptographic signature verification (Ed25519, ECDSA or RSA-PSS)
 - Version validation and rollback prevention
 - Integrity verification (SHA-256 hash)
 - Update manifest validation
@@ -12,20 +12,210 @@ Compliant with FDA cybersecurity requirements for software updates.
 
 import os
 import json
+import logging
 import time
 import hashlib
+import hmac
+import mmap
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any, List, Tuple
+from functools import lru_cache, partial
+from typing import Optional, Dict, Any, List, Tuple, Union, BinaryIO, FrozenSet, Mapping, Sequence
 from dataclasses import dataclass
 from enum import Enum
 
+import orjson
+
 # For signature verification
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding, ec
+from cryptography.hazmat.primitives.asymmetric import padding, ec, rsa, ed25519
 from cryptography.hazmat.backends import default_backend
 from cryptography.exceptions import InvalidSignature
-from cryptography.x509 import load_pem_x509_certificate
+from cryptography.x509 import load_pem_x509_certificates
+
+# Rejections are reported as warnings; arguments are only formatted when emitted
+logger = logging.getLogger("medusa.firmware")
+
+# Firmware can be passed as an in-memory buffer, an open binary stream, or a path
+FirmwareSource = Union[bytes, bytearray, memoryview, BinaryIO, "os.PathLike[str]", str]
+
+# Read size for streamed firmware images
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Threads for batch verification; hashlib and OpenSSL release the GIL while
+# hashing and verifying, so this scales with cores
+VERIFY_WORKERS = os.cpu_count() or 1
+
+# Signature schemes are immutable, so one instance serves every sign/verify
+_SHA256 = hashes.SHA256()
+_PSS_PADDING = padding.PSS(mgf=padding.MGF1(_SHA256), salt_length=padding.PSS.MAX_LENGTH)
+_ECDSA_SHA256 = ec.ECDSA(_SHA256)
+
+# Manifest sig_alg names per EC curve
+_EC_CURVE_NAMES = {"secp256r1": "p256", "secp384r1": "p384", "secp521r1": "p521"}
+
+
+def _signature_algorithm(key) -> Optional[str]:
+    """
+    sig_alg name for a public or private key: "ed25519", "ecdsa-<curve>-sha256"
+    or "rsa-pss-sha256". New firmware should be signed with Ed25519, the
+    cheapest of the three to verify on constrained gateways.
+    """
+    if isinstance(key, (ed25519.Ed25519PublicKey, ed25519.Ed25519PrivateKey)):
+        return "ed25519"
+    if isinstance(key, (ec.EllipticCurvePublicKey, ec.EllipticCurvePrivateKey)):
+        return f"ecdsa-{_EC_CURVE_NAMES.get(key.curve.name, key.curve.name)}-sha256"
+    if isinstance(key, (rsa.RSAPublicKey, rsa.RSAPrivateKey)):
+        return "rsa-pss-sha256"
+    return None
+
+
+# Distinct (manifest, signature, key) verdicts kept in memory. A fleet rollout
+# presents the same signed manifest from every device, so the expensive
+# public-key verify runs once per manifest rather than once per device.
+SIGNATURE_CACHE_SIZE = 1024
+
+# Public keys by SHA-256 fingerprint of their SubjectPublicKeyInfo DER; the
+# cache is keyed on the fingerprint so it never holds instances alive
+_VERIFY_KEYS: Dict[bytes, Tuple[Any, Optional[str]]] = {}
+
+
+def _canonical_manifest(manifest_data: Dict[str, Any]) -> bytes:
+    """
+    Bytes that manifest signatures cover. This stays json.dumps(sort_keys=True):
+    orjson's compact separators would change the signed bytes and invalidate
+    every manifest already issued.
+    """
+    return json.dumps(manifest_data, sort_keys=True).encode()
+
+
+def _key_fingerprint(public_key) -> bytes:
+    """SHA-256 over the DER SubjectPublicKeyInfo of a public key."""
+    der = public_key.public_bytes(
+        serialization.Encoding.DER,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return hashlib.sha256(der).digest()
+
+
+@lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def _verify_signature_cached(canonical: bytes, signature_b64: str, key_fingerprint: bytes) -> bool:
+    """
+    Verify a signature over canonical manifest bytes with a registered key.
+    Only definite verdicts are memoized; unexpected errors propagate uncached.
+    """
+    public_key, sig_alg = _VERIFY_KEYS[key_fingerprint]
+    signature = base64.b64decode(signature_b64)
+    try:
+        if sig_alg == "ed25519":
+            public_key.verify(signature, canonical)
+        elif sig_alg == "rsa-pss-sha256":
+            public_key.verify(signature, canonical, _PSS_PADDING, _SHA256)
+        else:
+            # ECDSA key
+            public_key.verify(signature, canonical, _ECDSA_SHA256)
+    except InvalidSignature:
+        return False
+    return True
+
+
+# Fields every manifest must carry
+_REQUIRED_MANIFEST_KEYS = frozenset({
+    'firmware_id', 'version', 'device_type', 'release_date',
+    'min_required_version', 'sha256_hash', 'size_bytes',
+    'signature', 'certificate_id'
+})
+
+# Bits per major/minor/patch field in a packed version
+_VERSION_FIELD_BITS = 21
+_VERSION_FIELD_LIMIT = 1 << _VERSION_FIELD_BITS
+
+
+@lru_cache(maxsize=256)
+def _pack_version(version: str) -> int:
+    """
+    Pack "major.minor.patch" into one integer that orders like the version.
+    Missing trailing fields count as 0. Raises ValueError for anything that
+    doesn't fit the packed form (non-numeric, more than three fields, or a
+    field outside 0..2**21-1).
+    """
+    parts = [int(x) for x in version.split('.')]
+    if len(parts) > 3:
+        raise ValueError(f"too many version fields: {version}")
+    packed = 0
+    for i in range(3):
+        part = parts[i] if i < len(parts) else 0
+        if not 0 <= part < _VERSION_FIELD_LIMIT:
+            raise ValueError(f"version field out of range: {version}")
+        packed = (packed << _VERSION_FIELD_BITS) | part
+    return packed
+
+
+def _cert_time(cert, attr: str) -> float:
+    """POSIX timestamp of a certificate validity bound."""
+    # *_utc accessors appeared in cryptography 42; older ones return naive UTC
+    aware = getattr(cert, f"{attr}_utc", None)
+    if aware is None:
+        aware = getattr(cert, attr).replace(tzinfo=timezone.utc)
+    return aware.timestamp()
+
+
+def _sha256_and_size(source: FirmwareSource) -> Tuple[bytes, int]:
+    """
+    Raw SHA-256 digest and byte length of firmware in a single pass.
+    
+    Buffers are hashed in place; files are hashed with hashlib.file_digest
+    (mmap on older interpreters) and other streams are read in
+    HASH_CHUNK_SIZE chunks, so the image never has to be resident at once.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        return hashlib.sha256(view).digest(), view.nbytes
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as stream:
+            if hasattr(hashlib, "file_digest"):
+                # 3.11+: hashes straight from the file into a reused buffer
+                digest = hashlib.file_digest(stream, "sha256")
+                return digest.digest(), stream.tell()
+            size = os.fstat(stream.fileno()).st_size
+            if size == 0:
+                return hashlib.sha256().digest(), 0
+            # Map the file so pages are faulted in on demand instead of
+            # being copied into Python-side chunks
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest = hashlib.sha256()
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, HASH_CHUNK_SIZE):
+                        digest.update(view[offset:offset + HASH_CHUNK_SIZE])
+                return digest.digest(), size
+    digest = hashlib.sha256()
+    total = 0
+    while chunk := source.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+        total += len(chunk)
+    return digest.digest(), total
+
+
+def _known_size(source: FirmwareSource) -> Optional[int]:
+    """Byte length of a buffer or file without reading it; None for streams."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    if isinstance(source, (str, os.PathLike)):
+        return os.stat(source).st_size
+    return None
+
+
+def _digest_matches(digest: bytes, expected_hex: str) -> bool:
+    """
+    Constant-time check of a raw digest against a hex string (either case).
+    Malformed hex never matches.
+    """
+    try:
+        expected = bytes.fromhex(expected_hex)
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(digest, expected)
 
 
 class FirmwareStatus(Enum):
@@ -54,6 +244,7 @@ class FirmwareManifest:
     certificate_id: str
     changelog: Optional[str] = None
     critical_update: bool = False
+    sig_alg: Optional[str] = None
 
 
 @dataclass
@@ -86,7 +277,7 @@ class FirmwareVerificationService:
     }
     
     # Revoked certificate IDs
-    REVOKED_CERTIFICATES: List[str] = []
+    REVOKED_CERTIFICATES: FrozenSet[str] = frozenset()
     
     # Minimum supported versions per device type (for rollback prevention)
     MIN_VERSIONS: Dict[str, str] = {
@@ -107,11 +298,50 @@ class FirmwareVerificationService:
                 public_key_pem.encode(),
                 backend=default_backend()
             )
+        self._sig_alg = _signature_algorithm(self._public_key)
+        self._key_fingerprint = None
+        if self._public_key is not None:
+            self._key_fingerprint = _key_fingerprint(self._public_key)
+            _VERIFY_KEYS[self._key_fingerprint] = (self._public_key, self._sig_alg)
+        self.refresh_certificates()
+    
+    def refresh_certificates(self) -> None:
+        """
+        Load and chain-check TRUSTED_CERTIFICATES once, caching for each entry
+        the fingerprint and sig_alg of its leaf public key and the validity
+        window shared by its whole chain. Manifests naming a cached
+        certificate are verified with its leaf key. Call again after changing
+        the trusted store.
+        
+        Each PEM holds the leaf first, followed by any intermediates. Entries
+        that fail to parse, whose chain signatures don't verify, or whose leaf
+        key can't sign manifests are cached as None and rejected at
+        verification time.
+        """
+        cache: Dict[str, Optional[Tuple[bytes, str, float, float]]] = {}
+        for certificate_id, pem in self.TRUSTED_CERTIFICATES.items():
+            try:
+                chain = load_pem_x509_certificates(pem.encode())
+                for cert, issuer in zip(chain, chain[1:]):
+                    cert.verify_directly_issued_by(issuer)
+                leaf_key = chain[0].public_key()
+                sig_alg = _signature_algorithm(leaf_key)
+                if sig_alg is None:
+                    raise ValueError(f"unsupported leaf key type {type(leaf_key).__name__}")
+                fingerprint = _key_fingerprint(leaf_key)
+                _VERIFY_KEYS[fingerprint] = (leaf_key, sig_alg)
+                not_before = max(_cert_time(c, "not_valid_before") for c in chain)
+                not_after = min(_cert_time(c, "not_valid_after") for c in chain)
+                cache[certificate_id] = (fingerprint, sig_alg, not_before, not_after)
+            except Exception as e:
+                logger.warning("Certificate %s failed validation: %r", certificate_id, e)
+                cache[certificate_id] = None
+        self._cert_cache = cache
     
     def verify_firmware_update(
         self,
         manifest_json: str,
-        firmware_data: bytes,
+        firmware_data: FirmwareSource,
         current_version: str,
         device_type: str
     ) -> FirmwareVerificationResult:
@@ -120,22 +350,24 @@ class FirmwareVerificationService:
         
         Args:
             manifest_json: JSON string of the firmware manifest
-            firmware_data: Raw firmware binary data
+            firmware_data: Raw firmware binary (bytes, binary stream, or path)
             current_version: Currently installed firmware version
             device_type: Type of device (for version check)
             
         Returns:
             FirmwareVerificationResult with verification status
         """
+        # One timestamp for every rejection; success is stamped at completion
+        now = datetime.now(timezone.utc)
         try:
             # 1. Parse and validate manifest
-            manifest = self._parse_manifest(manifest_json)
+            manifest, manifest_data = self._load_manifest(manifest_json)
             if not manifest:
                 return FirmwareVerificationResult(
                     status=FirmwareStatus.INVALID_MANIFEST,
                     is_valid=False,
                     message="Invalid or malformed firmware manifest",
-                    verified_at=datetime.now(timezone.utc)
+                    verified_at=now
                 )
             
             # 2. Check device type matches
@@ -145,7 +377,7 @@ class FirmwareVerificationService:
                     is_valid=False,
                     message=f"Firmware is for {manifest.device_type}, not {device_type}",
                     manifest=manifest,
-                    verified_at=datetime.now(timezone.utc)
+                    verified_at=now
                 )
             
             # 3. Check for version rollback
@@ -155,7 +387,7 @@ class FirmwareVerificationService:
                     is_valid=False,
                     message=f"Version rollback detected: {manifest.version} < {current_version}",
                     manifest=manifest,
-                    verified_at=datetime.now(timezone.utc)
+                    verified_at=now
                 )
             
             # 4. Check minimum required version
@@ -166,7 +398,7 @@ class FirmwareVerificationService:
                     is_valid=False,
                     message=f"Version {manifest.version} below minimum {min_version}",
                     manifest=manifest,
-                    verified_at=datetime.now(timezone.utc)
+                    verified_at=now
                 )
             
             # 5. Check certificate validity
@@ -177,37 +409,37 @@ class FirmwareVerificationService:
                     is_valid=False,
                     message=f"Certificate verification failed: {cert_status.value}",
                     manifest=manifest,
-                    verified_at=datetime.now(timezone.utc)
+                    verified_at=now
                 )
             
-            # 6. Verify firmware hash
-            if not self._verify_hash(firmware_data, manifest.sha256_hash):
-                return FirmwareVerificationResult(
-                    status=FirmwareStatus.INVALID_HASH,
-                    is_valid=False,
-                    message="Firmware hash mismatch - data may be corrupted",
-                    manifest=manifest,
-                    verified_at=datetime.now(timezone.utc)
-                )
+            # 6. Verify size up front when it is known without reading the
+            # image, so oversized payloads are rejected before any crypto
+            known_size = _known_size(firmware_data)
+            if known_size is not None and known_size != manifest.size_bytes:
+                return self._size_mismatch(manifest, known_size, now)
             
-            # 7. Verify size
-            if len(firmware_data) != manifest.size_bytes:
+            # 7. Verify cryptographic signature. The signed manifest is what
+            # authenticates the expected hash, so it is checked before hashing.
+            if not self._verify_signature_from_dict(manifest_data, manifest.signature, manifest.certificate_id):
                 return FirmwareVerificationResult(
-                    status=FirmwareStatus.INVALID_HASH,
+                    status=FirmwareStatus.INVALID_SIGNATURE,
                     is_valid=False,
-                    message=f"Size mismatch: expected {manifest.size_bytes}, got {len(firmware_data)}",
+                    message="Invalid firmware signature - update may be tampered",
                     manifest=manifest,
-                    verified_at=datetime.now(timezone.utc)
+                    verified_at=now
                 )
             
-            # 8. Verify cryptographic signature
-            if not self._verify_signature(manifest_json, manifest.signature):
+            # 8. Verify firmware hash (size is tallied in the same pass)
+            calculated_digest, firmware_size = _sha256_and_size(firmware_data)
+            if firmware_size != manifest.size_bytes:
+                return self._size_mismatch(manifest, firmware_size, now)
+            if not _digest_matches(calculated_digest, manifest.sha256_hash):
                 return FirmwareVerificationResult(
-                    status=FirmwareStatus.INVALID_SIGNATURE,
+                    status=FirmwareStatus.INVALID_HASH,
                     is_valid=False,
-                    message="Invalid firmware signature - update may be tampered",
+                    message="Firmware hash mismatch - data may be corrupted",
                     manifest=manifest,
-                    verified_at=datetime.now(timezone.utc)
+                    verified_at=now
                 )
             
             # All checks passed
@@ -224,25 +456,38 @@ class FirmwareVerificationService:
                 status=FirmwareStatus.UNKNOWN_ERROR,
                 is_valid=False,
                 message=f"Verification error: {str(e)}",
-                verified_at=datetime.now(timezone.utc)
+                verified_at=now
             )
     
+    @staticmethod
+    def _size_mismatch(manifest: FirmwareManifest, firmware_size: int, now: datetime) -> FirmwareVerificationResult:
+        return FirmwareVerificationResult(
+            status=FirmwareStatus.INVALID_HASH,
+            is_valid=False,
+            message=f"Size mismatch: expected {manifest.size_bytes}, got {firmware_size}",
+            manifest=manifest,
+            verified_at=now
+        )
+    
     def _parse_manifest(self, manifest_json: str) -> Optional[FirmwareManifest]:
         """Parse and validate firmware manifest JSON."""
+        return self._load_manifest(manifest_json)[0]
+    
+    def _load_manifest(
+        self, manifest_json: str
+    ) -> Tuple[Optional[FirmwareManifest], Optional[Dict[str, Any]]]:
+        """
+        Parse manifest JSON once, returning the validated manifest together
+        with the decoded dict so signature checks don't parse it again.
+        """
         try:
-            data = json.loads(manifest_json)
-            
-            # Required fields
-            required_fields = [
-                'firmware_id', 'version', 'device_type', 'release_date',
-                'min_required_version', 'sha256_hash', 'size_bytes',
-                'signature', 'certificate_id'
-            ]
+            data = orjson.loads(manifest_json)
             
-            for field in required_fields:
-                if field not in data:
-                    print(f"[FirmwareService] Missing required field: {field}")
-                    return None
+            # Required fields, checked with one C-level set difference
+            missing = _REQUIRED_MANIFEST_KEYS.difference(data)
+            if missing:
+                logger.warning("Missing required manifest fields: %s", ", ".join(sorted(missing)))
+                return None, None
             
             return FirmwareManifest(
                 firmware_id=data['firmware_id'],
@@ -255,18 +500,26 @@ class FirmwareVerificationService:
                 signature=data['signature'],
                 certificate_id=data['certificate_id'],
                 changelog=data.get('changelog'),
-                critical_update=data.get('critical_update', False)
-            )
+                critical_update=data.get('critical_update', False),
+                sig_alg=data.get('sig_alg')
+            ), data
         except (json.JSONDecodeError, KeyError, TypeError) as e:
-            print(f"[FirmwareService] Manifest parse error: {e}")
-            return None
+            logger.warning("Manifest parse error: %s", e)
+            return None, None
     
     def _is_rollback(self, new_version: str, current_version: str) -> bool:
         """
         Check if new version is older than current (rollback attempt).
         
-        Uses semantic versioning comparison (major.minor.patch).
+        Uses semantic versioning comparison (major.minor.patch). Ordinary
+        versions compare as packed integers; anything else falls back to a
+        component-wise compare.
         """
+        try:
+            return _pack_version(new_version) < _pack_version(current_version)
+        except ValueError:
+            pass
+        
         try:
             new_parts = [int(x) for x in new_version.split('.')]
             current_parts = [int(x) for x in current_version.split('.')]
@@ -291,73 +544,90 @@ class FirmwareVerificationService:
             return True
     
     def _verify_certificate(self, certificate_id: str) -> FirmwareStatus:
-        """Verify the signing certificate."""
+        """
+        Verify the signing certificate against the cache built by
+        refresh_certificates, so each call is a lookup and a time compare.
+        """
         # Check if certificate is revoked
         if certificate_id in self.REVOKED_CERTIFICATES:
             return FirmwareStatus.REVOKED_CERTIFICATE
         
         # Check if certificate is trusted
-        if certificate_id not in self.TRUSTED_CERTIFICATES and self.TRUSTED_CERTIFICATES:
-            # In production with strict mode, this would fail
-            # For now, we allow unknown certificates with a warning
-            print(f"[FirmwareService] Warning: Unknown certificate ID: {certificate_id}")
+        if certificate_id not in self._cert_cache:
+            if self._cert_cache:
+                # In production with strict mode, this would fail
+                # For now, we allow unknown certificates with a warning
+                logger.warning("Unknown certificate ID: %s", certificate_id)
+            return FirmwareStatus.VALID
         
-        # Additional certificate validation would go here
-        # (expiration, chain verification, etc.)
+        cached = self._cert_cache[certificate_id]
+        if cached is None:
+            # Chain failed to parse or verify when the store was loaded
+            return FirmwareStatus.INVALID_SIGNATURE
+        
+        _, _, not_before, not_after = cached
+        if not not_before <= time.time() <= not_after:
+            return FirmwareStatus.EXPIRED_CERTIFICATE
         
         return FirmwareStatus.VALID
     
-    def _verify_hash(self, data: bytes, expected_hash: str) -> bool:
+    def _verify_hash(self, data: FirmwareSource, expected_hash: str) -> bool:
         """Verify SHA-256 hash of firmware data."""
-        calculated_hash = hashlib.sha256(data).hexdigest()
-        return calculated_hash.lower() == expected_hash.lower()
+        calculated_digest, _ = _sha256_and_size(data)
+        return _digest_matches(calculated_digest, expected_hash)
     
     def _verify_signature(self, manifest_json: str, signature_b64: str) -> bool:
+        """Verify cryptographic signature of a manifest JSON string."""
+        try:
+            manifest_data = orjson.loads(manifest_json)
+        except json.JSONDecodeError as e:
+            logger.warning("Signature verification error: %s", e)
+            return False
+        return self._verify_signature_from_dict(manifest_data, signature_b64, manifest_data.get('certificate_id'))
+    
+    def _signing_key(self, certificate_id: Optional[str]) -> Optional[Tuple[bytes, str]]:
+        """
+        Fingerprint and sig_alg of the key a manifest must be signed with: the
+        cached leaf key of a trusted certificate, else the configured key.
+        """
+        cached = self._cert_cache.get(certificate_id) if certificate_id is not None else None
+        if cached is not None:
+            return cached[0], cached[1]
+        if self._public_key is not None:
+            return self._key_fingerprint, self._sig_alg
+        return None
+    
+    def _verify_signature_from_dict(
+        self, manifest_data: Dict[str, Any], signature_b64: str, certificate_id: Optional[str] = None
+    ) -> bool:
         """
-        Verify cryptographic signature of the manifest.
+        Verify cryptographic signature of an already-parsed manifest.
         
-        Uses RSA-PSS or ECDSA depending on key type.
+        The verifying key (see _signing_key) decides the algorithm (Ed25519,
+        ECDSA or RSA-PSS); a manifest declaring a different sig_alg is
+        rejected rather than being allowed to pick the scheme. Manifests
+        without sig_alg predate the field and are checked with the key's scheme.
         """
-        if not self._public_key:
+        signing_key = self._signing_key(certificate_id)
+        if signing_key is None:
             # No public key configured - skip signature verification
             # In production, this should fail
-            print("[FirmwareService] Warning: No public key configured, skipping signature verification")
+            logger.warning("No public key configured, skipping signature verification")
             return True
+        key_fingerprint, sig_alg = signing_key
         
         try:
-            # Decode signature
-            signature = base64.b64decode(signature_b64)
+            # Signed data is the manifest without its signature field
+            manifest_data = {k: v for k, v in manifest_data.items() if k != 'signature'}
+            declared_alg = manifest_data.get('sig_alg')
+            if declared_alg is not None and declared_alg != sig_alg:
+                logger.warning("Manifest sig_alg %s does not match key (%s)", declared_alg, sig_alg)
+                return False
+            data_to_verify = _canonical_manifest(manifest_data)
             
-            # Get manifest data (excluding signature field for verification)
-            manifest_data = json.loads(manifest_json)
-            manifest_data.pop('signature', None)
-            data_to_verify = json.dumps(manifest_data, sort_keys=True).encode()
-            
-            # Verify based on key type
-            if hasattr(self._public_key, 'verify'):
-                # RSA key
-                self._public_key.verify(
-                    signature,
-                    data_to_verify,
-                    padding.PSS(
-                        mgf=padding.MGF1(hashes.SHA256()),
-                        salt_length=padding.PSS.MAX_LENGTH
-                    ),
-                    hashes.SHA256()
-                )
-            else:
-                # ECDSA key
-                self._public_key.verify(
-                    signature,
-                    data_to_verify,
-                    ec.ECDSA(hashes.SHA256())
-                )
-            
-            return True
-        except InvalidSignature:
-            return False
+            return _verify_signature_cached(data_to_verify, signature_b64, key_fingerprint)
         except Exception as e:
-            print(f"[FirmwareService] Signature verification error: {e}")
+            logger.warning("Signature verification error: %s", e)
             return False
     
     @staticmethod
@@ -365,7 +635,7 @@ class FirmwareVerificationService:
         firmware_id: str,
         version: str,
         device_type: str,
-        firmware_data: bytes,
+        firmware_data: FirmwareSource,
         certificate_id: str,
         private_key_pem: Optional[str] = None,
         changelog: Optional[str] = None,
@@ -381,7 +651,7 @@ class FirmwareVerificationService:
             firmware_id: Unique firmware identifier
             version: Semantic version string
             device_type: Target device type
-            firmware_data: Raw firmware binary
+            firmware_data: Raw firmware binary (bytes, binary stream, or path)
             certificate_id: ID of signing certificate
             private_key_pem: PEM-encoded private key for signing
             changelog: Optional release notes
@@ -390,8 +660,8 @@ class FirmwareVerificationService:
         Returns:
             JSON string of the signed manifest
         """
-        # Calculate hash
-        sha256_hash = hashlib.sha256(firmware_data).hexdigest()
+        # Calculate hash and size in one pass
+        digest, size_bytes = _sha256_and_size(firmware_data)
         
         # Build manifest
         manifest = {
@@ -400,8 +670,8 @@ class FirmwareVerificationService:
             "device_type": device_type,
             "release_date": datetime.now(timezone.utc).isoformat(),
             "min_required_version": "1.0.0",  # Could be configurable
-            "sha256_hash": sha256_hash,
-            "size_bytes": len(firmware_data),
+            "sha256_hash": digest.hex(),
+            "size_bytes": size_bytes,
             "certificate_id": certificate_id,
             "changelog": changelog,
             "critical_update": critical_update
@@ -415,29 +685,24 @@ class FirmwareVerificationService:
                 backend=default_backend()
             )
             
-            data_to_sign = json.dumps(manifest, sort_keys=True).encode()
+            # sig_alg is part of the signed data, so it can't be swapped later
+            manifest["sig_alg"] = _signature_algorithm(private_key)
+            data_to_sign = _canonical_manifest(manifest)
             
             # Sign based on key type
-            if hasattr(private_key, 'sign'):
-                signature = private_key.sign(
-                    data_to_sign,
-                    padding.PSS(
-                        mgf=padding.MGF1(hashes.SHA256()),
-                        salt_length=padding.PSS.MAX_LENGTH
-                    ),
-                    hashes.SHA256()
-                )
+            if manifest["sig_alg"] == "ed25519":
+                signature = private_key.sign(data_to_sign)
+            elif manifest["sig_alg"] == "rsa-pss-sha256":
+                signature = private_key.sign(data_to_sign, _PSS_PADDING, _SHA256)
             else:
-                signature = private_key.sign(
-                    data_to_sign,
-                    ec.ECDSA(hashes.SHA256())
-                )
+                # ECDSA key
+                signature = private_key.sign(data_to_sign, _ECDSA_SHA256)
             
             manifest["signature"] = base64.b64encode(signature).decode()
         else:
             manifest["signature"] = ""
         
-        return json.dumps(manifest, indent=2)
+        return orjson.dumps(manifest, option=orjson.OPT_INDENT_2).decode()
 
 
 # Global service instance
@@ -477,7 +742,11 @@ def verify_firmware_endpoint(
             }
         
         # Verify hash matches manifest
-        if manifest.sha256_hash.lower() != firmware_hash.lower():
+        try:
+            hash_matches = _digest_matches(bytes.fromhex(firmware_hash), manifest.sha256_hash)
+        except (ValueError, TypeError):
+            hash_matches = False
+        if not hash_matches:
             return {
                 "valid": False,
                 "status": "hash_mismatch",
@@ -507,3 +776,39 @@ def verify_firmware_endpoint(
             "status": "error",
             "message": str(e)
         }
+
+
+def _verify_batch_entry(service: FirmwareVerificationService, request: Mapping[str, Any]) -> FirmwareVerificationResult:
+    """One batch entry; a malformed request fails on its own instead of aborting the batch."""
+    try:
+        return service.verify_firmware_update(**request)
+    except Exception as e:
+        return FirmwareVerificationResult(
+            status=FirmwareStatus.UNKNOWN_ERROR,
+            is_valid=False,
+            message=f"Verification error: {str(e)}",
+            verified_at=datetime.now(timezone.utc)
+        )
+
+
+def verify_firmware_batch(
+    requests: Sequence[Mapping[str, Any]],
+    service: Optional[FirmwareVerificationService] = None
+) -> List[FirmwareVerificationResult]:
+    """
+    Verify many firmware updates concurrently, e.g. one per gateway in a
+    fleet rollout.
+    
+    Each request holds the verify_firmware_update keyword arguments
+    (manifest_json, firmware_data, current_version, device_type). Results
+    are returned in request order, and an entry that errors gets an
+    UNKNOWN_ERROR result without affecting the rest. Repeated manifests
+    share one signature verify through the signature cache.
+    """
+    service = service or firmware_service
+    if len(requests) <= 1:
+        return [_verify_batch_entry(service, request) for request in requests]
+    
+    workers = min(VERIFY_WORKERS, len(requests))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fw-verify") as pool:
+        return list(pool.map(partial(_verify_batch_entry, service), requests))
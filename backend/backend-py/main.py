@@ -1,4 +1,4 @@
-import os, sys, uuid, time, secrets
+import os, sys, uuid, time, secrets, traceback
 from datetime import datetime, timezone
 from typing import Optional
 
@@ -29,14 +29,14 @@ from models import (
     TremorResponse, AssignPatientReq, DoctorPatientsRes
 )
 from auth import (
-    auth_middleware, issue_tokens, verify_pw, hash_pw,
+    AuthMiddleware, issue_tokens, verify_pw, hash_pw,
     generate_mfa_secret, verify_mfa_code, get_mfa_provisioning_uri,
     issue_temp_token, verify_temp_token
 )
 from password_validator import PasswordValidator
 from email_service import EmailService
 from rbac import require_role, get_user_id, get_user_role
-from audit_service import audit_service, AuditEventType
+from audit_service import audit_service, audit_log_writer, AuditEventType
 from replay_protection import nonce_service, require_nonce, get_nonce_endpoint
 import db
 import storage
@@ -46,6 +46,10 @@ app = FastAPI(title="MeDUSA Python API (Single Lambda)")
 # Initialize email service
 email_service = EmailService()
 
+# Auth is added before CORS so CORS ends up outermost: preflights are answered
+# there without reaching auth or routing, and 401s still carry CORS headers
+app.add_middleware(AuthMiddleware)
+
 # CORS - properly configured for web clients
 # Production: Set ALLOWED_ORIGINS env var to restrict origins (comma-separated)
 # Development: Defaults to * but logs a warning
@@ -76,16 +80,6 @@ app.add_middleware(
     max_age=600  # Cache preflight for 10 minutes
 )
 
-@app.middleware("http")
-async def _auth_mw(request: Request, call_next):
-    return await auth_middleware(request, call_next)
-
-# -------- CORS Preflight Handler
-@app.options("/{path:path}")
-async def options_handler(path: str):
-    """Handle CORS preflight requests explicitly"""
-    return {"ok": True}
-
 # -------- Admin
 @app.get("/api/v1/admin/health")
 def health():
@@ -376,12 +370,16 @@ def register(req: RegisterReq):
         "mfaEnabled": True,
         "createdAt": datetime.now(timezone.utc).isoformat()
     }
-    db.put_user(user)
+    # Conditional write: never overwrite an existing account on an id collision
+    if not db.create_user_if_absent(user):
+        raise HTTPException(409, detail={"code": "USER_EXISTS", "message": "Account could not be created, please retry"})
     
     # Send welcome email with MFA secret
     try:
-        email_service.send_welcome_with_mfa(email, mfa_secret, role)
-        print(f"[Register] Welcome email with MFA sent to {email}")
+        if email_service.send_welcome_with_mfa(email, mfa_secret, role):
+            print(f"[Register] Welcome email with MFA sent to {email}")
+        else:
+            print(f"[Register] Warning: Welcome email to {email} was not sent")
     except Exception as e:
         print(f"[Register] Warning: Failed to send welcome email: {e}")
         # Don't fail registration if email fails - user can still use the MFA secret from response
@@ -872,11 +870,13 @@ async def create_admin_user(req: CreateAdminReq, request: Request):
         "createdAt": datetime.now(timezone.utc).isoformat(),
         "createdBy": get_user_id(request)  # Track who created this admin
     }
-    db.put_user(user)
+    if not db.create_user_if_absent(user):
+        raise HTTPException(409, detail={"code": "USER_EXISTS", "message": "Account could not be created, please retry"})
     
     # Send welcome email with MFA secret
     try:
-        email_service.send_welcome_with_mfa(email, mfa_secret, "admin")
+        if not email_service.send_welcome_with_mfa(email, mfa_secret, "admin"):
+            print(f"[CreateAdmin] Warning: Welcome email to {email} was not sent")
     except Exception as e:
         print(f"[CreateAdmin] Warning: Failed to send welcome email: {e}")
     
@@ -989,7 +989,6 @@ async def poses_list(patientId: str, request: Request, nextToken: Optional[str]
         ]
         return PosePage(items=poses, nextToken=nt["id"] if isinstance(nt, dict) and "id" in nt else None)
     except Exception as e:
-        import traceback
         print(f"[ERROR] poses_list failed: {str(e)}")
         print(traceback.format_exc())
         raise HTTPException(500, detail={"code":"POSE_LIST_FAILED","message":str(e)})
@@ -1029,7 +1028,6 @@ async def poses_create(body: PoseCreateReq, request: Request):
         )
         return PosePage(items=[pose], nextToken=None)
     except Exception as e:
-        import traceback
         print(f"[ERROR] poses_create failed: {str(e)}")
         print(traceback.format_exc())
         raise HTTPException(500, detail={"code":"POSE_CREATE_FAILED","message":str(e)})
@@ -1104,7 +1102,8 @@ async def register_device(body: DeviceRegisterReq, request: Request):
         "updatedAt": now.isoformat()
     }
     
-    db.create_device(device_data)
+    if not db.create_device_if_absent(device_data):
+        raise HTTPException(409, detail={"code": "DEVICE_EXISTS", "message": "Device could not be registered, please retry"})
     
     return Device(
         id=device_data["id"],
@@ -1328,9 +1327,10 @@ async def get_patients(request: Request):
         profiles = db.get_all_patient_profiles()
     
     # Enrich with user data
+    users = db.get_users_bulk([profile["userId"] for profile in profiles])
     patients = []
     for profile in profiles:
-        user = db.get_user(profile["userId"])
+        user = users.get(profile["userId"])
         if user:
             patients.append(PatientWithProfile(
                 userId=user["id"],
@@ -1685,10 +1685,12 @@ async def get_sessions(request: Request, status: Optional[str] = None):
         all_sessions = [s for s in all_sessions if s.get("status") == status]
     
     # Enrich with details
+    devices = db.get_devices_bulk([s["deviceId"] for s in all_sessions])
+    patients = db.get_users_bulk([s["patientId"] for s in all_sessions])
     sessions_with_details = []
     for session in all_sessions:
-        device = db.get_device(session["deviceId"])
-        patient = db.get_user(session["patientId"])
+        device = devices.get(session["deviceId"])
+        patient = patients.get(session["patientId"])
         
         sessions_with_details.append(SessionWithDetails(
             sessionId=session["sessionId"],
@@ -1738,10 +1740,11 @@ async def get_doctor_patients(request: Request, doctor_id: str):
         
     profiles = db.get_patients_by_doctor(doctor_id)
     
+    users = db.get_users_bulk([p.get("userId") for p in profiles])
     patients = []
     for p in profiles:
         pid = p.get("userId")
-        user = db.get_user(pid)
+        user = users.get(pid)
         if user:
             patients.append({
                 "patient_id": pid,
@@ -1790,7 +1793,6 @@ async def assign_patient(request: Request, body: AssignPatientReq):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         print(f"Error assigning patient: {str(e)}")
         print(traceback.format_exc())
         # Return the actual error for debugging
@@ -2374,4 +2376,22 @@ def get_tremor_analysis(
     }
 
 # Lambda handler
-handler = Mangum(app)
+_mangum_handler = Mangum(app)
+
+# One-off data migrations, run by invoking the function directly with
+# {"task": "<name>"} (see deploy.ps1); API Gateway events never carry "task"
+MAINTENANCE_TASKS = {
+    "backfill-conversation-pointers": db.backfill_conversation_pointers,
+}
+
+def handler(event, context):
+    try:
+        task = event.get("task") if isinstance(event, dict) else None
+        if task is not None:
+            if task not in MAINTENANCE_TASKS:
+                return {"task": task, "error": "unknown task"}
+            return {"task": task, "updated": MAINTENANCE_TASKS[task]()}
+        return _mangum_handler(event, context)
+    finally:
+        # Emit buffered audit lines before the execution environment is frozen
+        audit_log_writer.flush()
@@ -5,12 +5,23 @@ Run with: python -m pytest test_audit_service.py -v
 Or simply: python test_audit_service.py
 """
 
+import io
+import os
 import json
+import socket
+import struct
+import tempfile
+import threading
+import time
 import unittest
+from unittest.mock import patch
+import audit_service as audit_module
 from audit_service import (
     AuditService, 
     AuditEventType, 
     AuditSeverity,
+    AuditLogWriter,
+    UnixSocketAuditSink,
     audit_service,
     log_audit
 )
@@ -118,7 +129,7 @@ class TestAuditService(unittest.TestCase):
         
         # Each entry should have a unique hash
         self.assertNotEqual(entry1["event_hash"], entry2["event_hash"])
-        self.assertEqual(len(entry1["event_hash"]), 16)  # SHA-256 truncated
+        self.assertEqual(len(entry1["event_hash"]), 16)  # BLAKE2b 64-bit digest
     
     def test_login_success_convenience_method(self):
         """Test login success convenience method"""
@@ -209,11 +220,25 @@ class TestAuditService(unittest.TestCase):
         self.assertEqual(masked["user"]["password"], "***REDACTED***")
         self.assertEqual(masked["metadata"]["token"], "***REDACTED***")
     
+    def test_non_string_detail_keys(self):
+        """Details with non-str keys serialize with stringified keys"""
+        payload = self.service._serialize_entry(
+            self.service._mask_sensitive_data({1: "a", "password": "x", "nested": {2: "b"}})
+        )
+        
+        self.assertEqual(json.loads(payload), {"1": "a", "password": "***REDACTED***", "nested": {"2": "b"}})
+    
     def test_empty_data_handling(self):
         """Test handling of empty/None data"""
         self.assertIsNone(self.service._mask_sensitive_data(None))
         self.assertEqual(self.service._mask_sensitive_data({}), {})
     
+    def test_non_sensitive_data_not_copied(self):
+        """Test that data without sensitive keys is returned unchanged"""
+        data = {"data_type": "tremor_analysis", "filters": {"severity": "INFO"}}
+        
+        self.assertIs(self.service._mask_sensitive_data(data), data)
+    
     def test_all_event_types_have_severity(self):
         """Ensure all event types can get a severity"""
         for event_type in AuditEventType:
@@ -258,6 +283,151 @@ class TestAuditEventTypes(unittest.TestCase):
             self.assertIn(event, AuditEventType)
 
 
+
+class _ListSink:
+    """Collects emitted records; raises while failing is set"""
+    
+    def __init__(self, failing=False):
+        self.failing = failing
+        self.records = []
+    
+    def emit(self, records):
+        if self.failing:
+            raise OSError("sink down")
+        self.records.extend(records)
+
+
+class TestAuditLogWriter(unittest.TestCase):
+    """Test cases for buffered audit output"""
+    
+    # Writers get a long flush_interval so only explicit flush() calls emit
+    
+    def _roots(self, records):
+        return [json.loads(r) for tag, r in records if tag == "AUDIT_ROOT"]
+    
+    def test_failed_emit_falls_back_to_stderr(self):
+        """A failing sink's batch is written to stderr instead of dropped"""
+        sink = _ListSink(failing=True)
+        writer = AuditLogWriter(sink=sink, flush_interval=3600)
+        fallback = _ListSink()
+        with patch.object(audit_module, "_STDERR_SINK", fallback), \
+             patch("sys.stderr", io.StringIO()):
+            writer.write("AUDIT", b'{"n":1}', "00" * 8)
+            writer.flush()
+        
+        self.assertEqual(fallback.records[0], ("AUDIT", b'{"n":1}'))
+        root = self._roots(fallback.records)[0]
+        self.assertEqual(writer._last_root, root["root"])
+    
+    def test_unwritten_batch_is_requeued_without_advancing_root(self):
+        """If nothing could be written, the batch and chain wait for the next flush"""
+        sink = _ListSink(failing=True)
+        writer = AuditLogWriter(sink=sink, flush_interval=3600)
+        with patch.object(audit_module, "_STDERR_SINK", _ListSink(failing=True)), \
+             patch("sys.stderr", io.StringIO()):
+            writer.write("AUDIT", b'{"n":1}', "01" * 8)
+            writer.flush()
+        self.assertIsNone(writer._last_root)
+        
+        sink.failing = False
+        writer.write("AUDIT", b'{"n":2}', "02" * 8)
+        writer.flush()
+        
+        self.assertEqual([r for tag, r in sink.records if tag == "AUDIT"], [b'{"n":1}', b'{"n":2}'])
+        roots = self._roots(sink.records)
+        self.assertEqual(len(roots), 1)
+        self.assertEqual(roots[0]["count"], 2)
+        self.assertIsNone(roots[0]["prevRoot"])
+        self.assertEqual(writer._last_root, roots[0]["root"])
+    
+    def test_roots_chain_across_batches(self):
+        """Each batch root is keyed with the previous one"""
+        sink = _ListSink()
+        writer = AuditLogWriter(sink=sink, flush_interval=3600)
+        for i in range(2):
+            writer.write("AUDIT", b"{}", f"{i:016x}")
+            writer.flush()
+        
+        first, second = self._roots(sink.records)
+        self.assertEqual(second["prevRoot"], first["root"])
+    
+    def _wait_for(self, predicate, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertTrue(predicate())
+    
+    def test_background_thread_writes_after_interval_then_idles(self):
+        """A queued record is written by the thread; an empty queue takes no wakeups"""
+        class CountingCondition(threading.Condition):
+            waits = 0
+            def wait(self, timeout=None):
+                CountingCondition.waits += 1
+                return super().wait(timeout)
+        
+        sink = _ListSink()
+        writer = AuditLogWriter(sink=sink, flush_interval=0.01)
+        writer._cond = CountingCondition()
+        writer.write("AUDIT", b'{"n":1}')
+        self._wait_for(lambda: sink.records)
+        # Let the thread get back to its idle wait
+        self._wait_for(lambda: writer._cond._waiters)
+        waits = CountingCondition.waits
+        time.sleep(0.1)  # ten flush intervals
+        
+        self.assertEqual(sink.records, [("AUDIT", b'{"n":1}')])
+        self.assertEqual(CountingCondition.waits, waits)
+    
+    def test_full_batch_is_written_before_interval(self):
+        """Reaching batch_size wakes the thread without waiting out the deadline"""
+        sink = _ListSink()
+        writer = AuditLogWriter(sink=sink, batch_size=3, flush_interval=3600)
+        for i in range(3):
+            writer.write("AUDIT", b"{}")
+        
+        self._wait_for(lambda: len(sink.records) == 3)
+
+
+
+class TestUnixSocketAuditSink(unittest.TestCase):
+    """Test cases for the framed Unix socket sink"""
+    
+    def test_frames_records_on_socket(self):
+        """Records arrive as 4-byte length-prefixed frames"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "audit.sock")
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+            server.listen(1)
+            self.addCleanup(server.close)
+            
+            UnixSocketAuditSink(path).emit([("AUDIT", b'{"a":1}'), ("AUDIT_ROOT", b"{}")])
+            conn, _ = server.accept()
+            data = conn.recv(1024)
+            conn.close()
+        
+        self.assertEqual(data, struct.pack(">I", 7) + b'{"a":1}' + struct.pack(">I", 2) + b"{}")
+    
+    def test_dead_socket_falls_back_to_stdout_and_reports(self):
+        """An unreachable socket is reported once and records go to stdout"""
+        sink = UnixSocketAuditSink("/nonexistent/medusa-audit.sock")
+        with patch("sys.stdout", io.StringIO()) as out, patch("sys.stderr", io.StringIO()) as err:
+            sink.emit([("AUDIT", b'{"a":1}')])
+            sink.emit([("AUDIT", b'{"a":2}')])
+        
+        self.assertEqual(out.getvalue(), '[AUDIT] {"a":1}\n[AUDIT] {"a":2}\n')
+        self.assertEqual(err.getvalue().count("[AUDIT_SINK_ERROR]"), 1)
+    
+    def test_fallback_errors_propagate(self):
+        """If stdout fails too, emit raises instead of silently dropping"""
+        sink = UnixSocketAuditSink("/nonexistent/medusa-audit.sock")
+        broken = io.StringIO()
+        broken.close()
+        with patch("sys.stdout", broken), patch("sys.stderr", io.StringIO()):
+            with self.assertRaises(ValueError):
+                sink.emit([("AUDIT", b"{}")])
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("MeDUSA Audit Service Test Suite")
@@ -0,0 +1,407 @@
+"""
+Test suite for MeDUSA DynamoDB access layer
+
+Run with: python -m pytest test_db.py -v
+"""
+
+import os
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+os.environ.setdefault('USE_MEMORY', 'true')
+
+import db
+
+
+class _ConditionalCheckFailed(Exception):
+    pass
+
+
+class FakeCountersTable:
+    """
+    Just enough of a DynamoDB Table to exercise the counters row: ADD
+    increments, and the conditional ADD used to seed a counter.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.meta = MagicMock()
+        self.meta.client.exceptions.ConditionalCheckFailedException = _ConditionalCheckFailed
+
+    def get_item(self, Key):
+        item = self.items.get(Key["settingKey"])
+        return {"Item": dict(item)} if item is not None else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames,
+                    ExpressionAttributeValues, ConditionExpression=None, ReturnValues=None):
+        item = self.items.setdefault(Key["settingKey"], {"settingKey": Key["settingKey"]})
+        name = ExpressionAttributeNames["#n"]
+        values = ExpressionAttributeValues
+        if UpdateExpression == "ADD #n :d":
+            item[name] = item.get(name, 0) + values[":d"]
+        elif UpdateExpression == "ADD #n :d, seeded :s":
+            if values[":name"] in item.get("seeded", set()):
+                raise _ConditionalCheckFailed()
+            item[name] = item.get(name, 0) + values[":d"]
+            item["seeded"] = item.get("seeded", set()) | values[":s"]
+        else:
+            raise AssertionError(f"unexpected update: {UpdateExpression}")
+        return {"Attributes": {name: item[name]}}
+
+
+class TestDashboardCounters(unittest.TestCase):
+    """Counters row used for dashboard totals"""
+
+    def setUp(self):
+        self.settings = FakeCountersTable()
+        self.users = MagicMock()
+        self.users.scan.return_value = {"Count": 5}
+        self.devices = MagicMock()
+        self.devices.scan.return_value = {"Count": 3}
+        patchers = [
+            patch.object(db, "USE_MEMORY", False),
+            patch.object(db, "T_SYSTEM_SETTINGS", self.settings, create=True),
+            patch.object(db, "T_USERS", self.users, create=True),
+            patch.object(db, "T_DEVICES", self.devices, create=True),
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_increment_before_first_read_is_recounted(self):
+        """Deltas written before seeding don't pass for totals"""
+        db.increment_counter("users")
+        db.increment_counter("devices", -1)
+
+        counters = db._get_counters()
+
+        self.assertEqual(counters, {"users": 5, "devices": 3})
+        self.devices.scan.assert_called_once()
+        self.assertEqual(self.settings.items[db._COUNTERS_KEY]["seeded"], {"users", "devices"})
+
+    def test_seeded_counters_are_not_rescanned(self):
+        """After seeding, reads use the row and increments apply on top"""
+        db._get_counters()
+        db.increment_counter("users")
+        db.increment_counter("devices", -1)
+
+        counters = db._get_counters()
+
+        self.assertEqual(counters, {"users": 6, "devices": 2})
+        self.users.scan.assert_called_once()
+        self.devices.scan.assert_called_once()
+
+    def test_partially_seeded_row_recounts_missing_field(self):
+        """A counter missing from the seeded set is recounted on its own"""
+        self.settings.items[db._COUNTERS_KEY] = {
+            "settingKey": db._COUNTERS_KEY, "users": 7, "devices": -1, "seeded": {"users"}
+        }
+
+        counters = db._get_counters()
+
+        self.assertEqual(counters, {"users": 7, "devices": 3})
+        self.users.scan.assert_not_called()
+
+    def test_increment_during_seeding_is_kept(self):
+        """A user created after the COUNT scan read past it still counts"""
+        def scan(**kwargs):
+            db.increment_counter("users")
+            return {"Count": 5}
+        self.users.scan.side_effect = scan
+
+        counters = db._get_counters()
+
+        self.assertEqual(counters["users"], 6)
+        self.assertEqual(self.settings.items[db._COUNTERS_KEY]["users"], 6)
+        self.assertEqual(db._get_counters()["users"], 6)
+
+    def test_device_creation_paths_increment_counter(self):
+        """Single and bulk device creates both feed totalDevices"""
+        db._get_counters()
+        self.devices.put_item.return_value = {}
+        self.devices.batch_writer.return_value = MagicMock()
+
+        db.create_device({"id": "d1"})
+        db.create_devices_bulk([{"id": "d2"}, {"id": "d3"}, {"id": "d3"}])
+        self.devices.put_item.return_value = {"Attributes": {"id": "d1"}}
+        db.create_device({"id": "d1"})  # overwrite, not a new device
+
+        self.assertEqual(db._get_counters()["devices"], 6)
+
+
+class TestAuditLogQueries(unittest.TestCase):
+    """Index selection for audit log queries"""
+
+    def setUp(self):
+        self.table = MagicMock()
+        self.table.query.return_value = {"Items": []}
+        self.table.meta.client.exceptions.ConditionalCheckFailedException = _ConditionalCheckFailed
+        patchers = [
+            patch.object(db, "USE_MEMORY", False),
+            patch.object(db, "T_AUDIT_LOGS", self.table, create=True),
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _query_params(self):
+        return self.table.query.call_args.kwargs
+
+    def test_event_and_severity_filter_until_index_ready(self):
+        """Rows without eventTypeSeverity stay visible before the backfill"""
+        with patch.object(db, "AUDIT_EVENT_SEVERITY_INDEX_READY", False):
+            db.get_audit_logs(event_type="AUTH_LOGIN_FAILURE", severity="WARNING")
+
+        params = self._query_params()
+        self.assertEqual(params["IndexName"], "eventType-index")
+        self.assertEqual(params["FilterExpression"], "#sev = :sev")
+        self.assertEqual(params["ExpressionAttributeValues"][":sev"], "WARNING")
+
+    def test_event_and_severity_use_composite_index_when_ready(self):
+        """Once backfilled, event type + severity is a key condition"""
+        with patch.object(db, "AUDIT_EVENT_SEVERITY_INDEX_READY", True):
+            db.get_audit_logs(event_type="AUTH_LOGIN_FAILURE", severity="WARNING")
+
+        params = self._query_params()
+        self.assertEqual(params["IndexName"], "eventTypeSeverity-index")
+        self.assertNotIn("FilterExpression", params)
+        self.assertIn("AUTH_LOGIN_FAILURE#WARNING", params["ExpressionAttributeValues"].values())
+
+    def test_put_audit_log_adds_composite_key(self):
+        db.put_audit_log({"pk": "AUDIT#ALL", "sk": "t1", "eventType": "E", "severity": "INFO"})
+
+        item = self.table.put_item.call_args.kwargs["Item"]
+        self.assertEqual(item["eventTypeSeverity"], "E#INFO")
+
+    def test_backfill_sets_missing_composite_keys(self):
+        """Backfill pages through older rows and writes the composite key"""
+        self.table.scan.side_effect = [
+            {"Items": [{"pk": "AUDIT#ALL", "sk": "t1", "eventType": "E", "severity": "INFO"}],
+             "LastEvaluatedKey": {"pk": "AUDIT#ALL", "sk": "t1"}},
+            {"Items": [{"pk": "AUDIT#ALL", "sk": "t2", "eventType": "F", "severity": "HIGH"}]},
+        ]
+
+        self.assertEqual(db.backfill_audit_event_type_severity(), 2)
+
+        values = [c.kwargs["ExpressionAttributeValues"][":v"] for c in self.table.update_item.call_args_list]
+        self.assertEqual(values, ["E#INFO", "F#HIGH"])
+        self.assertEqual(self.table.scan.call_args_list[1].kwargs["ExclusiveStartKey"],
+                         {"pk": "AUDIT#ALL", "sk": "t1"})
+
+
+
+class TestTTLCache(unittest.TestCase):
+    """Read cache shared by request threads"""
+
+    def test_get_returns_copy_and_evicts_lru(self):
+        cache = db._TTLCache(maxsize=2)
+        cache.put("a", {"v": 1})
+        cache.put("b", {"v": 2})
+        cache.get("a")["v"] = 99  # mutating the result leaves the cache intact
+        cache.put("c", {"v": 3})  # "b" is least recently used
+
+        self.assertEqual(cache.get("a"), {"v": 1})
+        self.assertIsNone(cache.get("b"))
+
+    def test_nested_mutation_leaves_cache_intact(self):
+        """Updating a nested field (as the settings endpoint does) can't leak into the cache"""
+        cache = db._TTLCache()
+        user = {"id": "usr_1", "settings": {"theme": "light"}}
+        cache.put("usr_1", user)
+        user["settings"]["theme"] = "blue"  # caller keeps editing what it cached
+
+        settings = cache.get("usr_1")["settings"]
+        settings.update({"theme": "dark"})
+
+        self.assertEqual(cache.get("usr_1")["settings"], {"theme": "light"})
+
+    def test_read_overlapping_invalidation_is_not_cached(self):
+        """A read that started before a write can't re-cache the old item"""
+        cache = db._TTLCache()
+        generation = cache.generation()
+        cache.pop("dev_1")  # write completed while the read was in flight
+        cache.put("dev_1", {"status": "old"}, generation)
+
+        self.assertIsNone(cache.get("dev_1"))
+
+    def test_concurrent_access(self):
+        """Interleaved get/put/pop from many threads neither raise nor overfill"""
+        cache = db._TTLCache(maxsize=32, ttl=0.001)
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(2000):
+                    key = str((n * 7 + i) % 64)
+                    cache.put(key, {"i": i})
+                    cache.get(key)
+                    cache.pop(str(i % 64))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache._items), 32)
+
+
+
+class TestWriteInvalidation(unittest.TestCase):
+    """Cached point reads after writes"""
+
+    def setUp(self):
+        self.stored = {"id": "dev_1", "status": "old"}
+        self.devices = MagicMock()
+        patchers = [
+            patch.object(db, "USE_MEMORY", False),
+            patch.object(db, "T_DEVICES", self.devices, create=True),
+            patch.object(db, "_get_item_raw", lambda table, key: dict(self.stored), create=True),
+            patch.object(db, "_device_cache", db._TTLCache()),
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_read_during_update_is_not_served_stale(self):
+        """A reader racing update_device doesn't leave the old item cached"""
+        def update_item(**kwargs):
+            db.get_device("dev_1")  # concurrent reader sees the old row
+            self.stored["status"] = "active"
+
+        self.devices.update_item.side_effect = update_item
+        db.update_device("dev_1", {"status": "active"})
+
+        self.assertEqual(db.get_device("dev_1")["status"], "active")
+
+
+class _TransactionCanceled(Exception):
+    def __init__(self, *reasons):
+        super().__init__("Transaction cancelled")
+        self.response = {"CancellationReasons": [{"Code": code} for code in reasons]}
+
+
+class TestConversations(unittest.TestCase):
+    """Conversation METADATA/MEMBER# rows behind participantRecent-index"""
+
+    def setUp(self):
+        self.table = MagicMock()
+        self.table.name = "messages"
+        self.table.meta.client.exceptions.TransactionCanceledException = _TransactionCanceled
+        self.table.get_item.return_value = {"Item": {"participants": ["u1", "u2", "u3"]}}
+        patchers = [
+            patch.object(db, "USE_MEMORY", False),
+            patch.object(db, "T_MESSAGES", self.table, create=True),
+            patch.object(db.time, "sleep"),
+            patch.object(db, "_participants_cache", db._TTLCache()),
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _transactions(self):
+        return [c.kwargs["TransactItems"] for c in self.table.meta.client.transact_write_items.call_args_list]
+
+    def test_send_message_writes_one_transaction(self):
+        """The message, METADATA and every pointer row commit together"""
+        message = db.send_message("c1", "u2", "hello")
+
+        (actions,) = self._transactions()
+        self.assertEqual(actions[0]["Put"]["Item"]["messageId"], message["messageId"])
+        self.assertEqual(actions[1]["Update"]["Key"], {"conversationId": "c1", "messageId": "METADATA"})
+        self.assertEqual([a["Update"]["Key"]["messageId"] for a in actions[2:]], ["MEMBER#u2", "MEMBER#u3"])
+        self.assertEqual({a["Update"]["ExpressionAttributeValues"][":t"] for a in actions[1:]},
+                         {message["createdAt"]})
+        self.table.put_item.assert_not_called()
+
+    def test_send_message_without_conversation_stores_message_only(self):
+        self.table.get_item.return_value = {}
+
+        db.send_message("c1", "u1", "hello")
+
+        self.table.put_item.assert_called_once()
+        self.table.meta.client.transact_write_items.assert_not_called()
+
+    def test_large_conversation_is_split_at_transaction_limit(self):
+        self.table.get_item.return_value = {"Item": {"participants": [f"u{i}" for i in range(150)]}}
+
+        db.send_message("c1", "u0", "hello")
+
+        # 1 put + 1 METADATA update + 149 pointer updates
+        self.assertEqual([len(t) for t in self._transactions()], [100, 51])
+
+    def test_conflicting_transaction_is_retried(self):
+        self.table.meta.client.transact_write_items.side_effect = [
+            _TransactionCanceled("None", "TransactionConflict"), {}
+        ]
+
+        db.send_message("c1", "u1", "hello")
+
+        self.assertEqual(len(self._transactions()), 2)
+
+    def test_backfill_rewrites_legacy_conversations(self):
+        """Legacy METADATA rows get reindexed and pointer rows without clobbering newer sends"""
+        self.table.scan.side_effect = [
+            {"Items": [{"conversationId": "c1", "participants": ["u1", "u2"],
+                        "lastMessageAt": "2026-01-01T00:00:00+00:00"}],
+             "LastEvaluatedKey": {"conversationId": "c1", "messageId": "METADATA"}},
+            {"Items": [{"conversationId": "c2", "participants": ["u3"], "createdAt": "2026-02-01"}]},
+        ]
+
+        self.assertEqual(db.backfill_conversation_pointers(), 2)
+
+        first, second = self._transactions()
+        self.assertEqual([(a["Update"]["Key"]["messageId"], a["Update"]["ExpressionAttributeValues"][":pid"])
+                          for a in first], [("METADATA", "u1"), ("MEMBER#u2", "u2")])
+        for action in first + second:
+            self.assertIn("if_not_exists(lastMessageAt", action["Update"]["UpdateExpression"])
+        self.assertEqual(second[0]["Update"]["ExpressionAttributeValues"][":t"], "2026-02-01")
+        self.assertEqual(self.table.scan.call_args_list[1].kwargs["ExclusiveStartKey"],
+                         {"conversationId": "c1", "messageId": "METADATA"})
+
+    def test_participants_are_read_once(self):
+        """Later sends to a conversation are a single transaction, no GetItem"""
+        db.send_message("c1", "u2", "hello")
+        db.send_message("c1", "u3", "hi")
+
+        self.table.get_item.assert_called_once()
+        self.assertEqual(len(self._transactions()), 2)
+
+    def test_create_conversation_primes_participants(self):
+        db.create_conversation("c9", ["u1", "u2"], "u1")
+        db.send_message("c9", "u1", "hello")
+
+        self.table.get_item.assert_not_called()
+        (actions,) = self._transactions()
+        self.assertEqual(actions[-1]["Update"]["Key"]["messageId"], "MEMBER#u2")
+
+    def test_get_conversations_uses_participant_index_until_ready(self):
+        """Before the backfill, listings keep reading participantId-index"""
+        self.table.query.return_value = {"Items": [
+            {"conversationId": "c1", "messageId": "METADATA", "participantId": "u1"},
+            {"conversationId": "c2", "messageId": "MEMBER#u1"},
+        ]}
+        with patch.object(db, "CONVERSATION_RECENT_INDEX_READY", False), \
+                patch.object(db, "_batch_get", return_value={"c2": {"conversationId": "c2"}}):
+            conversations = db.get_conversations("u1")
+
+        self.assertEqual([c["conversationId"] for c in conversations], ["c1", "c2"])
+        self.assertEqual(self.table.query.call_args.kwargs["IndexName"], "participantId-index")
+
+    def test_get_conversations_keeps_index_order(self):
+        self.table.query.return_value = {"Items": [{"conversationId": "c2"}, {"conversationId": "c1"}]}
+        with patch.object(db, "CONVERSATION_RECENT_INDEX_READY", True), \
+                patch.object(db, "_batch_get", return_value={"c1": {"conversationId": "c1"},
+                                                             "c2": {"conversationId": "c2"}}):
+            conversations = db.get_conversations("u1")
+
+        self.assertEqual([c["conversationId"] for c in conversations], ["c2", "c1"])
+        self.assertEqual(self.table.query.call_args.kwargs["IndexName"], "participantRecent-index")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+"""
+Test suite for MeDUSA Email Service
+
+Run with: python -m pytest test_email_service.py -v
+"""
+
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+from botocore.exceptions import ClientError
+
+import email_service
+from email_service import EmailService, _SendRateLimiter
+
+
+def _client_error(code, operation="SendEmail"):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class FakeClock:
+    """Stands in for time.monotonic/time.sleep; sleeping advances the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestSendRateLimiter(unittest.TestCase):
+    """Per-container pacing to the SES send quota"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for name in ("monotonic", "sleep"):
+            p = patch.object(email_service.time, name, getattr(self.clock, name))
+            p.start()
+            self.addCleanup(p.stop)
+        self.ses = MagicMock()
+        self.ses.get_send_quota.return_value = {"MaxSendRate": 2.0}
+        self.limiter = _SendRateLimiter()
+
+    def test_unpaced_until_quota_is_read(self):
+        """A failed GetSendQuota leaves sends unthrottled rather than blocked"""
+        self.ses.get_send_quota.side_effect = _client_error("AccessDenied", "GetSendQuota")
+
+        for _ in range(5):
+            self.limiter.acquire(self.ses)
+
+        self.assertIsNone(self.limiter.rate)
+        self.assertEqual(self.clock.sleeps, [])
+        self.ses.get_send_quota.assert_called_once()
+
+    def test_paces_at_max_send_rate(self):
+        """A full bucket covers MaxSendRate sends; the next one waits its turn"""
+        for _ in range(3):
+            self.limiter.acquire(self.ses)
+
+        self.assertEqual(self.limiter.rate, 2.0)
+        self.assertEqual(self.clock.sleeps, [0.5])
+
+    def test_quota_is_refreshed_periodically(self):
+        """MaxSendRate is re-read only after the refresh interval"""
+        self.limiter.acquire(self.ses)
+        self.clock.now += email_service.SES_QUOTA_REFRESH_SECONDS - 1
+        self.limiter.acquire(self.ses)
+        self.assertEqual(self.ses.get_send_quota.call_count, 1)
+
+        self.ses.get_send_quota.return_value = {"MaxSendRate": 1.0}
+        self.clock.now += 1
+        self.limiter.acquire(self.ses)
+
+        self.assertEqual(self.ses.get_send_quota.call_count, 2)
+        self.assertEqual(self.limiter.max_rate, 1.0)
+        self.assertEqual(self.limiter.rate, 1.0)
+
+    def test_throttle_backs_off_and_success_recovers(self):
+        """Throttling halves the pace (floor 1/s); successes regrow it to the quota"""
+        self.ses.get_send_quota.return_value = {"MaxSendRate": 14.0}
+        self.limiter.acquire(self.ses)
+
+        self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 7.0)
+        for _ in range(4):
+            self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 1.0)
+
+        self.limiter.on_success()
+        self.assertEqual(self.limiter.rate, 1.0 + email_service.SES_RATE_INCREASE)
+        for _ in range(100):
+            self.limiter.on_success()
+        self.assertEqual(self.limiter.rate, 14.0)
+
+    def test_throttled_send_reports_to_limiter(self):
+        """_ses_send halves the pace on Throttling and re-raises the error"""
+        service = EmailService()
+        service.ses_client = self.ses
+        limiter = _SendRateLimiter()
+        self.ses.send_email.side_effect = [_client_error("Throttling"), {"MessageId": "m-1"}]
+
+        with patch.object(EmailService, "_rate_limiter", limiter):
+            with self.assertRaises(ClientError):
+                service._ses_send("send_email", 1)
+            self.assertEqual(limiter.rate, 1.0)
+            self.assertEqual(service._ses_send("send_email", 1), {"MessageId": "m-1"})
+            self.assertEqual(limiter.rate, 1.0 + email_service.SES_RATE_INCREASE)
+
+
+def _render(template_part, data):
+    """What SES does with a template part: substitute each {{field}}"""
+    for field, value in data.items():
+        template_part = template_part.replace("{{%s}}" % field, value)
+    return template_part
+
+
+class TestSesTemplates(unittest.TestCase):
+    """SendTemplatedEmail path and the deploy-time template sync"""
+
+    # Previous SendEmail bodies, rendered in Python, per template kind
+    CASES = {
+        "registration": {"code": "123456"},
+        "password_reset": {"code": "654321"},
+        "welcome_mfa": {"email": "pat@example.com", "mfa_secret": "JBSWY3DPEHPK3PXP", "role_upper": "PATIENT"},
+    }
+
+    def setUp(self):
+        self.service = EmailService()
+        self.service.use_ses = True
+        self.service.ses_client = self.ses = MagicMock()
+        self.ses.send_templated_email.return_value = {"MessageId": "m-1"}
+        self.ses.send_email.return_value = {"MessageId": "m-2"}
+        p = patch.object(EmailService, "_rate_limiter", _SendRateLimiter())
+        p.start()
+        self.addCleanup(p.stop)
+
+    def _synced_templates(self):
+        self.service.sync_ses_templates()
+        return {c.kwargs["Template"]["TemplateName"]: c.kwargs["Template"]
+                for c in self.ses.create_template.call_args_list}
+
+    def _legacy_email(self, kind, data):
+        if kind == "welcome_mfa":
+            return (self.service._WELCOME_MFA_TEMPLATE.format(**data),
+                    self.service._WELCOME_MFA_TEXT_TEMPLATE.format(**data))
+        if kind == "password_reset":
+            return self.service._generate_password_reset_email(data["code"])
+        return self.service._generate_verification_email(data["code"])
+
+    def test_verification_code_sends_only_template_data(self):
+        """The request carries the template name and the code, not the body"""
+        self.assertTrue(self.service.send_verification_code("a@example.com", "123456", "password_reset"))
+
+        self.ses.send_email.assert_not_called()
+        kwargs = self.ses.send_templated_email.call_args.kwargs
+        self.assertEqual(kwargs["Template"], "medusa-password-reset-code")
+        self.assertEqual(kwargs["Destination"], {"ToAddresses": ["a@example.com"]})
+        self.assertEqual(json.loads(kwargs["TemplateData"]), {"code": "123456"})
+
+    def test_welcome_mfa_sends_template_data(self):
+        self.assertTrue(self.service.send_welcome_with_mfa("pat@example.com", "SECRET", "doctor"))
+
+        kwargs = self.ses.send_templated_email.call_args.kwargs
+        self.assertEqual(kwargs["Template"], "medusa-welcome-mfa")
+        self.assertEqual(json.loads(kwargs["TemplateData"]),
+                         {"email": "pat@example.com", "mfa_secret": "SECRET", "role_upper": "DOCTOR"})
+
+    def test_missing_template_falls_back_to_full_body(self):
+        """Before sync-templates has run, the rendered body goes out via SendEmail"""
+        self.ses.send_templated_email.side_effect = _client_error("TemplateDoesNotExist", "SendTemplatedEmail")
+
+        self.assertTrue(self.service.send_verification_code("a@example.com", "123456"))
+
+        message = self.ses.send_email.call_args.kwargs["Message"]
+        html, text = self.service._generate_verification_email("123456")
+        self.assertEqual(message["Subject"]["Data"], "Email Verification Code - MeDUSA")
+        self.assertEqual(message["Body"]["Html"]["Data"], html)
+        self.assertEqual(message["Body"]["Text"]["Data"], text)
+
+    def test_other_send_errors_do_not_fall_back(self):
+        self.ses.send_templated_email.side_effect = _client_error("MessageRejected", "SendTemplatedEmail")
+
+        self.assertFalse(self.service.send_verification_code("a@example.com", "123456"))
+        self.ses.send_email.assert_not_called()
+
+    def test_sync_uploads_every_template(self):
+        """Each kind is created with handlebars placeholders for its fields"""
+        templates = self._synced_templates()
+
+        self.assertEqual(set(templates), {name for name, _ in EmailService._SES_TEMPLATES.values()})
+        reset = templates["medusa-password-reset-code"]
+        self.assertEqual(reset["SubjectPart"], "Password Reset Verification Code - MeDUSA")
+        self.assertIn('<div class="code">{{code}}</div>', reset["HtmlPart"])
+        self.assertIn("{{code}}", reset["TextPart"])
+        self.ses.update_template.assert_not_called()
+
+    def test_sync_updates_existing_templates(self):
+        self.ses.create_template.side_effect = _client_error("AlreadyExists", "CreateTemplate")
+
+        names = self.service.sync_ses_templates()
+
+        self.assertEqual(self.ses.update_template.call_count, len(names))
+
+    def test_rendered_templates_match_previous_bodies(self):
+        """SES substitution yields byte-identical bodies to the SendEmail path"""
+        templates = self._synced_templates()
+
+        for kind, data in self.CASES.items():
+            with self.subTest(kind=kind):
+                template = templates[EmailService._SES_TEMPLATES[kind][0]]
+                html, text = self._legacy_email(kind, data)
+                self.assertEqual(template["SubjectPart"], self.service._template_content(kind)[0])
+                self.assertEqual(_render(template["HtmlPart"], data), html)
+                self.assertEqual(_render(template["TextPart"], data), text)
+
+
+if __name__ == "__main__":
+    unittest.main()
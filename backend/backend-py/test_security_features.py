@@ -17,10 +17,18 @@ import json
 import time
 import hashlib
 import base64
+import io
+import tempfile
+import types
 import unittest
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch, MagicMock
 
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
 # Set up test environment
 os.environ['USE_MEMORY'] = 'true'
 os.environ['JWT_SECRET'] = 'test-secret-key-for-testing'
@@ -38,10 +46,30 @@ from firmware_service import (
     FirmwareVerificationService,
     FirmwareStatus,
     FirmwareManifest,
-    firmware_service
+    firmware_service,
+    verify_firmware_batch
 )
+import firmware_service as firmware_module
 from password_validator import PasswordValidator
 from audit_service import AuditService, AuditEventType, AuditSeverity
+from auth import (
+    issue_tokens,
+    issue_temp_token,
+    verify_jwt,
+    verify_temp_token,
+    _jwt_encode_hs256,
+    _jwt_decode_hs256,
+    TokenError,
+    TokenExpiredError,
+    AuthMiddleware
+)
+import auth as auth_module
+from fastapi import FastAPI, HTTPException, Request
+
+try:
+    from fastapi.testclient import TestClient
+except ImportError:  # TestClient needs httpx, which the Lambda bundle doesn't ship
+    TestClient = None
 
 
 class TestNonceService(unittest.TestCase):
@@ -378,6 +406,272 @@ class TestFirmwareVerificationService(unittest.TestCase):
         self.assertEqual(result.status, FirmwareStatus.VERSION_ROLLBACK)
 
 
+def _private_key_pem(private_key) -> str:
+    return private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode()
+
+
+def _public_key_pem(private_key) -> str:
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+
+def _certificate_pem(subject, subject_key, issuer, issuer_key, valid_days=(-1, 30)) -> str:
+    """PEM certificate for subject_key, signed by issuer_key"""
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)]))
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer)]))
+        .public_key(subject_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now + timedelta(days=valid_days[0]))
+        .not_valid_after(now + timedelta(days=valid_days[1]))
+        .sign(issuer_key, hashes.SHA256())
+    )
+    return cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class TestFirmwareCertificates(unittest.TestCase):
+    """Test cases for the trusted certificate cache."""
+    
+    @classmethod
+    def setUpClass(cls):
+        root_key = ec.generate_private_key(ec.SECP256R1())
+        cls.leaf_key = ec.generate_private_key(ec.SECP256R1())
+        other_key = ec.generate_private_key(ec.SECP256R1())
+        root = _certificate_pem("root", root_key, "root", root_key)
+        
+        class Service(FirmwareVerificationService):
+            TRUSTED_CERTIFICATES = {
+                "good": _certificate_pem("leaf", cls.leaf_key, "root", root_key) + root,
+                "expired": _certificate_pem("leaf", cls.leaf_key, "root", root_key, (-30, -1)) + root,
+                "broken": _certificate_pem("leaf", cls.leaf_key, "root", other_key) + root,
+                "junk": "not a certificate",
+            }
+        
+        cls.service_class = Service
+        cls.firmware_data = b"certificate test firmware" * 50
+    
+    def _verify(self, service, certificate_id, private_key):
+        manifest = FirmwareVerificationService.create_manifest(
+            firmware_id="fw_cert",
+            version="1.2.0",
+            device_type="tremor_sensor",
+            firmware_data=self.firmware_data,
+            certificate_id=certificate_id,
+            private_key_pem=_private_key_pem(private_key)
+        )
+        return service.verify_firmware_update(manifest, self.firmware_data, "1.0.0", "tremor_sensor")
+    
+    def test_valid_chain_verifies_with_leaf_key(self):
+        """A manifest naming a trusted certificate is checked with its leaf key"""
+        result = self._verify(self.service_class(), "good", self.leaf_key)
+        self.assertEqual(result.status, FirmwareStatus.VALID, result.message)
+    
+    def test_leaf_key_takes_precedence_over_configured_key(self):
+        """A key other than the certificate's leaf doesn't pass for it"""
+        configured_key = ec.generate_private_key(ec.SECP256R1())
+        service = self.service_class(_public_key_pem(configured_key))
+        
+        result = self._verify(service, "good", configured_key)
+        
+        self.assertEqual(result.status, FirmwareStatus.INVALID_SIGNATURE)
+    
+    def test_expired_chain(self):
+        result = self._verify(self.service_class(), "expired", self.leaf_key)
+        self.assertEqual(result.status, FirmwareStatus.EXPIRED_CERTIFICATE)
+    
+    def test_broken_chain(self):
+        """A leaf not signed by the next certificate in its chain is rejected"""
+        result = self._verify(self.service_class(), "broken", self.leaf_key)
+        self.assertEqual(result.status, FirmwareStatus.INVALID_SIGNATURE)
+    
+    def test_unparseable_certificate(self):
+        result = self._verify(self.service_class(), "junk", self.leaf_key)
+        self.assertEqual(result.status, FirmwareStatus.INVALID_SIGNATURE)
+    
+    def test_revoked_certificate(self):
+        service = self.service_class()
+        with patch.object(service, "REVOKED_CERTIFICATES", frozenset({"good"})):
+            result = self._verify(service, "good", self.leaf_key)
+        self.assertEqual(result.status, FirmwareStatus.REVOKED_CERTIFICATE)
+
+
+class TestFirmwareSigning(unittest.TestCase):
+    """Round trips through create_manifest and verify_firmware_update."""
+    
+    firmware_data = b"signed firmware image" * 200
+    
+    def _round_trip(self, private_key, tamper=None):
+        manifest_json = FirmwareVerificationService.create_manifest(
+            firmware_id="fw_signed",
+            version="1.2.0",
+            device_type="tremor_sensor",
+            firmware_data=self.firmware_data,
+            certificate_id="cert_signing",
+            private_key_pem=_private_key_pem(private_key)
+        )
+        if tamper:
+            manifest = json.loads(manifest_json)
+            manifest.update(tamper)
+            manifest_json = json.dumps(manifest)
+        service = FirmwareVerificationService(_public_key_pem(private_key))
+        return service.verify_firmware_update(manifest_json, self.firmware_data, "1.0.0", "tremor_sensor")
+    
+    def test_rsa_round_trip(self):
+        result = self._round_trip(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+        self.assertEqual(result.status, FirmwareStatus.VALID, result.message)
+        self.assertEqual(result.manifest.sig_alg, "rsa-pss-sha256")
+    
+    def test_ec_round_trip(self):
+        result = self._round_trip(ec.generate_private_key(ec.SECP384R1()))
+        self.assertEqual(result.status, FirmwareStatus.VALID, result.message)
+        self.assertEqual(result.manifest.sig_alg, "ecdsa-p384-sha256")
+    
+    def test_ed25519_round_trip(self):
+        result = self._round_trip(ed25519.Ed25519PrivateKey.generate())
+        self.assertEqual(result.status, FirmwareStatus.VALID, result.message)
+        self.assertEqual(result.manifest.sig_alg, "ed25519")
+    
+    def test_rsa_manifest_with_mismatched_sig_alg(self):
+        """A declared sig_alg can't steer an RSA-signed manifest to another scheme"""
+        result = self._round_trip(
+            rsa.generate_private_key(public_exponent=65537, key_size=2048),
+            tamper={"sig_alg": "ed25519"}
+        )
+        self.assertEqual(result.status, FirmwareStatus.INVALID_SIGNATURE)
+    
+    def test_tampered_manifest(self):
+        result = self._round_trip(ed25519.Ed25519PrivateKey.generate(), tamper={"critical_update": True})
+        self.assertEqual(result.status, FirmwareStatus.INVALID_SIGNATURE)
+
+
+class TestFirmwareHashing(unittest.TestCase):
+    """Hashing inputs, and the checks that run before any hashing."""
+    
+    firmware_data = b"hashed firmware image" * 5000  # spans several HASH_CHUNK_SIZE reads
+    
+    def setUp(self):
+        self.private_key = ed25519.Ed25519PrivateKey.generate()
+        self.manifest_json = FirmwareVerificationService.create_manifest(
+            firmware_id="fw_hash",
+            version="1.2.0",
+            device_type="tremor_sensor",
+            firmware_data=self.firmware_data,
+            certificate_id="cert_hash",
+            private_key_pem=_private_key_pem(self.private_key)
+        )
+        self.service = FirmwareVerificationService(_public_key_pem(self.private_key))
+        self.expected = (hashlib.sha256(self.firmware_data).digest(), len(self.firmware_data))
+    
+    def _write_firmware(self, data):
+        handle = tempfile.NamedTemporaryFile(delete=False)
+        self.addCleanup(os.unlink, handle.name)
+        with handle:
+            handle.write(data)
+        return handle.name
+    
+    def test_oversized_payload_rejected_before_hashing(self):
+        with patch.object(firmware_module, "_sha256_and_size") as hash_firmware:
+            result = self.service.verify_firmware_update(
+                self.manifest_json, self.firmware_data + b"extra", "1.0.0", "tremor_sensor"
+            )
+        self.assertEqual(result.status, FirmwareStatus.INVALID_HASH)
+        self.assertIn("Size mismatch", result.message)
+        hash_firmware.assert_not_called()
+    
+    def test_wrongly_signed_manifest_rejected_before_hashing(self):
+        other_key = ed25519.Ed25519PrivateKey.generate()
+        service = FirmwareVerificationService(_public_key_pem(other_key))
+        with patch.object(firmware_module, "_sha256_and_size") as hash_firmware:
+            result = service.verify_firmware_update(
+                self.manifest_json, self.firmware_data, "1.0.0", "tremor_sensor"
+            )
+        self.assertEqual(result.status, FirmwareStatus.INVALID_SIGNATURE)
+        hash_firmware.assert_not_called()
+    
+    def test_hash_stream(self):
+        self.assertEqual(firmware_module._sha256_and_size(io.BytesIO(self.firmware_data)), self.expected)
+    
+    def test_hash_path(self):
+        path = self._write_firmware(self.firmware_data)
+        self.assertEqual(firmware_module._sha256_and_size(path), self.expected)
+    
+    def test_hash_path_without_file_digest(self):
+        """Interpreters before 3.11 hash files through mmap"""
+        path = self._write_firmware(self.firmware_data)
+        legacy_hashlib = types.SimpleNamespace(sha256=hashlib.sha256)
+        with patch.object(firmware_module, "hashlib", legacy_hashlib):
+            self.assertEqual(firmware_module._sha256_and_size(path), self.expected)
+            self.assertEqual(firmware_module._sha256_and_size(self._write_firmware(b"")),
+                             (hashlib.sha256(b"").digest(), 0))
+    
+    def test_verify_stream_and_path(self):
+        for source in (io.BytesIO(self.firmware_data), self._write_firmware(self.firmware_data)):
+            result = self.service.verify_firmware_update(self.manifest_json, source, "1.0.0", "tremor_sensor")
+            self.assertEqual(result.status, FirmwareStatus.VALID, result.message)
+
+
+class TestFirmwareBatch(unittest.TestCase):
+    """Test cases for verify_firmware_batch."""
+    
+    def setUp(self):
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        self.service = FirmwareVerificationService(_public_key_pem(private_key))
+        self.firmware_data = b"batch firmware image" * 100
+        self.manifest_json = FirmwareVerificationService.create_manifest(
+            firmware_id="fw_batch",
+            version="1.2.0",
+            device_type="tremor_sensor",
+            firmware_data=self.firmware_data,
+            certificate_id="cert_batch",
+            private_key_pem=_private_key_pem(private_key)
+        )
+    
+    def _request(self, current_version="1.0.0", **overrides):
+        request = {
+            "manifest_json": self.manifest_json,
+            "firmware_data": self.firmware_data,
+            "current_version": current_version,
+            "device_type": "tremor_sensor",
+        }
+        request.update(overrides)
+        return request
+    
+    def test_results_follow_request_order(self):
+        requests = [self._request("1.3.0" if i % 3 == 0 else "1.0.0") for i in range(24)]
+        requests[5] = self._request(manifest_json="{}")
+        
+        statuses = [r.status for r in verify_firmware_batch(requests, self.service)]
+        
+        expected = [FirmwareStatus.VERSION_ROLLBACK if i % 3 == 0 else FirmwareStatus.VALID for i in range(24)]
+        expected[5] = FirmwareStatus.INVALID_MANIFEST
+        self.assertEqual(statuses, expected)
+    
+    def test_failing_entry_does_not_affect_others(self):
+        """An entry that raises gets its own error result; the rest still verify"""
+        requests = [self._request() for _ in range(6)]
+        del requests[2]["device_type"]
+        requests[4]["unexpected"] = True
+        
+        results = verify_firmware_batch(requests, self.service)
+        
+        self.assertEqual(len(results), 6)
+        for i, result in enumerate(results):
+            expected = FirmwareStatus.UNKNOWN_ERROR if i in (2, 4) else FirmwareStatus.VALID
+            self.assertEqual(result.status, expected, f"entry {i}: {result.message}")
+    
+    def test_single_failing_entry(self):
+        results = verify_firmware_batch([{"manifest_json": self.manifest_json}], self.service)
+        self.assertEqual([r.status for r in results], [FirmwareStatus.UNKNOWN_ERROR])
+
+
 class TestPasswordValidator(unittest.TestCase):
     """Test cases for password validation."""
     
@@ -513,6 +807,188 @@ class TestAuditService(unittest.TestCase):
         )
 
 
+class TestTokenService(unittest.TestCase):
+    """Test cases for HS256 JWT issuance and verification."""
+    
+    def test_issue_and_verify_access_token(self):
+        """Test that an issued access token round-trips its claims."""
+        tokens = issue_tokens("usr_123", "doctor")
+        claims = verify_jwt(tokens["accessJwt"])
+        
+        self.assertEqual(claims["sub"], "usr_123")
+        self.assertEqual(claims["role"], "doctor")
+        self.assertGreater(claims["exp"], int(time.time()))
+    
+    def test_token_header_is_standard_hs256(self):
+        """Test that tokens carry a standard HS256 JWT header."""
+        token = _jwt_encode_hs256({"sub": "usr_123"})
+        header_b64 = token.split(".")[0]
+        header = json.loads(base64.urlsafe_b64decode(header_b64 + "=" * (-len(header_b64) % 4)))
+        
+        self.assertEqual(header, {"alg": "HS256", "typ": "JWT"})
+    
+    def test_expired_token_rejected(self):
+        """Test that a token past its exp is rejected as expired."""
+        token = _jwt_encode_hs256({"sub": "usr_123", "exp": int(time.time()) - 1})
+        
+        with self.assertRaises(TokenExpiredError):
+            _jwt_decode_hs256(token)
+    
+    def test_tampered_token_rejected(self):
+        """Test that modifying the payload invalidates the signature."""
+        token = _jwt_encode_hs256({"sub": "usr_123", "role": "patient"})
+        header, _, signature = token.split(".")
+        forged_payload = base64.urlsafe_b64encode(
+            json.dumps({"sub": "usr_123", "role": "admin"}).encode()
+        ).rstrip(b"=").decode()
+        
+        with self.assertRaises(TokenError):
+            _jwt_decode_hs256(f"{header}.{forged_payload}.{signature}")
+    
+    def test_unsigned_token_rejected(self):
+        """Test that alg=none tokens are rejected."""
+        header = base64.urlsafe_b64encode(b'{"alg":"none","typ":"JWT"}').rstrip(b"=").decode()
+        payload = base64.urlsafe_b64encode(b'{"sub":"usr_123"}').rstrip(b"=").decode()
+        
+        with self.assertRaises(TokenError):
+            _jwt_decode_hs256(f"{header}.{payload}.")
+    
+    def test_malformed_token_returns_401(self):
+        """Test that garbage bearer tokens map to a 401."""
+        with self.assertRaises(HTTPException) as ctx:
+            verify_jwt("not-a-jwt")
+        self.assertEqual(ctx.exception.status_code, 401)
+    
+    def test_temp_token_scope(self):
+        """Test that MFA temp tokens verify with the mfa_pending scope."""
+        claims = verify_temp_token(issue_temp_token("usr_123", "patient"))
+        self.assertEqual(claims["scope"], "mfa_pending")
+        
+        # A regular access token must not be accepted as an MFA temp token
+        with self.assertRaises(HTTPException):
+            verify_temp_token(issue_tokens("usr_123", "patient")["accessJwt"])
+
+
+class TestJwtCache(unittest.TestCase):
+    """Test cases for the verified-claims cache in verify_jwt."""
+    
+    def setUp(self):
+        auth_module._jwt_cache.clear()
+        self.addCleanup(auth_module._jwt_cache.clear)
+    
+    def _token(self, sub="usr_123", exp_in=3600):
+        return _jwt_encode_hs256({"sub": sub, "exp": int(time.time()) + exp_in})
+    
+    def _cached_until(self, token):
+        key = auth_module.hashlib.blake2b(token.encode(), digest_size=16).digest()
+        return auth_module._jwt_cache[key][1]
+    
+    def test_cache_window_is_capped_at_ttl(self):
+        now = int(time.time())
+        token = self._token(exp_in=3600)
+        verify_jwt(token)
+        self.assertLessEqual(self._cached_until(token), now + auth_module.JWT_CACHE_TTL_SECONDS + 1)
+    
+    def test_cache_window_never_outlives_exp(self):
+        token = self._token(exp_in=10)
+        verify_jwt(token)
+        self.assertEqual(self._cached_until(token), _jwt_decode_hs256(token)["exp"])
+    
+    def test_hit_skips_decode_until_window_ends(self):
+        token = self._token()
+        verify_jwt(token)
+        with patch.object(auth_module, "_jwt_decode_hs256", wraps=_jwt_decode_hs256) as decode:
+            verify_jwt(token)
+            decode.assert_not_called()
+            later = time.time() + auth_module.JWT_CACHE_TTL_SECONDS + 1
+            with patch.object(auth_module.time, "time", return_value=later):
+                verify_jwt(token)
+            decode.assert_called_once()
+    
+    def test_invalid_tokens_are_not_cached(self):
+        expired = self._token(exp_in=-1)
+        for token in ("not-a-jwt", expired, self._token()[:-2] + "xx"):
+            with self.assertRaises(HTTPException):
+                verify_jwt(token)
+        self.assertEqual(len(auth_module._jwt_cache), 0)
+    
+    def test_eviction_drops_least_recently_used(self):
+        """A token still in use survives a stream of other tokens"""
+        active = self._token("usr_active")
+        with patch.object(auth_module, "JWT_CACHE_MAX_ENTRIES", 2):
+            verify_jwt(active)
+            for i in range(5):
+                verify_jwt(self._token(f"usr_{i}"))
+                verify_jwt(active)
+            self.assertEqual(len(auth_module._jwt_cache), 2)
+            with patch.object(auth_module, "_jwt_decode_hs256") as decode:
+                verify_jwt(active)
+                decode.assert_not_called()
+
+
+@unittest.skipIf(TestClient is None, "httpx is not installed")
+class TestAuthMiddleware(unittest.TestCase):
+    """Test cases for the bearer-token ASGI middleware."""
+    
+    @classmethod
+    def setUpClass(cls):
+        app = FastAPI()
+        app.add_middleware(AuthMiddleware)
+        
+        @app.get("/api/v1/me")
+        def me(request: Request):
+            return request.state.claims
+        
+        @app.post("/api/v1/auth/login")
+        def login():
+            return {"open": True}
+        
+        @app.options("/api/v1/me")
+        def preflight():
+            return {"preflight": True}
+        
+        cls.client = TestClient(app)
+    
+    def test_open_path_needs_no_token(self):
+        response = self.client.post("/api/v1/auth/login")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"open": True})
+    
+    def test_open_suffix_only_matches_whole_segment(self):
+        """An open suffix must match whole path segments"""
+        response = self.client.post("/api/v1/auth/xlogin")
+        self.assertEqual(response.status_code, 401)
+    
+    def test_missing_token_returns_401_json(self):
+        response = self.client.get("/api/v1/me")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"code": "AUTH_REQUIRED", "message": "missing bearer token"})
+    
+    def test_non_bearer_authorization_returns_401(self):
+        response = self.client.get("/api/v1/me", headers={"Authorization": "Basic dXNlcjpwYXNz"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["code"], "AUTH_REQUIRED")
+    
+    def test_bad_token_returns_verify_error(self):
+        response = self.client.get("/api/v1/me", headers={"Authorization": "Bearer not-a-jwt"})
+        self.assertEqual(response.status_code, 401)
+        with self.assertRaises(HTTPException) as ctx:
+            verify_jwt("not-a-jwt")
+        self.assertEqual(response.json(), ctx.exception.detail)
+    
+    def test_options_bypasses_auth(self):
+        response = self.client.options("/api/v1/me")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"preflight": True})
+    
+    def test_claims_reach_request_state(self):
+        token = issue_tokens("usr_123", "doctor")["accessJwt"]
+        response = self.client.get("/api/v1/me", headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["sub"], "usr_123")
+        self.assertEqual(response.json()["role"], "doctor")
+
+
 class TestSecurityIntegration(unittest.TestCase):
     """Integration tests for security features."""
     
@@ -49,6 +49,28 @@ if ($LASTEXITCODE -eq 0) {
     Write-Host ""
     Write-Host "✅ Deployment successful!" -ForegroundColor Green
     Write-Host ""
+    # Publish this build's email bodies as SES templates; sends fall back to
+    # full-body emails until they exist, so a failure here is not fatal
+    Write-Host "📧 Syncing SES email templates..." -ForegroundColor Cyan
+    python backend-py/email_service.py sync-templates
+    if ($LASTEXITCODE -ne 0) {
+        Write-Host "⚠️  SES template sync failed; emails will be sent with full bodies" -ForegroundColor Yellow
+    }
+    Write-Host ""
+    # Give older conversations the pointer rows participantRecent-index needs;
+    # listings only switch to the index once deployed with
+    # ConversationRecentIndex=ready. Safe to re-run on every deploy.
+    Write-Host "💬 Backfilling conversation pointers..." -ForegroundColor Cyan
+    $backfillOut = Join-Path $env:TEMP "medusa-backfill.json"
+    $invoke = aws lambda invoke --function-name medusa-api-v3 --cli-binary-format raw-in-base64-out `
+        --payload '{"task":"backfill-conversation-pointers"}' $backfillOut | ConvertFrom-Json
+    if ($LASTEXITCODE -ne 0 -or $invoke.FunctionError) {
+        Write-Host "⚠️  Conversation backfill failed; keep ConversationRecentIndex=building and re-run" -ForegroundColor Yellow
+    } else {
+        Write-Host "✅ Conversation backfill: $(Get-Content $backfillOut -Raw)" -ForegroundColor Green
+        Write-Host "   Deploy with --parameter-overrides ConversationRecentIndex=ready to list by recent activity" -ForegroundColor Gray
+    }
+    Write-Host ""
     Write-Host "📝 Next steps:" -ForegroundColor Cyan
     Write-Host "  1. Copy the API Gateway URL from the output above" -ForegroundColor Yellow
     Write-Host "  2. Update Flutter app's network_service.dart with the new API URL" -ForegroundColor Yellow